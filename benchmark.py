@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+"""
+author: Rafal Miecznik
+contact: ravmiecznk@gmail.com
+
+Micro-benchmarks of protocol hot paths, no Qt or serial device required:
+    python benchmark.py                                     # print results
+    python benchmark.py -o baseline.json                    # save results
+    python benchmark.py --baseline baseline.json -o new.json --threshold 0.2
+    python benchmark.py --filter crc
+    python benchmark.py --replay REFLASHER_CAPTURE/_dev_ttyUSB0.cap      # recorded rx stream as decoder input
+
+In comparison mode each benchmark slower than baseline by more than threshold is reported as regression
+and exit code is 1.
+Best of repeated runs is compared, it is least sensitive to machine noise.
+"""
+
+import os
+import sys
+import json
+import time
+import timeit
+import argparse
+import platform
+import contextlib
+
+EXIT_OK = 0
+EXIT_REGRESSION = 1
+
+DEFAULT_REPEAT = 5
+DEFAULT_THRESHOLD = 0.2
+HEX_RECORD_LEN = 16
+
+
+def intel_hex_lines(image, record_len=HEX_RECORD_LEN):
+    """
+    :return: list of intel hex lines of image placed at address 0
+    """
+    lines = []
+    for offset in range(0, len(image), record_len):
+        if offset and offset % 0x10000 == 0:
+            record = bytes([2, 0, 0, 4]) + (offset >> 16).to_bytes(2, 'big')
+            lines.append(':{}{:02X}'.format(record.hex().upper(), -sum(record) & 0xff))
+        data = image[offset:offset + record_len]
+        record = bytes([len(data)]) + (offset & 0xffff).to_bytes(2, 'big') + b'\x00' + data
+        lines.append(':{}{:02X}'.format(record.hex().upper(), -sum(record) & 0xff))
+    lines.append(':00000001FF')
+    return lines
+
+
+def bench_intel_hex_parser(size):
+    from intel_hex_handler import intel_hex_parser
+    lines = intel_hex_lines(os.urandom(size))
+    return lambda: intel_hex_parser(lines)
+
+
+def bench_crc_bytes():
+    from message_handler.crc import crc_bytes
+    page = os.urandom(2050)
+    return lambda: crc_bytes(page)
+
+
+def bench_create_message():
+    from message_handler import MessageSender
+    from message_handler.message_handler import create_message
+    page = os.urandom(2050)
+    return lambda: create_message(MessageSender.ID.write_to_page, page, context=100)
+
+
+def bench_message_batch(builder, count=10000, body_len=64):
+    # count messages in one run: run time below 1 s means more than count messages per second
+    from message_handler.message_handler import create_message
+    from message_handler.codec import pack_message_into, message_size
+    body = os.urandom(body_len)
+    if builder == "create_message":
+        return lambda: [create_message(1, body, context=i & 0x7fff) for i in range(count)]
+    buffer = bytearray(message_size(body_len)*count)
+
+    def run():
+        offset = 0
+        for i in range(count):
+            offset = pack_message_into(buffer, offset, 1, body, i & 0x7fff)
+    return run
+
+
+def bench_decode_tail(count=10000):
+    from message_handler.codec import pack_tail, decode_tail
+    tail = memoryview(pack_tail(0, 100, b''))
+    return lambda: [decode_tail(tail) for _ in range(count)]
+
+
+def bench_rx_message():
+    from message_handler import RxMessage
+    return lambda: RxMessage(msg_id=RxMessage.RxId.ack, context=100, crc_check=RxMessage.RxId.ack, body=b'',
+                             length=0)
+
+
+def bench_background_call(persistent):
+    # rx data handling started from reader thread: thread per call (as GuiThread did) vs persistent Worker
+    import threading
+    from worker_pool import Worker
+    job = lambda: None
+    if persistent:
+        worker = Worker(job)
+        return lambda: worker.start().get_result()
+
+    def run():
+        thread = threading.Thread(target=job)
+        thread.start()
+        thread.join()
+    return run
+
+
+def bench_send_message(performance_mode, preframed=False):
+    # per packet cost of MessageSender.send including its debug logging,
+    # preframed: page message taken from PageFrames, only context is set at send time
+    from loggers import set_performance_mode, performance_mode_enabled
+    from message_handler import MessageSender
+    from message_handler.message_handler import ContextAllocator
+    from flash_session.flash_session import PageFrames
+    sender = MessageSender(tx_interface=lambda msg: None, context_allocator=ContextAllocator())
+    page = os.urandom(2050)
+    frame = PageFrames({0: page[2:]})[0]
+
+    def run():
+        if performance_mode_enabled() != performance_mode:
+            set_performance_mode(performance_mode)
+        if preframed:
+            sender.send_frame(MessageSender.ID.write_to_page, frame)
+        else:
+            sender.send(MessageSender.ID.write_to_page, page)
+    return run
+
+
+def bench_page_frames(size):
+    from flash_session import packetize
+    from flash_session.flash_session import PageFrames
+    packets, crcs = packetize(os.urandom(size))
+    return lambda: PageFrames(packets, crcs)
+
+
+def bench_circ_io_buffer():
+    # receive path pattern: 64 bytes chunks, whole content peeked after each one, message sized reads
+    from circ_io_buffer import CircIoBuffer
+    chunk = os.urandom(64)
+    buff = CircIoBuffer(size=258*10)
+
+    def run():
+        for _ in range(33):
+            buff.write(chunk)
+            buff.peek()
+        buff.read(2060)
+    return run
+
+
+def bench_message_receiver(noise_len):
+    # 10 ack messages, each one preceded by noise, drained as they arrive in 64 bytes chunks
+    from message_handler import MessageReceiver
+    from circ_io_buffer import CircIoBuffer
+    from bootloader_emulator import device_message
+    noise = (b'<>' * noise_len)[:noise_len]
+    stream = b''.join(noise + device_message(0, context, b'') for context in range(2, 12))
+    chunks = [stream[i:i + 64] for i in range(0, len(stream), 64)]
+
+    def run():
+        rx_buffer = CircIoBuffer(size=258*10)
+        receiver = MessageReceiver(rx_buffer)
+        for chunk in chunks:
+            rx_buffer.write(chunk)
+            msg = receiver.get_message()
+            while msg:
+                msg = receiver.get_message()
+    return run
+
+
+def bench_replay(path):
+    # recorded rx stream (wire capture or rx_log) through CircIoBuffer + MessageReceiver
+    from replay import Replay, load_chunks
+    replay = Replay(load_chunks(path))
+    return lambda: replay.run()
+
+
+def bench_packetize(size, skip_blank=False):
+    from flash_session import packetize
+    image = os.urandom(size//2) + b'\xff'*(size - size//2)
+    return lambda: packetize(image, skip_blank=skip_blank)
+
+
+BENCHMARKS = (
+    ("intel_hex_parser 4KB", lambda: bench_intel_hex_parser(4*1024)),
+    ("intel_hex_parser 128KB", lambda: bench_intel_hex_parser(128*1024)),
+    ("crc_bytes 2050B", bench_crc_bytes),
+    ("create_message 2050B", bench_create_message),
+    ("create_message 10k x 64B", lambda: bench_message_batch("create_message")),
+    ("pack_message_into 10k x 64B", lambda: bench_message_batch("pack_message_into")),
+    ("decode_tail 10k", bench_decode_tail),
+    ("RxMessage", bench_rx_message),
+    ("MessageSender.send debug log", lambda: bench_send_message(False)),
+    ("CircIoBuffer write/peek/read", bench_circ_io_buffer),
+    ("MessageReceiver clean stream", lambda: bench_message_receiver(0)),
+    ("MessageReceiver noisy stream", lambda: bench_message_receiver(512)),
+    ("packetize 128KB", lambda: bench_packetize(128*1024)),
+    ("packetize 128KB skip_blank", lambda: bench_packetize(128*1024, skip_blank=True)),
+    ("PageFrames 128KB", lambda: bench_page_frames(128*1024)),
+    ("background call: new thread", lambda: bench_background_call(False)),
+    ("background call: Worker", lambda: bench_background_call(True)),
+    # last ones, performance mode stays enabled
+    ("MessageSender.send performance", lambda: bench_send_message(True)),
+    ("MessageSender.send_frame perf.", lambda: bench_send_message(True, preframed=True)),
+)
+
+
+def measure(func, repeat=DEFAULT_REPEAT, min_time=0.05):
+    """
+    Call func in loops long enough to be measured
+    :return: dict with best and median time of single call [s] and number of calls per loop
+    """
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    number = max(1, int(number*min_time/0.2))
+    times = sorted(t/number for t in timer.repeat(repeat=repeat, number=number))
+    return {"best": times[0], "median": times[len(times)//2], "number": number}
+
+
+def run_benchmarks(name_filter=None, repeat=DEFAULT_REPEAT, out=print, replay=()):
+    """
+    :param replay: paths of recorded rx streams to be benchmarked with replay
+    :return: results dict, ready to be dumped as json
+    """
+    results = {}
+    replay_benchmarks = tuple(("replay " + os.path.basename(path), lambda path=path: bench_replay(path))
+                              for path in replay)
+    for name, setup in replay_benchmarks + BENCHMARKS:
+        if name_filter and name_filter not in name:
+            continue
+        func = setup()
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            results[name] = measure(func, repeat)
+        out("{:32s} {:12.3f} us (median {:.3f} us)".format(name, results[name]["best"]*1e6,
+                                                            results[name]["median"]*1e6))
+    return {
+        "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": results,
+    }
+
+
+def compare(results, baseline, threshold=DEFAULT_THRESHOLD):
+    """
+    :param threshold: allowed slowdown, 0.2 means 20%
+    :return: list of tuples (name, baseline time, new time, ratio) of regressed benchmarks
+    """
+    regressions = []
+    for name, result in results["results"].items():
+        base = baseline["results"].get(name)
+        if base is None:
+            continue
+        ratio = result["best"]/base["best"]
+        if ratio > 1 + threshold:
+            regressions.append((name, base["best"], result["best"], ratio))
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog="benchmark", description="protocol hot paths micro-benchmarks")
+    parser.add_argument("-o", "--output", help="save results as json")
+    parser.add_argument("--baseline", help="json results to compare with")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="allowed slowdown against baseline, 0.2 means 20%%")
+    parser.add_argument("--filter", dest="name_filter", help="run only benchmarks with this text in name")
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT)
+    parser.add_argument("--replay", nargs='+', default=(), help="wire capture or rx_log files to replay")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    results = run_benchmarks(args.name_filter, args.repeat, replay=args.replay)
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=2)
+    if args.baseline:
+        with open(args.baseline) as baseline:
+            regressions = compare(results, json.load(baseline), args.threshold)
+        for name, base, new, ratio in regressions:
+            print("REGRESSION {}: {:.3f} us -> {:.3f} us ({:+.0f}%)".format(name, base*1e6, new*1e6, (ratio - 1)*100))
+        if regressions:
+            return EXIT_REGRESSION
+    return EXIT_OK
+
+
+if __name__ == "__main__":
+    sys.exit(main())
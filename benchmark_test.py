@@ -0,0 +1,38 @@
+"""
+author: Rafal Miecznik
+contact: ravmiecznk@gmail.com
+"""
+
+import os
+import json
+
+import benchmark
+from intel_hex_handler import intel_hex_parser
+
+
+def results(**best):
+    return {"results": {name: {"best": value, "median": value, "number": 1} for name, value in best.items()}}
+
+
+def test_intel_hex_lines():
+    image = os.urandom(0x10000 + 100)
+    assert intel_hex_parser(benchmark.intel_hex_lines(image)) == {0: image[:0x10000], 0x10000: image[0x10000:]}
+
+
+def test_compare():
+    baseline = results(a=1.0, b=1.0, c=1.0)
+    regressions = benchmark.compare(results(a=1.1, b=1.5, c=0.5, new=9.0), baseline, threshold=0.2)
+    assert [(name, ratio) for name, _, _, ratio in regressions] == [('b', 1.5)]
+
+
+def test_main_saves_and_compares(tmpdir):
+    output = str(tmpdir.join('results.json'))
+    assert benchmark.main(['--filter', 'crc_bytes', '--repeat', '1', '-o', output]) == benchmark.EXIT_OK
+    with open(output) as f:
+        saved = json.load(f)
+    assert list(saved["results"]) == ["crc_bytes 2050B"]
+    saved["results"]["crc_bytes 2050B"]["best"] /= 100
+    with open(output, 'w') as f:
+        json.dump(saved, f)
+    assert benchmark.main(['--filter', 'crc_bytes', '--repeat', '1', '--baseline', output]) == \
+        benchmark.EXIT_REGRESSION
@@ -0,0 +1,6 @@
+"""
+author: Rafal Miecznik
+contact: ravmiecznk@gmail.com
+"""
+
+from bootloader_emulator.bootloader_emulator import BootloaderEmulator, device_message
@@ -0,0 +1,292 @@
+"""
+author: Rafal Miecznik
+contact: ravmiecznk@gmail.com
+
+atm128_bootloader_v3 emulator on Linux pseudo terminal.
+Host side opens `emulator.port` like any serial port, emulator reads messages created by create_message:
+ >ID CONTEXT BODY_LEN CRC<MESSAGE_BODY
+  2  2       4        2   ?bytes
+and responds with device messages (see MessageReceiver):
+ MESSAGE_BODY<ID CONTEXT MSG_LEN BODY_CRC>TAIL_CRC
+
+Handled requests:
+    bootloader:         txt message with bootloader signature
+    rxflush:            ack (bytes received before it are already consumed)
+    write_to_page:      page is written to emulated flash memory, ack
+    run_main_app_btl:   ack, app_started flag is set
+    any other:          ack
+Message with body crc error is nacked.
+
+Line conditions can be simulated: baudrate pacing, page write latency, bit errors, dropped bytes and lost acks.
+Lost acks and nacks of given pages and unplugged device can be requested explicitly for repeatable tests.
+"""
+
+import os
+import pty
+import tty
+import time
+import random
+import struct
+import select
+import threading
+
+from loggers import create_logger
+from message_handler import MessageSender, RxMessage
+from message_handler.message_handler import MAX_PACKET_SIZE
+from message_handler.crc import crc16_xmodem
+from message_handler.codec import pack_tail, MESSAGE_HEADER, HEADER_END
+from config import LOG_PATH
+
+
+log_format = '[%(asctime)s]: %(levelname)s method:"%(funcName)s" %(message)s'
+e_logger = create_logger("bootloader_emulator", log_path=LOG_PATH, format=log_format)
+
+BOOTLOADER_SIGNATURE = b'bootloader3'
+FLASH_SIZE = 128*1024
+PAGE_SIZE = 256*8
+HEADER_LEN = MESSAGE_HEADER.size
+BITS_PER_BYTE = 10      # start + 8 data + stop bits
+
+
+def device_message(m_id, context, body=b''):
+    """
+    Create message as it is sent by device: body first, tail with its crc in the end
+    """
+    return body + pack_tail(m_id, context, body)
+
+
+class BootloaderEmulator(threading.Thread):
+    """
+        with BootloaderEmulator(page_write_latency=0.01) as device:
+            with FlashSession(port=device.port) as session:
+                ...
+            device.image(len(image)) == image
+    """
+    def __init__(self, baudrate=None, page_write_latency=0, bit_error_rate=0, drop_rate=0, ack_loss_rate=0,
+                 page_size=PAGE_SIZE, flash_size=FLASH_SIZE, seed=None, lost_ack_pages=(), nack_pages=(),
+                 unplug_after=None):
+        """
+        :param baudrate: line speed to emulate in both directions, no pacing if None
+        :param page_write_latency: time of single page write in seconds
+        :param bit_error_rate: probability of single bit flip in each transferred byte, both directions
+        :param drop_rate: probability of each received byte being lost
+        :param ack_loss_rate: probability that write_to_page response is lost (page is still written)
+        :param page_size: write_to_page page size, page index * page_size is its flash address
+        :param seed: random seed, for repeatable line errors
+        :param lost_ack_pages: page indexes whose first write_to_page ack is lost (page is still written)
+        :param nack_pages: page indexes whose first write_to_page is nacked (page is not written)
+        :param unplug_after: request id, device is unplugged right after it is answered, see unplug
+        """
+        threading.Thread.__init__(self, daemon=True)
+        self.baudrate = baudrate
+        self.page_write_latency = page_write_latency
+        self.bit_error_rate = bit_error_rate
+        self.drop_rate = drop_rate
+        self.ack_loss_rate = ack_loss_rate
+        self.page_size = page_size
+        self.lost_ack_pages = set(lost_ack_pages)
+        self.nack_pages = set(nack_pages)
+        self.unplug_after = unplug_after
+        self.memory = bytearray(b'\xff'*flash_size)
+        self.page_writes = {}               # page index -> number of writes
+        self.app_started = False
+        self.requests = []                  # (id, context) of each handled request
+        self.messages = 0
+        self.nacks = 0
+        self.flipped_bits = 0
+        self.dropped_bytes = 0
+        self.lost_acks = 0
+        self.__random = random.Random(seed)
+        self.__rx_line = self.__tx_line = 0
+        self.__rx_buffer = bytearray()
+        self.__stop = threading.Event()
+        self.__unplug = threading.Event()
+        self.__master, self.__slave = pty.openpty()
+        tty.setraw(self.__slave)
+        self.port = os.ttyname(self.__slave)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        self.__stop.set()
+        if self.is_alive():
+            self.join()
+        for fd in (self.__master, self.__slave):
+            if fd is None:
+                continue
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+        self.__master = self.__slave = None
+
+    def unplug(self):
+        """
+        Disconnect device: master side of pseudo terminal is closed, host side I/O fails as on unplugged USB
+        """
+        self.__unplug.set()
+        if not self.is_alive():
+            self.__hang_up()
+
+    def __hang_up(self):
+        if self.__master is not None:
+            os.close(self.__master)
+            self.__master = None
+
+    def image(self, length, address=0):
+        """
+        :return: flash memory content
+        """
+        return bytes(self.memory[address:address + length])
+
+    def __pace(self, line_free, num_of_bytes):
+        """
+        Sleep for time which num_of_bytes take on the line
+        :return: time when line is free again
+        """
+        if not self.baudrate:
+            return 0
+        now = time.time()
+        line_free = max(line_free, now) + num_of_bytes*BITS_PER_BYTE/float(self.baudrate)
+        time.sleep(line_free - now)
+        return line_free
+
+    def __line_errors(self, data):
+        """
+        Apply dropped bytes (when drop_rate is given) and bit errors to data
+        """
+        if not (self.bit_error_rate or self.drop_rate):
+            return data
+        result = bytearray()
+        for byte in data:
+            if self.drop_rate and self.__random.random() < self.drop_rate:
+                self.dropped_bytes += 1
+                continue
+            if self.bit_error_rate and self.__random.random() < self.bit_error_rate:
+                byte ^= 1 << self.__random.randrange(8)
+                self.flipped_bits += 1
+            result.append(byte)
+        return result
+
+    def send(self, m_id, context, body=b''):
+        data = self.__line_errors(device_message(m_id, context, body))
+        self.__tx_line = self.__pace(self.__tx_line, len(data))
+        view = memoryview(data)
+        while view:
+            view = view[os.write(self.__master, view):]
+
+    def run(self):
+        while not self.__stop.is_set():
+            if self.__unplug.is_set():
+                self.__hang_up()
+                return
+            if not select.select([self.__master], [], [], 0.05)[0]:
+                continue
+            try:
+                data = os.read(self.__master, 4096)
+            except OSError:
+                return
+            self.__rx_line = self.__pace(self.__rx_line, len(data))
+            self.__rx_buffer += self.__line_errors(data)
+            self.process_rx_buffer()
+
+    def process_rx_buffer(self):
+        """
+        Extract and handle all complete messages, garbage before message start mark is dropped
+        """
+        buff = self.__rx_buffer
+        while not self.__unplug.is_set():
+            start = buff.find(b'>')
+            if start < 0:
+                del buff[:]
+                return
+            if len(buff) < start + HEADER_LEN:
+                del buff[:start]
+                return
+            _, m_id, context, body_len, crc, header_end = MESSAGE_HEADER.unpack_from(buff, start)
+            if header_end != HEADER_END or body_len > MAX_PACKET_SIZE:
+                e_logger.debug("corrupted header at %s", start)
+                del buff[:start + 1]
+                continue
+            end = start + HEADER_LEN + body_len
+            if len(buff) < end:
+                del buff[:start]
+                return
+            body = bytes(buff[start + HEADER_LEN:end])
+            del buff[:end]
+            self.messages += 1
+            if crc != crc16_xmodem(body):
+                e_logger.debug("crc error, id: %s, context: %s", m_id, context)
+                self.nacks += 1
+                self.send(RxMessage.RxId.nack, context)
+            else:
+                self.handle(m_id, context, body)
+
+    def handle(self, m_id, context, body):
+        self.requests.append((m_id, context))
+        self.respond(m_id, context, body)
+        if m_id == self.unplug_after:
+            self.unplug()
+
+    def respond(self, m_id, context, body):
+        if m_id == MessageSender.ID.bootloader:
+            self.send(RxMessage.RxId.txt, context, BOOTLOADER_SIGNATURE)
+            return
+        if m_id == MessageSender.ID.write_to_page:
+            page_index = struct.unpack_from('H', body)[0]
+            if page_index in self.nack_pages:
+                self.nack_pages.remove(page_index)
+                self.nacks += 1
+                self.send(RxMessage.RxId.nack, context)
+                return
+            address = page_index*self.page_size
+            self.memory[address:address + len(body) - 2] = body[2:]
+            self.page_writes[page_index] = self.page_writes.get(page_index, 0) + 1
+            if self.page_write_latency:
+                time.sleep(self.page_write_latency)
+            ack_lost = page_index in self.lost_ack_pages or \
+                (self.ack_loss_rate and self.__random.random() < self.ack_loss_rate)
+            if ack_lost:
+                self.lost_ack_pages.discard(page_index)
+                self.lost_acks += 1
+                return
+        elif m_id == MessageSender.ID.run_main_app_btl:
+            self.app_started = True
+        self.send(RxMessage.RxId.ack, context)
+
+    def __repr__(self):
+        return "{}({}, messages: {}, pages: {}, nacks: {}, flipped bits: {}, dropped bytes: {}, lost acks: {})".format(
+            type(self).__name__, self.port, self.messages, len(self.page_writes), self.nacks, self.flipped_bits,
+            self.dropped_bytes, self.lost_acks)
+
+
+if __name__ == "__main__":
+    # serve emulated device until ctrl+c:
+    #   python -m bootloader_emulator.bootloader_emulator --page-write-latency 0.01
+    #   python reflash.py --port <printed port> --hex app.hex
+    import argparse
+
+    parser = argparse.ArgumentParser(description="atm128 bootloader v3 emulator on pseudo terminal")
+    parser.add_argument("--baudrate", type=int, default=None)
+    parser.add_argument("--page-write-latency", type=float, default=0)
+    parser.add_argument("--bit-error-rate", type=float, default=0)
+    parser.add_argument("--drop-rate", type=float, default=0)
+    parser.add_argument("--ack-loss-rate", type=float, default=0)
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    with BootloaderEmulator(baudrate=args.baudrate, page_write_latency=args.page_write_latency,
+                            bit_error_rate=args.bit_error_rate, drop_rate=args.drop_rate,
+                            ack_loss_rate=args.ack_loss_rate, seed=args.seed) as emulator:
+        print(emulator.port, flush=True)
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
+        print(emulator)
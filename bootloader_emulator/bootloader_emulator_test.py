@@ -0,0 +1,80 @@
+"""
+author: Rafal Miecznik
+contact: ravmiecznk@gmail.com
+"""
+
+import os
+import json
+import time
+
+from bootloader_emulator import BootloaderEmulator
+from image_cache import CachedImage
+from message_handler.crc import page_crcs
+from flash_session import FlashSession, PACKET_SIZE
+from flash_session.flash_session import packet_index_prefix
+
+
+def random_image(size):
+    image = os.urandom(size)
+    return CachedImage(image, PACKET_SIZE, page_crcs(image, PACKET_SIZE, page_prefix=packet_index_prefix))
+
+
+def flash(device, image, **session_kwargs):
+    with FlashSession(port=device.port, **session_kwargs) as session:
+        session.enable_bootloader()
+        result = session.flash(image, timeout=20)
+        time.sleep(0.05)      # run_main_app_btl ack
+        return result, session.transmitter
+
+
+def test_image_lands_byte_exact():
+    image = random_image(PACKET_SIZE*5 + 100)
+    with BootloaderEmulator() as device:
+        result, transmitter = flash(device, image, window=3)
+        assert result
+        assert device.image(len(image.image)) == bytes(image.image)
+        assert device.app_started
+        assert transmitter.nacks == transmitter.timeouts == 0
+
+
+def test_lossy_line():
+    image = random_image(PACKET_SIZE*6)
+    with BootloaderEmulator(bit_error_rate=1e-4, drop_rate=1e-4, ack_loss_rate=0.2, seed=3) as device:
+        result, transmitter = flash(device, image, window=2, rxtimeout=0.2)
+        assert result
+        assert device.image(len(image.image)) == bytes(image.image)
+        assert device.lost_acks and transmitter.timeouts
+
+
+def test_baudrate_pacing():
+    image = random_image(PACKET_SIZE*2)
+    with BootloaderEmulator(baudrate=115200, page_write_latency=0.01) as device:
+        result, transmitter = flash(device, image)
+        assert result
+        assert transmitter.elapsed > len(image.image)*10/115200.0
+        assert transmitter.bytes_per_second() < 11520
+
+
+def test_stats_files(tmpdir):
+    image = random_image(PACKET_SIZE*3)
+    with BootloaderEmulator() as device:
+        result, transmitter = flash(device, image, stats_dir=str(tmpdir), prometheus_dir=str(tmpdir))
+        assert result
+    name = device.port.replace('/', '_')
+    with open(str(tmpdir.join(name + '.json'))) as f:
+        stats = json.load(f)
+    assert stats["acks"] == 3 and stats["latency"]["count"] == 3
+    assert 'reflasher_acks_total{{port="{}"}} 3'.format(device.port) in tmpdir.join('reflasher_' + name + '.prom').read()
+
+
+def test_wire_capture(tmpdir):
+    from wire_capture import read_capture, RX, TX
+    image = random_image(PACKET_SIZE*2)
+    with BootloaderEmulator() as device:
+        result, transmitter = flash(device, image, capture_dir=str(tmpdir))
+        assert result
+    records = list(read_capture(str(tmpdir.join(device.port.replace('/', '_') + '.cap'))))
+    tx = b''.join(r.data for r in records if r.direction == TX)
+    rx = b''.join(r.data for r in records if r.direction == RX)
+    assert bytes(image.image[:PACKET_SIZE]) in tx
+    assert b'bootloader3' in rx
@@ -3,4 +3,5 @@ author: Rafal Miecznik
 contact: ravmiecznk@gmail.com
 """
 
-from circ_io_buffer.circ_io_buffer import CircIoBuffer
\ No newline at end of file
+from circ_io_buffer.circ_io_buffer import CircIoBuffer
+from circ_io_buffer.ring_buffer import RingBuffer
@@ -6,11 +6,80 @@ contact: ravmiecznk@gmail.com
 
 #import pytest
 #import pytest_mccabe
-from io import BytesIO
+from io import BytesIO, IOBase
+from circ_io_buffer.ring_buffer import RingBuffer
 #from call_tracker import method_call_track
 
-#@shallow_track_class_calls
-class CircIoBuffer(BytesIO):
+
+class CircIoBuffer(RingBuffer, IOBase):
+    """
+    CircIoBuffer API on top of zero-copy RingBuffer.
+    Content is never moved, peek/read return copies, use views/find/consume/readinto to avoid copying.
+    """
+    def __init__(self, initial_buffer=bytearray(), size=1024):
+        IOBase.__init__(self)
+        self.__write_locked = False
+        RingBuffer.__init__(self, size=size, initial_buffer=initial_buffer)
+
+    def lock_write(self):
+        self.__write_locked = True
+
+    def unlock_write(self):
+        self.__write_locked = False
+
+    def write(self, bytes):
+        if not self.__write_locked:
+            RingBuffer.write(self, bytes)
+            return True
+        else:
+            return False
+
+    def writelines(self, sequence_of_strings=''):
+        raise NotImplementedError
+
+    def tell(self):
+        return self._tail
+
+    def readable(self):
+        return True
+
+    def writable(self):
+        return True
+
+    def flush(self):
+        self.clear()
+
+    def flush_until(self, sequence=b''):
+        """
+        Drop content until end of sequence, whole content is dropped if sequence is not present
+        """
+        pos = self.find(sequence)
+        self.consume(pos + len(sequence) if pos >= 0 else self._available)
+
+    def show(self):
+        content = self.peek().decode('latin-1')
+        content += ' '*(self._limit - len(content))
+        main = '|{}|'.format('|'.join(list(content)))
+        top = ' '*(len(main))
+        bottom = top
+        top = insert_str(top, 'H', self._head)
+        bottom = insert_str(bottom, 'T', self._tail)
+        output = '{} <-{}\n'.format(top, self._head)
+        output += '{}  {}\n'.format(main, self._available)
+        output += '{} <-{}'.format(bottom, self._tail)
+        return output
+
+    def __str__(self):
+        return self.peek().decode('latin-1')
+
+    def __contains__(self, item):
+        return RingBuffer.__contains__(self, item)
+
+
+class BytesIoCircBuffer(BytesIO):
+    """
+    Previous BytesIO based implementation, kept as benchmark reference (see ring_buffer.py)
+    """
     def __init__(self, initial_buffer=bytearray(), size=1024):
         initial_buffer = initial_buffer[-size:]
         bytes_len = len(initial_buffer)
@@ -109,7 +178,7 @@ class CircIoBuffer(BytesIO):
         self.__init__(initial_buffer='', size=self._limit)
 
     def flush_until(self, sequence=''):
-        cb = CircIoBuffer(size=len(sequence))
+        cb = BytesIoCircBuffer(size=len(sequence))
         while sequence not in cb:
             char = self.read(1)
             if char == '':
@@ -146,9 +215,9 @@ def insert_str(string, substring, pos):
 
 if __name__ == "__main__":
     cb = CircIoBuffer(size=10)
-    cb.write('rafal')
-    cb.write('rafal')
-    for i in '123456':
-        cb.write(i)
+    cb.write(b'rafal')
+    cb.write(b'rafal')
+    for i in b'123456':
+        cb.write(bytes([i]))
         print(cb.peek())
 
@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+"""
+author: Rafal Miecznik
+contact: ravmiecznk@gmail.com
+
+Zero-copy circular buffer built on preallocated bytearray.
+Buffered content is exposed as memoryview windows: one segment, or two when content wraps around buffer end.
+When buffer is full, oldest bytes are overwritten.
+All positions in public methods are relative to head (oldest byte available).
+written and consumed count bytes of the whole stream: written - consumed == available.
+"""
+
+
+class RingBuffer(object):
+    def __init__(self, size=1024, initial_buffer=b''):
+        self._buffer = bytearray(size)
+        self._view = memoryview(self._buffer)
+        self._limit = size
+        self._head = 0
+        self._available = 0
+        self._written = 0
+        self._consumed = 0
+        self.write(initial_buffer)
+
+    @property
+    def size(self):
+        return self._limit
+
+    @property
+    def written(self):
+        """
+        Number of bytes written since buffer creation
+        """
+        return self._written
+
+    @property
+    def consumed(self):
+        """
+        Number of bytes which left buffer since its creation: consumed, read, cleared or overwritten
+        """
+        return self._consumed
+
+    @property
+    def _tail(self):
+        return (self._head + self._available) % self._limit
+
+    def available(self):
+        return self._available
+
+    def __len__(self):
+        return self._available
+
+    def write(self, data):
+        """
+        :return: number of bytes written, if data is longer than buffer only its last part is stored
+        """
+        written = data_len = len(data)
+        if data_len > self._limit:
+            data = memoryview(data)[-self._limit:]
+            data_len = self._limit
+        tail = (self._head + self._available) % self._limit
+        end = tail + data_len
+        if end <= self._limit:
+            self._buffer[tail:end] = data
+        else:
+            data = memoryview(data)
+            first = self._limit - tail
+            self._buffer[tail:] = data[:first]
+            self._buffer[:data_len - first] = data[first:]
+        self._written += written
+        self._consumed += max(self._available + written - self._limit, 0)
+        overflow = self._available + data_len - self._limit
+        if overflow > 0:
+            self._head = (self._head + overflow) % self._limit
+            self._available = self._limit
+        else:
+            self._available += data_len
+        return written
+
+    def views(self, start=0, length=None):
+        """
+        :return: tuple with one or two memoryviews covering content from start to start+length
+        """
+        start = min(start, self._available)
+        length = self._available - start if length is None else min(length, self._available - start)
+        begin = (self._head + start) % self._limit
+        end = begin + length
+        if end <= self._limit:
+            return (self._view[begin:end],)
+        return self._view[begin:], self._view[:end - self._limit]
+
+    def find(self, sub, start=0, end=None):
+        """
+        Search without copying buffered content
+        :param sub: byte value (int) or bytes
+        :return: position relative to head or -1
+        """
+        end = self._available if end is None else min(end, self._available)
+        if start >= end:
+            return -1
+        begin = (self._head + start) % self._limit
+        stop = begin + end - start
+        if stop <= self._limit:
+            pos = self._buffer.find(sub, begin, stop)
+            return pos - begin + start if pos >= 0 else -1
+        pos = self._buffer.find(sub, begin, self._limit)
+        if pos >= 0:
+            return pos - begin + start
+        first_len = self._limit - begin
+        sub_len = 1 if isinstance(sub, int) else len(sub)
+        if sub_len > 1:     # sub may be split by buffer end
+            edge = min(sub_len - 1, first_len)
+            joint = bytes(self._buffer[self._limit - edge:]) + bytes(self._buffer[:min(sub_len - 1, stop - self._limit)])
+            pos = joint.find(sub)
+            if pos >= 0:
+                return start + first_len - edge + pos
+        pos = self._buffer.find(sub, 0, stop - self._limit)
+        return pos + first_len + start if pos >= 0 else -1
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self._available)
+            if step != 1:
+                raise ValueError("only step 1 slices are supported")
+            return b''.join(self.views(start, stop - start))
+        if index < 0:
+            index += self._available
+        if not 0 <= index < self._available:
+            raise IndexError("{} index out of range".format(RingBuffer.__name__))
+        return self._buffer[(self._head + index) % self._limit]
+
+    def consume(self, amount):
+        """
+        Drop amount of bytes from head
+        :return: number of bytes dropped
+        """
+        amount = min(amount, self._available)
+        self._head = (self._head + amount) % self._limit
+        self._available -= amount
+        self._consumed += amount
+        return amount
+
+    def peek(self, amount=None):
+        """
+        :return: copy of buffered content as bytes, buffer is not changed
+        """
+        return b''.join(self.views(0, amount))
+
+    def read(self, amount=None):
+        result = self.peek(amount)
+        self.consume(len(result))
+        return result
+
+    def readinto(self, buffer):
+        """
+        Read into caller supplied writable buffer
+        :return: number of bytes read
+        """
+        target = memoryview(buffer).cast('B')
+        offset = 0
+        for view in self.views(0, len(target)):
+            target[offset:offset + len(view)] = view
+            offset += len(view)
+        return self.consume(offset)
+
+    def clear(self):
+        self._consumed += self._available
+        self._head = 0
+        self._available = 0
+
+    def __contains__(self, item):
+        return self.find(item) >= 0
+
+    def __repr__(self):
+        return "{}(size: {}, available: {})".format(type(self).__name__, self._limit, self._available)
+
+
+if __name__ == "__main__":
+    # benchmark: receive path pattern, 64 bytes chunks written, whole content peeked, message sized reads
+    import os
+    import sys
+    import timeit
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from circ_io_buffer.circ_io_buffer import CircIoBuffer, BytesIoCircBuffer
+
+    size = 258*10
+    chunk = os.urandom(64)
+    message_len = 2060
+
+    def receive_pattern(buffer_class, peek):
+        def run():
+            buff = buffer_class(size=size)
+            for _ in range(100):
+                for _ in range(message_len // len(chunk) + 1):
+                    buff.write(chunk)
+                    peek(buff)
+                buff.read(message_len)
+        return run
+
+    def ring_find_tail(buff):
+        buff.find(ord('<'))
+
+    for name, run in (("BytesIoCircBuffer write/peek/read", receive_pattern(BytesIoCircBuffer, lambda b: b.peek())),
+                      ("CircIoBuffer write/peek/read", receive_pattern(CircIoBuffer, lambda b: b.peek())),
+                      ("RingBuffer write/find/read", receive_pattern(RingBuffer, ring_find_tail)),
+                      ("RingBuffer write/views/read", receive_pattern(RingBuffer, lambda b: b.views()))):
+        number = 5
+        t = timeit.timeit(run, number=number) / number
+        print("{:40s} {:8.3f} ms per 100 messages".format(name, t*1000))
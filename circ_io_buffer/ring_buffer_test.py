@@ -0,0 +1,89 @@
+"""
+author: Rafal Miecznik
+contact: ravmiecznk@gmail.com
+"""
+
+from circ_io_buffer import RingBuffer, CircIoBuffer
+
+
+def wrapped_buffer():
+    """
+    buffer content 'cdefgh' split by buffer end: 'cd' at the end, 'efgh' at the beginning
+    """
+    rb = RingBuffer(size=8)
+    rb.write(b'xxxxxx')
+    rb.consume(6)
+    rb.write(b'cdefgh')
+    assert rb._head == 6 and rb._tail == 4 and len(rb) == 6
+    return rb
+
+
+def test_views_single_and_wrapped():
+    rb = RingBuffer(size=8)
+    rb.write(b'abc')
+    views = rb.views()
+    assert len(views) == 1 and bytes(views[0]) == b'abc'
+    rb.consume(2)
+    rb.write(b'defghij')
+    views = rb.views()
+    assert len(views) == 2
+    assert b''.join(views) == b'cdefghij'
+    assert b''.join(rb.views(3, 2)) == b'fg'
+
+
+def test_overwrite_oldest():
+    rb = RingBuffer(size=4, initial_buffer=b'123456')
+    assert rb.peek() == b'3456'
+    rb.write(b'78')
+    assert rb.read() == b'5678'
+    assert len(rb) == 0
+
+
+def test_stream_counters():
+    rb = RingBuffer(size=4, initial_buffer=b'123456')
+    assert (rb.written, rb.consumed) == (6, 2)
+    rb.write(b'78')
+    rb.consume(1)
+    assert (rb.written, rb.consumed) == (8, 5)
+    rb.clear()
+    assert rb.written == rb.consumed == 8
+
+
+def test_find_without_copy():
+    rb = RingBuffer(size=8)
+    rb.write(b'xxxxxx')
+    rb.consume(5)
+    rb.write(b'ab<cd>e')     # wraps after 'ab'
+    assert rb.find(ord('<')) == 3
+    assert rb.find(ord('>')) == 6
+    assert rb.find(ord('<'), 4) == -1
+    assert rb.find(b'b<c') == 2     # across buffer end
+    assert rb.find(b'd>e') == 5
+    assert rb.find(b'xa') == 0
+    assert b'cd' in rb and b'zz' not in rb
+
+
+def test_getitem():
+    rb = wrapped_buffer()
+    assert rb[0] == ord('c') and rb[-1] == ord('h')
+    assert rb[1:5] == b'defg'
+
+
+def test_readinto():
+    rb = wrapped_buffer()
+    target = bytearray(4)
+    assert rb.readinto(target) == 4
+    assert target == b'cdef'
+    assert rb.read() == b'gh'
+
+
+def test_circ_io_buffer_shim():
+    cb = CircIoBuffer(b'this is test buffer', size=20)
+    assert b'test' in cb
+    cb.flush_until(b'test')
+    assert cb.read() == b' buffer'
+    cb.lock_write()
+    assert not cb.write(b'x')
+    cb.unlock_write()
+    assert cb.write(b'x')
+    assert cb.peek() == b'x'
@@ -9,6 +9,9 @@ import os
 from loggers import create_logger
 
 LOG_PATH = os.path.join(os.getcwd(), "REFLASHER_DBG")
+CACHE_PATH = os.path.join(os.getcwd(), "REFLASHER_CACHE")
+CACHE_SIZE_LIMIT = 64*1024*1024
+FLASH_HISTORY_PATH = os.path.join(os.getcwd(), "REFLASHER_DEVICES")
 
 if not os.path.isdir(LOG_PATH):
     os.mkdir(LOG_PATH)
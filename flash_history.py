@@ -0,0 +1,107 @@
+"""
+author: Rafal Miecznik
+contact: ravmiecznk@gmail.com
+
+Record of the last image successfully flashed to each device, used for delta flashing:
+only pages which differ from the last flashed image are sent.
+
+Device is identified by USB serial number of its serial adapter when it is available, port name otherwise.
+Record is one json file per device:
+    {"page_size": 2048, "image_len": 131072, "hashes": [page hashes, ...]}
+
+Record is removed when flashing starts and written again only when all pages are acked,
+so after failed or interrupted flash device content is unknown and next flash is a full one.
+Use full=True when device could have been flashed by other tool.
+"""
+
+import os
+import re
+import json
+import hashlib
+
+from config import FLASH_HISTORY_PATH
+
+
+RECORD_EXT = '.json'
+PAGE_HASH_SIZE = 16
+
+
+def page_hashes(image, page_size):
+    """
+    :return: list of hex digests, one per page
+    """
+    image = memoryview(image)
+    return [hashlib.blake2b(image[offset:offset + page_size], digest_size=PAGE_HASH_SIZE).hexdigest()
+            for offset in range(0, len(image), page_size)]
+
+
+def device_id(port):
+    """
+    :return: USB serial number of port's adapter or port name if not available
+    """
+    try:
+        from serial.tools.list_ports import comports
+        for port_info in comports():
+            if port_info.device == port and port_info.serial_number:
+                return port_info.serial_number
+    except ImportError:
+        pass
+    return port
+
+
+class FlashHistory(object):
+    def __init__(self, history_path=FLASH_HISTORY_PATH):
+        self.history_path = history_path
+
+    def record_path(self, device):
+        return os.path.join(self.history_path, re.sub(r'[^\w.-]', '_', device) + RECORD_EXT)
+
+    def get(self, device, page_size):
+        """
+        :return: list of page hashes of last image flashed to device, None if unknown
+        """
+        try:
+            with open(self.record_path(device)) as f:
+                record = json.load(f)
+            if record["page_size"] != page_size:
+                return None
+            return record["hashes"]
+        except (IOError, OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def put(self, device, page_size, hashes, image_len=None):
+        if not os.path.isdir(self.history_path):
+            os.makedirs(self.history_path)
+        path = self.record_path(device)
+        with open(path + '.tmp', 'w') as f:
+            json.dump({"page_size": page_size, "image_len": image_len, "hashes": hashes}, f)
+        os.replace(path + '.tmp', path)
+
+    def remove(self, device):
+        try:
+            os.remove(self.record_path(device))
+        except OSError:
+            pass
+
+    def start_flash(self, device, image, full=False):
+        """
+        Select pages to be flashed and forget device's record until finish_flash.
+        Blank (0xFF) page is skipped only when record shows it already erased on device, like any unchanged page.
+        :param image: CachedImage
+        :param full: ignore record, all pages are flashed
+        :return: tuple(dict packet_index->packet of changed pages, hashes of all pages for finish_flash)
+        """
+        packets = image.packets()
+        hashes = page_hashes(image.image, image.page_size)
+        previous = None if full else self.get(device, image.page_size)
+        self.remove(device)
+        if previous is not None:
+            packets = {index: packet for index, packet in packets.items()
+                       if index >= len(previous) or previous[index] != hashes[index]}
+        return packets, hashes
+
+    def finish_flash(self, device, image, hashes):
+        """
+        Call when all pages were acked
+        """
+        self.put(device, image.page_size, hashes, len(image.image))
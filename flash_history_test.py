@@ -0,0 +1,112 @@
+"""
+author: Rafal Miecznik
+contact: ravmiecznk@gmail.com
+"""
+
+import os
+
+from flash_history import FlashHistory, page_hashes
+from image_cache import CachedImage
+from bootloader_emulator import BootloaderEmulator
+from flash_session import FlashSession, PACKET_SIZE
+from flash_session.flash_session import select_pages
+
+PAGE_SIZE = 2048
+
+
+def image_of(data):
+    return CachedImage(data, PACKET_SIZE, [None]*len(page_hashes(data, PACKET_SIZE)))
+
+
+def test_start_flash_selects_changed_pages(tmp_path):
+    history = FlashHistory(str(tmp_path))
+    old = os.urandom(PAGE_SIZE*4)
+    packets, hashes = history.start_flash('dev', image_of(old))
+    assert sorted(packets) == [0, 1, 2, 3]
+    history.finish_flash('dev', image_of(old), hashes)
+    new = old[:PAGE_SIZE] + os.urandom(PAGE_SIZE) + old[PAGE_SIZE*2:] + b'tail'
+    packets, hashes = history.start_flash('dev', image_of(new))
+    assert sorted(packets) == [1, 4]
+    assert history.get('dev', PAGE_SIZE) is None       # unknown until finish_flash
+    history.finish_flash('dev', image_of(new), hashes)
+    assert sorted(history.start_flash('dev', image_of(new), full=True)[0]) == [0, 1, 2, 3, 4]
+
+
+def test_page_size_change_is_full_flash(tmp_path):
+    history = FlashHistory(str(tmp_path))
+    history.put('/dev/ttyUSB0', PAGE_SIZE//2, ['x'])
+    assert history.get('/dev/ttyUSB0', PAGE_SIZE) is None
+    assert os.listdir(str(tmp_path)) == ['_dev_ttyUSB0.json']
+
+
+def test_delta_flash_on_emulator(tmp_path):
+    history = FlashHistory(str(tmp_path))
+    old = os.urandom(PACKET_SIZE*6)
+    new = old[:PACKET_SIZE*3] + os.urandom(10) + old[PACKET_SIZE*3 + 10:]
+    with BootloaderEmulator() as device:
+        for data, sent_pages in ((old, 6), (new, 1), (new, 0)):
+            with FlashSession(port=device.port, window=2, flash_history=history, device='emulator') as session:
+                session.enable_bootloader()
+                assert session.flash(image_of(data), run_app=False)
+                assert session.transmitter.acks == sent_pages
+                assert session.skipped_pages == 6 - sent_pages
+        assert device.image(len(new)) == new
+        assert device.page_writes == {0: 1, 1: 1, 2: 1, 3: 2, 4: 1, 5: 1}
+
+
+def test_blank_page_skipped_only_when_recorded_erased(tmp_path):
+    history = FlashHistory(str(tmp_path))
+    data = os.urandom(PAGE_SIZE*3)
+    sparse = data[:PAGE_SIZE] + b'\xff'*PAGE_SIZE*2
+    history.put('dev', PAGE_SIZE, page_hashes(data, PAGE_SIZE)[:1] + [None, None])     # blank pages unknown
+    packets, hashes = history.start_flash('dev', image_of(sparse))
+    assert sorted(packets) == [1, 2]     # erase
+    history.finish_flash('dev', image_of(sparse), hashes)
+    assert history.start_flash('dev', image_of(sparse))[0] == {}
+    assert sorted(history.start_flash('dev', image_of(sparse), full=True)[0]) == [0, 1, 2]
+
+
+def test_blank_pages_omitted_without_history():
+    sparse = os.urandom(100) + b'\xff'*(PACKET_SIZE*8 - 200) + os.urandom(100)
+    with BootloaderEmulator() as device:
+        with FlashSession(port=device.port) as session:
+            session.enable_bootloader()
+            assert session.flash(image_of(sparse), run_app=False, skip_blank=True)
+            assert session.transmitter.acks == 2
+            assert (session.skipped_pages, session.skipped_bytes) == (6, PACKET_SIZE*6)
+        assert device.image(len(sparse)) == sparse      # emulated flash is erased
+        device.memory[:len(sparse)] = os.urandom(len(sparse))
+        with FlashSession(port=device.port) as session:
+            session.enable_bootloader()
+            assert session.flash(image_of(sparse), run_app=False, skip_blank=True, erase_blank=True)
+            assert session.transmitter.acks == 8 and session.skipped_pages == 0
+        assert device.image(len(sparse)) == sparse
+
+
+def test_sparse_image_on_emulator(tmp_path):
+    history = FlashHistory(str(tmp_path))
+    data = os.urandom(PACKET_SIZE*8)
+    sparse = os.urandom(100) + b'\xff'*(PACKET_SIZE*8 - 200) + os.urandom(100)
+    update = os.urandom(100) + sparse[100:-100] + os.urandom(100)
+    with BootloaderEmulator() as device:
+        for image, sent_pages in ((data, 8), (sparse, 8), (update, 2)):     # recorded data of blank pages erased
+            with FlashSession(port=device.port, flash_history=history, device='emulator') as session:
+                session.enable_bootloader()
+                assert session.flash(image_of(image), run_app=False, skip_blank=True)
+                assert session.transmitter.acks == sent_pages
+                assert session.skipped_pages == 8 - sent_pages
+        assert device.image(len(update)) == update
+        assert device.page_writes == {0: 3, 1: 2, 2: 2, 3: 2, 4: 2, 5: 2, 6: 2, 7: 3}
+
+
+def test_omitted_blank_pages_recorded_unknown(tmp_path):
+    history = FlashHistory(str(tmp_path))
+    sparse = os.urandom(PAGE_SIZE) + b'\xff'*PAGE_SIZE*2
+    packets, hashes = select_pages(image_of(sparse), history, 'dev', skip_blank=True)
+    assert sorted(packets) == [0]
+    assert hashes[1:] == [None, None]
+    history.finish_flash('dev', image_of(sparse), hashes)
+    packets, hashes = select_pages(image_of(sparse), history, 'dev', skip_blank=True)
+    assert packets == {} and hashes[1:] == [None, None]
+    history.finish_flash('dev', image_of(sparse), hashes)
+    assert sorted(select_pages(image_of(sparse), history, 'dev')[0]) == [1, 2]     # erased state not known
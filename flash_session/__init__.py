@@ -0,0 +1,10 @@
+"""
+author: Rafal Miecznik
+contact: ravmiecznk@gmail.com
+"""
+
+from flash_session.flash_session import PageTransmitter, RttEstimator, FlashSession, BootloaderTimeout, load_hex_image, \
+    packetize, blank_pages, PACKET_SIZE
+from flash_session.orchestrator import FlashOrchestrator, FlashResult
+# asyncio session is not imported here to keep startup of threaded tools short:
+# from flash_session.async_session import AsyncFlashSession, flash_ports
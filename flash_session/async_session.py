@@ -0,0 +1,321 @@
+"""
+author: Rafal Miecznik
+contact: ravmiecznk@gmail.com
+
+asyncio reflash session, one thread (one event loop) can drive many ports:
+    async with AsyncFlashSession(port='/dev/ttyUSB0') as session:
+        await session.enable_bootloader()
+        await session.flash(image)
+
+    results = asyncio.run(flash_ports({'/dev/ttyUSB0': image, '/dev/ttyUSB1': image}))
+Same MessageSender, MessageReceiver and CircIoBuffer are used as in FlashSession, only waiting is async.
+"""
+
+import time
+import asyncio
+
+from message_handler import MessageSender, MessageReceiver, ContextAllocator
+from message_handler.message_handler import pending_table, unsolicited_table
+from circ_io_buffer import CircIoBuffer
+from flash_session.flash_session import PageTransmitter, RttEstimator, BootloaderTimeout, RX_BUFFER_SIZE, DEFAULT_WINDOW, \
+    BOOTLOADER_SIGNATURE, f_logger, report_stats, open_capture, select_pages
+from flash_history import device_id
+from flash_session.orchestrator import FlashResult
+
+
+class AsyncPendingReply(int):
+    """
+    asyncio counterpart of PendingReply: context of sent request which can be awaited
+    """
+    def __new__(cls, context, future):
+        obj = int.__new__(cls, context)
+        obj.tstamp = time.time()
+        obj.rx_tstamp = None
+        obj.rx_message = None
+        obj.future = future
+        return obj
+
+    def set(self, rx_message):
+        self.rx_tstamp = time.time()
+        self.rx_message = rx_message
+        if not self.future.done():
+            self.future.set_result(rx_message)
+
+    def done(self):
+        return self.future.done()
+
+    async def wait(self, timeout=None):
+        """
+        :return: RxMessage or None on timeout
+        """
+        try:
+            return await asyncio.wait_for(asyncio.shield(self.future), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class AsyncPendingRequests:
+    """
+    asyncio counterpart of PendingRequests, must be used from event loop thread only
+    """
+    def __init__(self, unsolicited=None):
+        self.unsolicited = unsolicited if unsolicited is not None else unsolicited_table()
+        self.__pending = pending_table()
+        self.__waiters = []
+
+    def register(self, context):
+        reply = AsyncPendingReply(context, asyncio.get_event_loop().create_future())
+        self.__pending[int(context)] = reply
+        return reply
+
+    def cancel(self, context):
+        return self.__pending.pop(int(context), None)
+
+    def dispatch(self, rx_message):
+        reply = self.__pending.pop(rx_message.context, None)
+        if reply is not None:
+            reply.set(rx_message)
+        else:
+            self.unsolicited[rx_message.context] = rx_message
+        for waiter in self.__waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+        self.__waiters = []
+        return reply is not None
+
+    async def wait_for(self, predicate, timeout=None):
+        """
+        Wait until predicate is true, it is checked each time message is dispatched
+        """
+        loop = asyncio.get_event_loop()
+        deadline = None if timeout is None else loop.time() + timeout
+        while not predicate():
+            remaining = None if deadline is None else deadline - loop.time()
+            if remaining is not None and remaining <= 0:
+                return False
+            waiter = loop.create_future()
+            self.__waiters.append(waiter)
+            try:
+                await asyncio.wait_for(waiter, remaining)
+            except asyncio.TimeoutError:
+                return predicate()
+        return True
+
+    async def wait_any(self, replies, timeout=None):
+        """
+        :return: list of completed replies, empty on timeout
+        """
+        if not any(r.done() for r in replies):
+            await asyncio.wait([r.future for r in replies], timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+        return [r for r in replies if r.done()]
+
+    def __len__(self):
+        return len(self.__pending)
+
+
+class AsyncPageTransmitter(PageTransmitter):
+    async def transmit(self, packets, packet_crcs=None, timeout=None, progress=lambda percent: None):
+        """
+        See PageTransmitter.transmit
+        """
+        self.start(packets, packet_crcs, timeout)
+        while self.packets:
+            self.fill_window()
+            await self.pending_requests.wait_any(self.in_flight(), timeout=self.wait_time())
+            self.collect()
+            progress(self.percent_done())
+            if self.expired():
+                return False
+        self.stats.stop()
+        self.elapsed = self.stats.elapsed
+        return True
+
+
+class AsyncFlashSession:
+    def __init__(self, port, baudrate=115200, window=DEFAULT_WINDOW, rxtimeout=1, connection_factory=None,
+                 flash_history=None, device=None, adaptive_rto=True, stats_dir=None, prometheus_dir=None,
+                 capture_dir=None, capture_max_bytes=None):
+        """
+        :param rxtimeout: page ack timeout, initial one with adaptive_rto
+        :param connection_factory: callable with AsyncSerialConnection arguments, AsyncSerialConnection by default
+        :param flash_history: FlashHistory for delta flashing, see FlashSession
+        :param stats_dir: stats of each flash are saved there as json
+        :param prometheus_dir: stats of each flash are saved there as Prometheus textfile
+        :param capture_dir: raw serial traffic is captured there, see WireCapture
+        :param capture_max_bytes: ring retention limit of capture, no limit if None
+        """
+        self.port = port
+        self.capture_dir = capture_dir
+        self.capture_max_bytes = capture_max_bytes
+        self.capture = None
+        self.stats_dir = stats_dir
+        self.prometheus_dir = prometheus_dir
+        self.flash_history = flash_history
+        self.device = device
+        self.skipped_pages = 0
+        self.skipped_bytes = 0
+        self.baudrate = baudrate
+        self.window = window
+        self.rxtimeout = rxtimeout
+        self.rtt_estimator = RttEstimator(initial_rto=rxtimeout) if adaptive_rto else None
+        if connection_factory is None:
+            from serial_handler.async_serial import AsyncSerialConnection
+            connection_factory = AsyncSerialConnection
+        self.connection_factory = connection_factory
+        self.rx_buffer = CircIoBuffer(size=RX_BUFFER_SIZE)
+        self.message_receiver = MessageReceiver(self.rx_buffer)
+        self.pending_requests = AsyncPendingRequests()
+        self.context_allocator = ContextAllocator(MessageSender.reserved_context)
+        self.connection = None
+        self.connection_error = None
+        self.message_sender = None
+        self.transmitter = None
+
+    @property
+    def stats(self):
+        """
+        :return: TransmissionStats of current or last flash, None before first flash
+        """
+        if self.transmitter is None:
+            return None
+        self.transmitter.stats.rx_buffered(self.message_receiver.high_water)
+        return self.transmitter.stats
+
+    async def open(self):
+        kwargs = {}
+        if self.capture_dir is not None:
+            self.capture = kwargs['capture'] = open_capture(self.capture_dir, self.port, self.capture_max_bytes)
+        self.connection = self.connection_factory(port=self.port, baudrate=self.baudrate,
+                                                  data_received=self.data_received,
+                                                  connection_lost=self.connection_lost, **kwargs)
+        self.message_sender = MessageSender(self.connection.send, self.pending_requests, self.context_allocator)
+        return self
+
+    async def close(self):
+        if self.connection is not None and self.connection.isOpen():
+            try:
+                await self.connection.drain()
+            except (IOError, OSError) as e:
+                f_logger.error("%s: pending data not written: %s", self.port, e)
+            finally:
+                self.connection.close()
+        if self.capture is not None:
+            self.capture.close()
+
+    async def __aenter__(self):
+        return await self.open()
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    def connection_lost(self, exc):
+        """
+        Port is gone, requests waiting for response fail on timeout and then connection_error is raised
+        """
+        f_logger.error("%s: connection lost: %s", self.port, exc)
+        self.connection_error = exc
+
+    def data_received(self, data):
+        self.rx_buffer.write(data)
+        for msg in self.message_receiver.get_messages():
+            self.pending_requests.dispatch(msg)
+
+    async def enable_bootloader(self, retx=3, timeout=1):
+        """
+        Request bootloader and wait for its signature
+        :raise BootloaderTimeout:
+        """
+        unsolicited = self.pending_requests.unsolicited
+        unsolicited.clear()
+        for _ in range(retx):
+            reply = self.message_sender.send(MessageSender.ID.bootloader)
+            bootloader_responded = lambda: (reply.done() and BOOTLOADER_SIGNATURE in reply.rx_message.msg) or \
+                any(BOOTLOADER_SIGNATURE in m.msg for m in unsolicited.values())
+            if await self.pending_requests.wait_for(bootloader_responded, timeout):
+                return True
+            self.pending_requests.cancel(reply)
+            if self.connection_error is not None:
+                raise self.connection_error
+        raise BootloaderTimeout("{}: bootloader did not respond".format(self.port))
+
+    async def flash(self, image, timeout=None, run_app=True, progress=lambda percent: None, full=False,
+                    skip_blank=False, erase_blank=False):
+        """
+        :param image: CachedImage
+        :param full: flash all pages even if device's flash history is known
+        :param skip_blank: do not send pages which are entirely 0xFF, they are assumed erased on device
+        :param erase_blank: erase skipped blank pages unless flash history shows them erased, see omit_blank_pages
+        :return: True when all pages acked
+        """
+        if self.flash_history is not None:
+            self.device = self.device if self.device is not None else device_id(self.port)
+        packets, hashes = select_pages(image, self.flash_history, self.device, full, skip_blank, erase_blank)
+        self.skipped_pages = len(image.crcs) - len(packets)
+        self.skipped_bytes = len(image.image) - sum(len(packet) for packet in packets.values())
+        self.pending_requests.cancel(self.message_sender.send(MessageSender.ID.rxflush))
+        self.pending_requests.unsolicited.clear()
+        self.message_receiver.high_water = 0
+        self.transmitter = AsyncPageTransmitter(self.message_sender, window=self.window, rxtimeout=self.rxtimeout,
+                                                rtt_estimator=self.rtt_estimator)
+        result = await self.transmitter.transmit(packets, dict(enumerate(image.crcs)), timeout=timeout,
+                                                 progress=progress)
+        if not result and self.connection_error is not None:
+            raise self.connection_error
+        f_logger.debug("{}: {}".format(self.port, self.transmitter))
+        report_stats(self.stats, self.port, self.stats_dir, self.prometheus_dir)
+        if result and hashes is not None:
+            self.flash_history.finish_flash(self.device, image, hashes)
+        if result and run_app:
+            self.pending_requests.cancel(self.message_sender.send(MessageSender.ID.run_main_app_btl))
+        return result
+
+
+async def flash_port(port, image, timeout=None, run_app=True, full=False, skip_blank=False, erase_blank=False,
+                     **session_kwargs):
+    """
+    :return: FlashResult
+    """
+    t0 = time.time()
+    session = AsyncFlashSession(port=port, **session_kwargs)
+    try:
+        await session.open()
+    except (IOError, OSError) as e:
+        return FlashResult(port, FlashResult.connection_error, error=e, elapsed=time.time() - t0)
+    try:
+        await session.enable_bootloader()
+        result = await session.flash(image, timeout=timeout, run_app=run_app, full=full,
+                                     skip_blank=skip_blank, erase_blank=erase_blank)
+        status = FlashResult.ok if result else FlashResult.failed
+        return FlashResult(port, status, transmitter=session.transmitter, elapsed=time.time() - t0,
+                           skipped_pages=session.skipped_pages, skipped_bytes=session.skipped_bytes)
+    except BootloaderTimeout as e:
+        return FlashResult(port, FlashResult.bootloader_error, error=e, elapsed=time.time() - t0)
+    except (IOError, OSError) as e:     # SerialException included, e.g. board unplugged during flash
+        f_logger.error("%s: connection lost: %s", port, e)
+        return FlashResult(port, FlashResult.connection_error, error=e, elapsed=time.time() - t0)
+    finally:
+        await session.close()
+
+
+async def flash_ports(jobs, **kwargs):
+    """
+    Flash all ports concurrently in current event loop
+    :param jobs: dict port->image
+    :return: dict port->FlashResult
+    """
+    ports = list(jobs)
+    results = await asyncio.gather(*[flash_port(port, jobs[port], **kwargs) for port in ports],
+                                   return_exceptions=True)
+    return {port: port_result(port, result) for port, result in zip(ports, results)}
+
+
+def port_result(port, result):
+    """
+    Unexpected exception of one port is its failed result, other ports results are kept
+    """
+    if isinstance(result, Exception):
+        f_logger.error("%s: flash failed: %r", port, result)
+        return FlashResult(port, FlashResult.failed, error=result)
+    if isinstance(result, BaseException):
+        raise result
+    return result
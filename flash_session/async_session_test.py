@@ -0,0 +1,50 @@
+"""
+author: Rafal Miecznik
+contact: ravmiecznk@gmail.com
+"""
+
+import os
+import asyncio
+from contextlib import ExitStack
+
+from message_handler import MessageSender
+from image_cache import CachedImage
+from bootloader_emulator import BootloaderEmulator
+from flash_session import PACKET_SIZE
+from flash_session import FlashResult
+from flash_session.async_session import AsyncFlashSession, flash_ports, port_result
+
+
+def test_async_session_flash():
+    image = CachedImage(os.urandom(PACKET_SIZE*3 + 1), PACKET_SIZE, [None]*4)
+
+    async def flash(device):
+        async with AsyncFlashSession(port=device.port, window=2) as session:
+            await session.enable_bootloader()
+            return await session.flash(image)
+
+    with BootloaderEmulator() as device:
+        assert asyncio.run(flash(device))
+        assert device.image(len(image)) == bytes(image.image)
+
+
+def test_flash_ports_in_one_loop():
+    image = CachedImage(os.urandom(PACKET_SIZE*2), PACKET_SIZE, [None]*2)
+    with ExitStack() as stack:
+        devices = [stack.enter_context(BootloaderEmulator()) for _ in range(3)]
+        results = asyncio.run(flash_ports({device.port: image for device in devices}))
+        assert all(results.values())
+        for device in devices:
+            assert device.image(len(image)) == bytes(image.image)
+
+
+def test_flash_ports_unplugged_device():
+    image = CachedImage(os.urandom(PACKET_SIZE*2), PACKET_SIZE, [None]*2)
+    with BootloaderEmulator() as device, BootloaderEmulator(unplug_after=MessageSender.ID.bootloader) as unplugged:
+        results = asyncio.run(flash_ports({device.port: image, unplugged.port: image}, rxtimeout=0.1, timeout=2))
+    assert results[device.port].status == FlashResult.ok
+    assert results[unplugged.port].status == FlashResult.connection_error
+
+
+def test_port_result_of_unexpected_error():
+    assert port_result('/dev/ttyUSB0', RuntimeError("broken")).status == FlashResult.failed
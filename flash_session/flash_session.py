@@ -0,0 +1,572 @@
+"""
+author: Rafal Miecznik
+contact: ravmiecznk@gmail.com
+
+Page transmission with sliding window.
+Up to `window` write_to_page messages are kept in flight, each one is tracked by its context.
+Page is removed from transmit set when acked, nacked and timed out pages are sent again.
+window=1 is plain stop-and-wait.
+Transmitter sleeps on pending requests registry and wakes up as soon as any ack is dispatched.
+
+FlashSession drives whole reflash procedure over serial connection without any Qt dependency.
+"""
+
+import os
+import re
+import time
+import struct
+import threading
+from collections import deque
+
+from loggers import create_logger
+from wire_capture import WireCapture
+from message_handler import MessageSender, MessageReceiver, RxMessage, PendingRequests, ContextAllocator, \
+    TransmissionStats
+from message_handler.crc import page_crcs, crc16_xmodem
+from message_handler.codec import MESSAGE_HEADER, pack_header_into
+from intel_hex_handler import intel_hex_parser
+from image_cache import CachedImage
+from flash_history import device_id
+from circ_io_buffer import CircIoBuffer
+from config import LOG_PATH
+
+
+log_format = '[%(asctime)s]: %(levelname)s method:"%(funcName)s" %(message)s'
+f_logger = create_logger("flash_session", log_path=LOG_PATH, format=log_format)
+
+DEFAULT_WINDOW = 1
+MIN_RTO = 0.05
+MAX_RTO = 4
+TIMEOUT_FACTOR = 3      # transmission timeout: TIMEOUT_FACTOR * expected duration
+PACKET_SIZE = 256*8
+ERASED_BYTE = b'\xff'
+RX_BUFFER_SIZE = 258*10
+CAPTURE_EXT = '.cap'
+BOOTLOADER_SIGNATURE = b'bootloader3'
+
+PACKET_INDEX = struct.Struct('=H')
+packet_index_prefix = lambda packet_index: PACKET_INDEX.pack(packet_index)
+
+
+class BootloaderTimeout(Exception):
+    pass
+
+
+def port_file_name(port):
+    """
+    :return: port name usable as file name, e.g. _dev_ttyUSB0
+    """
+    return re.sub(r'[^\w.-]', '_', port)
+
+
+def open_capture(capture_dir, port, max_bytes=None):
+    """
+    :return: WireCapture of port traffic written to <capture_dir>/<port file name>.cap
+    """
+    if not os.path.isdir(capture_dir):
+        os.makedirs(capture_dir)
+    return WireCapture(os.path.join(capture_dir, port_file_name(port) + CAPTURE_EXT), max_bytes=max_bytes)
+
+
+def report_stats(stats, name, stats_dir=None, prometheus_dir=None):
+    """
+    Log transmission stats as json, optionally save it as <name>.json in stats_dir
+    and as Prometheus textfile reflasher_<name>.prom in prometheus_dir (node_exporter textfile collector)
+    """
+    stats_json = stats.to_json()
+    f_logger.info("{} stats: {}".format(name, stats_json))
+    file_name = port_file_name(name)
+    if stats_dir is not None:
+        if not os.path.isdir(stats_dir):
+            os.makedirs(stats_dir)
+        with open(os.path.join(stats_dir, file_name + '.json'), 'w') as f:
+            f.write(stats_json)
+    if prometheus_dir is not None:
+        stats.write_prometheus(os.path.join(prometheus_dir, 'reflasher_{}.prom'.format(file_name)), {'port': name})
+
+
+def blank_pages(bin_segment, packet_size=PACKET_SIZE):
+    """
+    Pages with all bytes in erased flash state (0xFF), gap fill and padding produce them.
+    Each page is compared in place with prefix of blank page, nothing is copied.
+    :return: set of packet indexes
+    """
+    bin_segment = memoryview(bin_segment)
+    blank_page = ERASED_BYTE * packet_size
+    return {index for index, offset in enumerate(range(0, len(bin_segment), packet_size))
+            if blank_page.startswith(bin_segment[offset:offset + packet_size])}
+
+
+def omit_blank_pages(packets, bin_segment, packet_size=PACKET_SIZE, recorded=None, erase_blank=False):
+    """
+    Remove blank pages from transmit set, they are assumed erased on device.
+    atm128_bootloader_v3 has no erase-only request, page is erased by write_to_page of blank page, so blank page
+    which has to be erased stays in transmit set: one recorded with other data and, with erase_blank, any blank page
+    not recorded erased.
+    :param packets: dict packet_index->packet, blank pages are removed from it
+    :param recorded: page hashes of device's flash history record (pages not in packets are recorded as they are),
+                     None if device content is unknown
+    :param erase_blank: erase blank pages of unknown content too, safe but nothing is omitted without flash history
+    :return: set of omitted packet indexes
+    """
+    recorded = recorded or []
+    blank = blank_pages(bin_segment, packet_size).intersection(packets)
+    to_erase = blank if erase_blank else {index for index in blank
+                                          if index < len(recorded) and recorded[index] is not None}
+    if to_erase:
+        f_logger.info("%d blank pages erased by page write, bootloader has no erase request", len(to_erase))
+    omitted = blank - to_erase
+    for index in omitted:
+        del packets[index]
+    return omitted
+
+
+def select_pages(image, flash_history=None, device=None, full=False, skip_blank=False, erase_blank=False):
+    """
+    Pages to be flashed: all, changed since last flash with flash_history, without blank ones with skip_blank.
+    Omitted blank pages are recorded as unknown (None) in flash history.
+    :param image: CachedImage
+    :return: tuple(dict packet_index->packet, page hashes for FlashHistory.finish_flash or None without history)
+    """
+    packets, hashes, recorded = image.packets(), None, None
+    if flash_history is not None:
+        recorded = None if full else flash_history.get(device, image.page_size)
+        packets, hashes = flash_history.start_flash(device, image, full)
+    if skip_blank:
+        for index in omit_blank_pages(packets, image.image, image.page_size, recorded, erase_blank):
+            if hashes is not None:
+                hashes[index] = None
+    return packets, hashes
+
+
+def packetize(bin_segment, packet_size=PACKET_SIZE, skip_blank=False):
+    """
+    Slice binary segment into write_to_page packets
+    :param skip_blank: omit packets which are entirely 0xFF, only for device known to be erased, see omit_blank_pages
+    :return: tuple(dict packet_index->packet, dict packet_index->write_to_page body crc)
+    """
+    packets = {index: bin_segment[offset:offset + packet_size]
+               for index, offset in enumerate(range(0, len(bin_segment), packet_size))}
+    if skip_blank:
+        for index in blank_pages(bin_segment, packet_size):
+            del packets[index]
+    crcs = page_crcs(bin_segment, packet_size, page_prefix=packet_index_prefix)
+    return packets, dict(enumerate(crcs))
+
+
+class PageFrames:
+    """
+    Preserialized write_to_page messages of selected pages laid out contiguously in one buffer:
+     >ID CONTEXT BODY_LEN CRC<PACKET_INDEX PAGE>ID CONTEXT BODY_LEN CRC<PACKET_INDEX PAGE...
+    Built once before the first send, frames[packet_index] is zero-copy memoryview of whole message
+    and only its context field is set at send time (MessageSender.send_frame).
+    """
+    def __init__(self, packets, packet_crcs=None):
+        """
+        :param packets: dict packet_index->packet data
+        :param packet_crcs: dict packet_index->precalculated write_to_page body crc, calculated here if missing
+        """
+        packet_crcs = packet_crcs if packet_crcs is not None else {}
+        frame_overhead = MESSAGE_HEADER.size + PACKET_INDEX.size
+        self.buffer = bytearray(sum(frame_overhead + len(packet) for packet in packets.values()))
+        view = memoryview(self.buffer)
+        self.frames = {}
+        offset = 0
+        for packet_index in sorted(packets):
+            packet = packets[packet_index]
+            body = offset + MESSAGE_HEADER.size
+            end = body + PACKET_INDEX.size + len(packet)
+            PACKET_INDEX.pack_into(self.buffer, body, packet_index)
+            view[body + PACKET_INDEX.size:end] = packet
+            crc = packet_crcs.get(packet_index)
+            if crc is None:
+                crc = crc16_xmodem(view[body:end])
+            pack_header_into(self.buffer, offset, MessageSender.ID.write_to_page, 0, end - body, crc)
+            self.frames[packet_index] = view[offset:end]
+            offset = end
+
+    def __getitem__(self, packet_index):
+        return self.frames[packet_index]
+
+    def __len__(self):
+        return len(self.frames)
+
+
+def load_hex_image(file_path, image_cache=None, start_address=0, packet_size=PACKET_SIZE, info=lambda x: x):
+    """
+    Parse hex file (or take it from image cache) and calculate crc of every write_to_page body
+    :param image_cache: ImageCache or None
+    :return: CachedImage
+    """
+    image = image_cache.get(file_path, packet_size, start_address) if image_cache is not None else None
+    if image is None:
+        with open(file_path) as hex_file:
+            bin_segment = intel_hex_parser(hex_file, info)[start_address]
+        crcs = page_crcs(bin_segment, packet_size, page_prefix=packet_index_prefix)
+        if image_cache is not None:
+            image = image_cache.put(file_path, bin_segment, packet_size, crcs, start_address)
+        else:
+            image = CachedImage(bin_segment, packet_size, crcs)
+    return image
+
+
+class RttEstimator:
+    """
+    Retransmission timeout (rto) from measured page round trip times, TCP style (RFC 6298):
+        rttvar = (1 - beta)*rttvar + beta*|srtt - rtt|
+        srtt = (1 - alpha)*srtt + alpha*rtt
+        rto = srtt + k*rttvar
+    rto is doubled on each consecutive loss (exponential backoff) until next rtt sample.
+    Only pages sent once are sampled (Karn's algorithm), ack of retransmitted page is ambiguous.
+    """
+    def __init__(self, initial_rto=1, min_rto=MIN_RTO, max_rto=MAX_RTO, alpha=0.125, beta=0.25, k=4):
+        self.min_rto = min_rto
+        self.max_rto = max_rto
+        self.alpha = alpha
+        self.beta = beta
+        self.k = k
+        self.srtt = None
+        self.rttvar = None
+        self.backoffs = 0
+        self.__rto = self.__bound(initial_rto)
+
+    def __bound(self, rto):
+        return min(max(rto, self.min_rto), self.max_rto)
+
+    @property
+    def rto(self):
+        return self.__rto
+
+    def sample(self, rtt):
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt/2.0
+        else:
+            self.rttvar = (1 - self.beta)*self.rttvar + self.beta*abs(self.srtt - rtt)
+            self.srtt = (1 - self.alpha)*self.srtt + self.alpha*rtt
+        self.backoffs = 0
+        self.__rto = self.__bound(self.srtt + self.k*self.rttvar)
+
+    def backoff(self):
+        self.backoffs += 1
+        self.__rto = self.__bound(self.__rto*2)
+
+    def __repr__(self):
+        srtt = "{:.3f}s".format(self.srtt) if self.srtt is not None else None
+        return "srtt: {}, rto: {:.3f}s, backoffs: {}".format(srtt, self.__rto, self.backoffs)
+
+
+class PageTransmitter:
+    def __init__(self, message_sender, window=DEFAULT_WINDOW, rxtimeout=1, rtt_estimator=None):
+        """
+        :param message_sender: MessageSender with pending_requests registry, its replies are waited for
+        :param window: number of pages in flight
+        :param rxtimeout: time to wait for page ack before it is retransmitted
+        :param rtt_estimator: RttEstimator, page ack timeout follows measured round trip times, rxtimeout not used
+        """
+        if window < 1:
+            raise ValueError("window must be >= 1, got: {}".format(window))
+        if message_sender.pending_requests is None:
+            raise ValueError("message sender without pending requests registry")
+        self.message_sender = message_sender
+        self.pending_requests = message_sender.pending_requests
+        self.window = window
+        self.rxtimeout = rxtimeout
+        self.rtt_estimator = rtt_estimator
+        self.elapsed = 0
+        self.start({})
+
+    @property
+    def acks(self):
+        return self.stats.acks
+
+    @property
+    def nacks(self):
+        return self.stats.nacks
+
+    @property
+    def timeouts(self):
+        return self.stats.timeouts
+
+    @property
+    def retransmits(self):
+        return self.stats.retransmits
+
+    @property
+    def bytes_sent(self):
+        return self.stats.bytes_sent
+
+    def send_page(self, packet_index):
+        return self.message_sender.send_frame(MessageSender.ID.write_to_page, self.frames[packet_index])
+
+    def start(self, packets, packet_crcs=None, timeout=None):
+        """
+        Prepare transmission state and all page messages, see transmit
+        """
+        self.packets = packets
+        self.frames = PageFrames(packets, packet_crcs)
+        self.num_of_packets = len(packets)
+        self.total_bytes = sum(len(packet) for packet in packets.values())
+        self.to_send = deque(sorted(packets))
+        self.retransmitted = set()
+        self.context_to_packet_index_map = {}
+        self.timeout = timeout
+        self.stats = TransmissionStats()
+        self.t0 = self.t_progress = self.stats.t0
+
+    def rto(self):
+        """
+        :return: current page ack timeout
+        """
+        return self.rtt_estimator.rto if self.rtt_estimator is not None else self.rxtimeout
+
+    def deadline(self):
+        """
+        Fixed when timeout is given, otherwise scaled with image size and throughput measured so far
+        (or with rto before first ack): transmission may take TIMEOUT_FACTOR times longer than expected.
+        """
+        if self.timeout is not None:
+            return self.t0 + self.timeout
+        if self.bytes_sent:
+            expected = (self.t_progress - self.t0)*self.total_bytes/self.bytes_sent
+        else:
+            expected = self.rto()*self.num_of_packets/self.window
+        return self.t0 + TIMEOUT_FACTOR*expected + self.rto()
+
+    def fill_window(self):
+        while self.to_send and len(self.context_to_packet_index_map) < self.window:
+            packet_index = self.to_send.popleft()
+            if packet_index in self.retransmitted:
+                self.stats.retransmit()
+            context = self.send_page(packet_index)
+            self.context_to_packet_index_map[context] = packet_index
+
+    def in_flight(self):
+        return list(self.context_to_packet_index_map)
+
+    def wait_time(self):
+        """
+        :return: time until oldest page in flight times out (or whole transmission)
+        """
+        deadline = min(min(c.tstamp for c in self.context_to_packet_index_map) + self.rto(), self.deadline())
+        return max(0, deadline - time.time())
+
+    def collect(self):
+        """
+        Handle acked, nacked and timed out pages in flight
+        """
+        rto = self.rto()
+        lost = False
+        for context in self.in_flight():
+            packet_index = self.context_to_packet_index_map[context]
+            if context.done():
+                if context.rx_message.id == RxMessage.RxId.ack:
+                    rtt = context.rx_tstamp - context.tstamp
+                    self.stats.ack(len(self.packets.pop(packet_index)), latency=rtt)
+                    self.t_progress = context.rx_tstamp
+                    if self.rtt_estimator is not None and packet_index not in self.retransmitted:
+                        self.rtt_estimator.sample(rtt)
+                else:
+                    self.stats.nack()
+                    f_logger.debug("nack for context: %s, packet: %s", context, packet_index)
+                    self.retransmitted.add(packet_index)
+                    self.to_send.appendleft(packet_index)
+            elif time.time() - context.tstamp > rto:
+                self.stats.timeout()
+                lost = True
+                self.pending_requests.cancel(context)
+                f_logger.debug("timeout for context: %s, packet: %s, rto: %.3f", context, packet_index, rto)
+                self.retransmitted.add(packet_index)
+                self.to_send.appendleft(packet_index)
+            else:
+                continue
+            self.context_to_packet_index_map.pop(context)
+        if lost and self.rtt_estimator is not None:
+            self.rtt_estimator.backoff()
+
+    def percent_done(self):
+        try:
+            return 100*float(self.num_of_packets - len(self.packets))/self.num_of_packets
+        except ZeroDivisionError:
+            return 100.0
+
+    def expired(self):
+        self.elapsed = time.time() - self.t0
+        if self.packets and self.t0 + self.elapsed > self.deadline():
+            f_logger.debug("transmission timeout, {} packets left".format(len(self.packets)))
+            for context in self.context_to_packet_index_map:
+                self.pending_requests.cancel(context)
+            self.stats.stop()
+            return True
+        return False
+
+    def transmit(self, packets, packet_crcs=None, timeout=None, progress=lambda percent: None):
+        """
+        :param packets: dict packet_index->packet data, acked packets are removed from it
+        :param packet_crcs: dict packet_index->precalculated write_to_page body crc
+        :param timeout: overall transmission timeout, scaled with image size and throughput if None
+        :param progress: callback with percent of acked packets
+        :return: True when all packets acked, False on timeout
+        """
+        self.start(packets, packet_crcs, timeout)
+        while self.packets:
+            self.fill_window()
+            self.pending_requests.wait_any(self.in_flight(), timeout=self.wait_time())
+            self.collect()
+            progress(self.percent_done())
+            if self.expired():
+                return False
+        self.stats.stop()
+        self.elapsed = self.stats.elapsed
+        return True
+
+    def bytes_per_second(self):
+        try:
+            return self.bytes_sent/self.elapsed
+        except ZeroDivisionError:
+            return 0
+
+    def __repr__(self):
+        return "acks: {}, nacks: {}, timeouts: {}, retransmits: {}, {} bytes in {:.3f}s, {:.0f} B/s".format(
+            self.acks, self.nacks, self.timeouts, self.retransmits, self.bytes_sent, self.elapsed,
+            self.bytes_per_second())
+
+
+class FlashSession:
+    """
+    Single device reflash session:
+        with FlashSession(port='/dev/ttyUSB0') as session:
+            session.enable_bootloader()
+            session.flash(load_hex_image('app.hex'))
+    Received data is decoded in serial reader thread and dispatched to session's pending requests.
+    Session owns its context space, rx buffer and pending requests so many sessions can run at once.
+    With flash_history only pages changed since last flash of the device are sent.
+    Live stats of current (or last) flash: session.stats
+    """
+    def __init__(self, port, baudrate=115200, window=DEFAULT_WINDOW, rxtimeout=1, connection_factory=None,
+                 flash_history=None, device=None, adaptive_rto=True, stats_dir=None, prometheus_dir=None,
+                 capture_dir=None, capture_max_bytes=None):
+        """
+        :param rxtimeout: page ack timeout, initial one with adaptive_rto
+        :param connection_factory: callable with SerialConnection arguments, SerialConnection by default
+        :param flash_history: FlashHistory for delta flashing, all pages are flashed if None
+        :param device: device id in flash_history, USB serial number or port name if None
+        :param adaptive_rto: page ack timeout follows round trip times measured in this session, see RttEstimator
+        :param stats_dir: stats of each flash are saved there as json
+        :param prometheus_dir: stats of each flash are saved there as Prometheus textfile
+        :param capture_dir: raw serial traffic is captured there, see WireCapture
+        :param capture_max_bytes: ring retention limit of capture, no limit if None
+        """
+        self.port = port
+        self.capture_dir = capture_dir
+        self.capture_max_bytes = capture_max_bytes
+        self.capture = None
+        self.stats_dir = stats_dir
+        self.prometheus_dir = prometheus_dir
+        self.flash_history = flash_history
+        self.device = device
+        self.skipped_pages = 0
+        self.skipped_bytes = 0
+        self.baudrate = baudrate
+        self.window = window
+        self.rxtimeout = rxtimeout
+        self.rtt_estimator = RttEstimator(initial_rto=rxtimeout) if adaptive_rto else None
+        if connection_factory is None:
+            from serial_handler import SerialConnection
+            connection_factory = SerialConnection
+        self.connection_factory = connection_factory
+        self.rx_buffer = CircIoBuffer(size=RX_BUFFER_SIZE)
+        self.message_receiver = MessageReceiver(self.rx_buffer)
+        self.pending_requests = PendingRequests()
+        self.context_allocator = ContextAllocator(MessageSender.reserved_context)
+        self.rx_lock = threading.Lock()
+        self.connection = None
+        self.message_sender = None
+        self.transmitter = None
+
+    @property
+    def stats(self):
+        """
+        :return: TransmissionStats of current or last flash, None before first flash
+        """
+        if self.transmitter is None:
+            return None
+        self.transmitter.stats.rx_buffered(self.message_receiver.high_water)
+        return self.transmitter.stats
+
+    def open(self):
+        kwargs = {}
+        if self.capture_dir is not None:
+            self.capture = kwargs['capture'] = open_capture(self.capture_dir, self.port, self.capture_max_bytes)
+        self.connection = self.connection_factory(port=self.port, timeout=0.002, write_timeout=1,
+                                                  baudrate=self.baudrate, data_ready_signal=self.data_ready,
+                                                  **kwargs)
+        self.message_sender = MessageSender(self.connection.send, self.pending_requests, self.context_allocator)
+        return self
+
+    def close(self):
+        if self.connection is not None and self.connection.isOpen():
+            self.connection.close()
+        if self.capture is not None:
+            self.capture.close()
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def data_ready(self):
+        """
+        Called by serial reader thread when data is queued
+        """
+        with self.rx_lock:
+            while not self.connection.queue.empty():
+                self.rx_buffer.write(self.connection.queue.get_nowait())
+            for msg in self.message_receiver.get_messages():
+                self.pending_requests.dispatch(msg)
+
+    def enable_bootloader(self, retx=3, timeout=1):
+        """
+        Request bootloader and wait for its signature
+        :raise BootloaderTimeout:
+        """
+        unsolicited = self.pending_requests.unsolicited
+        unsolicited.clear()
+        for _ in range(retx):
+            reply = self.message_sender.send(MessageSender.ID.bootloader)
+            bootloader_responded = lambda: (reply.done() and BOOTLOADER_SIGNATURE in reply.rx_message.msg) or \
+                any(BOOTLOADER_SIGNATURE in m.msg for m in unsolicited.values())
+            if self.pending_requests.wait_for(bootloader_responded, timeout):
+                return True
+            self.pending_requests.cancel(reply)
+        raise BootloaderTimeout("{}: bootloader did not respond".format(self.port))
+
+    def flash(self, image, timeout=None, run_app=True, progress=lambda percent: None, full=False,
+              skip_blank=False, erase_blank=False):
+        """
+        :param image: CachedImage
+        :param full: flash all pages even if device's flash history is known
+        :param skip_blank: do not send pages which are entirely 0xFF, they are assumed erased on device
+        :param erase_blank: erase skipped blank pages unless flash history shows them erased, see omit_blank_pages
+        :return: True when all pages acked
+        """
+        if self.flash_history is not None:
+            self.device = self.device if self.device is not None else device_id(self.port)
+        packets, hashes = select_pages(image, self.flash_history, self.device, full, skip_blank, erase_blank)
+        self.skipped_pages = len(image.crcs) - len(packets)
+        self.skipped_bytes = len(image.image) - sum(len(packet) for packet in packets.values())
+        self.pending_requests.cancel(self.message_sender.send(MessageSender.ID.rxflush))
+        self.pending_requests.unsolicited.clear()
+        self.message_receiver.high_water = 0
+        self.transmitter = PageTransmitter(self.message_sender, window=self.window, rxtimeout=self.rxtimeout,
+                                           rtt_estimator=self.rtt_estimator)
+        result = self.transmitter.transmit(packets, dict(enumerate(image.crcs)), timeout=timeout,
+                                           progress=progress)
+        f_logger.debug("{}: {}".format(self.port, self.transmitter))
+        report_stats(self.stats, self.port, self.stats_dir, self.prometheus_dir)
+        if result and hashes is not None:
+            self.flash_history.finish_flash(self.device, image, hashes)
+        if result and run_app:
+            self.pending_requests.cancel(self.message_sender.send(MessageSender.ID.run_main_app_btl))
+        return result
@@ -0,0 +1,151 @@
+"""
+author: Rafal Miecznik
+contact: ravmiecznk@gmail.com
+"""
+
+import os
+import time
+
+from message_handler import MessageSender, PendingRequests
+from message_handler.message_handler import create_message
+from bootloader_emulator import BootloaderEmulator
+from flash_session import FlashSession, PageTransmitter, RttEstimator, blank_pages, packetize
+from flash_session.flash_session import PageFrames, packet_index_prefix, omit_blank_pages
+
+PAGE_SIZE = 256*8
+
+
+class WindowProbe(PageTransmitter):
+    """
+    PageTransmitter recording largest number of pages in flight
+    """
+    max_in_flight = 0
+
+    def fill_window(self):
+        PageTransmitter.fill_window(self)
+        self.max_in_flight = max(self.max_in_flight, len(self.in_flight()))
+
+
+def packets(num_of_packets):
+    return {i: bytes([i]) * PAGE_SIZE for i in range(num_of_packets)}
+
+
+def written(device, to_send):
+    return device.image(len(to_send)*PAGE_SIZE) == b''.join(to_send[i] for i in sorted(to_send))
+
+
+def test_stop_and_wait():
+    with BootloaderEmulator() as device, FlashSession(port=device.port) as session:
+        transmitter = WindowProbe(session.message_sender)
+        to_send = packets(5)
+        assert transmitter.transmit(to_send.copy())
+        assert written(device, to_send)
+        assert transmitter.max_in_flight == 1
+        assert transmitter.bytes_sent == 5*PAGE_SIZE
+
+
+def test_window_keeps_pages_in_flight():
+    with BootloaderEmulator(page_write_latency=0.01) as device, FlashSession(port=device.port) as session:
+        transmitter = WindowProbe(session.message_sender, window=4)
+        to_send = packets(12)
+        assert transmitter.transmit(to_send.copy())
+        assert written(device, to_send)
+        assert transmitter.max_in_flight == 4
+
+
+def test_retransmit_only_lost_and_nacked():
+    with BootloaderEmulator(lost_ack_pages=[2], nack_pages=[5]) as device, \
+            FlashSession(port=device.port) as session:
+        transmitter = PageTransmitter(session.message_sender, window=3, rxtimeout=0.05)
+        to_send = packets(8)
+        assert transmitter.transmit(to_send.copy())
+        assert written(device, to_send)
+        assert (transmitter.acks, transmitter.nacks, transmitter.timeouts) == (8, 1, 1)
+        assert device.page_writes[2] == 2 and device.page_writes[5] == 1
+
+
+def test_timeout():
+    with BootloaderEmulator(ack_loss_rate=1) as device, FlashSession(port=device.port) as session:
+        transmitter = PageTransmitter(session.message_sender, rxtimeout=1)
+        remaining = packets(3)
+        assert not transmitter.transmit(remaining, timeout=0.1)
+        assert len(remaining) == 3
+
+
+def test_ack_wakes_transmitter_immediately():
+    with BootloaderEmulator(page_write_latency=0.001) as device, FlashSession(port=device.port) as session:
+        transmitter = PageTransmitter(session.message_sender)
+        assert transmitter.transmit(packets(20))
+        assert transmitter.elapsed < 20*0.01
+
+
+def test_rtt_estimator():
+    estimator = RttEstimator(initial_rto=1, min_rto=0.01, max_rto=2)
+    estimator.sample(0.1)
+    assert (estimator.srtt, estimator.rttvar) == (0.1, 0.05)
+    assert abs(estimator.rto - 0.3) < 1e-9
+    for _ in range(50):
+        estimator.sample(0.1)
+    assert 0.1 < estimator.rto < 0.11
+    estimator.backoff()
+    estimator.backoff()
+    assert 0.4 < estimator.rto < 0.44 and estimator.backoffs == 2
+    for _ in range(5):
+        estimator.backoff()
+    assert estimator.rto == 2
+    estimator.sample(0.1)
+    assert estimator.rto < 0.2 and estimator.backoffs == 0
+
+
+def test_lost_ack_retransmitted_after_measured_rto():
+    with BootloaderEmulator(lost_ack_pages=[8], page_write_latency=0.005) as device, \
+            FlashSession(port=device.port) as session:
+        estimator = RttEstimator(initial_rto=1)
+        transmitter = PageTransmitter(session.message_sender, rtt_estimator=estimator)
+        to_send = packets(10)
+        assert transmitter.transmit(to_send.copy())
+        assert written(device, to_send)
+        assert transmitter.timeouts == 1
+        assert transmitter.elapsed < 0.5
+
+
+def test_timeout_scaled_with_image_size():
+    pending_requests = PendingRequests()
+    transmitter = PageTransmitter(MessageSender(lambda msg: None, pending_requests), rxtimeout=0.05)
+    t0 = time.time()
+    assert not transmitter.transmit(packets(3))
+    assert 3*3*0.05 < time.time() - t0 < 1
+
+
+def test_page_frames_match_create_message():
+    to_send = packets(3)
+    to_send[1] = to_send[1][:100]
+    frames = PageFrames(to_send, {0: 0x1234})
+    assert len(frames.buffer) == sum(12 + 2 + len(packet) for packet in to_send.values())
+    assert frames[1] == create_message(MessageSender.ID.write_to_page, packet_index_prefix(1) + to_send[1])
+    assert frames[0] == create_message(MessageSender.ID.write_to_page, packet_index_prefix(0) + to_send[0],
+                                       crc=0x1234)
+    sent = []
+    sender = MessageSender(lambda msg: sent.append(bytes(msg)))
+    context = sender.send_frame(MessageSender.ID.write_to_page, frames[2])
+    assert sent == [create_message(MessageSender.ID.write_to_page, packet_index_prefix(2) + to_send[2],
+                                   context=context)]
+
+
+def test_blank_pages():
+    page = 2048
+    image = os.urandom(page) + b'\xff'*page + b'\xff'*(page - 1) + b'\x00' + b'\xff'*10
+    assert blank_pages(image, page) == {1, 3}
+    assert sorted(packetize(image, page, skip_blank=True)[0]) == [0, 2]
+    assert sorted(packetize(image, page)[0]) == [0, 1, 2, 3]
+
+
+def test_omit_blank_pages():
+    page = 2048
+    image = os.urandom(page) + b'\xff'*page*3
+    to_send = packetize(image, page)[0]
+    assert omit_blank_pages(to_send, image, page, recorded=['a', 'b', None]) == {2, 3}
+    assert sorted(to_send) == [0, 1]     # recorded data is erased by page write
+    to_send = packetize(image, page)[0]
+    assert omit_blank_pages(to_send, image, page, erase_blank=True) == set()
+    assert len(to_send) == 4
@@ -0,0 +1,151 @@
+"""
+author: Rafal Miecznik
+contact: ravmiecznk@gmail.com
+
+Parallel reflash of many devices.
+Each port gets its own FlashSession (own context space, rx buffer and stats) run in a thread pool.
+Serial I/O releases GIL so throughput scales with number of ports until USB or CPU is saturated.
+"""
+
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from flash_session.flash_session import FlashSession, BootloaderTimeout, f_logger
+
+
+class FlashResult:
+    """
+    status: ok | failed | connection_error | bootloader_error
+    """
+    ok = 'ok'
+    failed = 'failed'
+    connection_error = 'connection_error'
+    bootloader_error = 'bootloader_error'
+
+    def __init__(self, port, status, transmitter=None, error=None, elapsed=0, skipped_pages=0, skipped_bytes=0):
+        """
+        :param skipped_pages: number of pages not sent: unchanged since last flash or blank
+        """
+        self.port = port
+        self.status = status
+        self.transmitter = transmitter
+        self.error = error
+        self.elapsed = elapsed
+        self.skipped_pages = skipped_pages
+        self.skipped_bytes = skipped_bytes
+
+    @property
+    def bytes_sent(self):
+        return self.transmitter.bytes_sent if self.transmitter is not None else 0
+
+    def __bool__(self):
+        return self.status == FlashResult.ok
+
+    def __repr__(self):
+        details = self.transmitter if self.error is None else self.error
+        if self.skipped_pages:
+            details = "{}, {} pages ({} bytes) skipped".format(details, self.skipped_pages, self.skipped_bytes)
+        return "{}: {} {}".format(self.port, self.status, details)
+
+
+class FlashOrchestrator:
+    def __init__(self, jobs, max_workers=None, timeout=None, run_app=True, progress=lambda percent: None, full=False,
+                 skip_blank=False, erase_blank=False, **session_kwargs):
+        """
+        :param jobs: dict port->image (CachedImage), same image object can be used for all ports
+        :param max_workers: thread pool size, one thread per port if None
+        :param progress: callback with aggregate progress of all ports in percent
+        :param full: flash all pages even if device's flash history is known
+        :param skip_blank: do not send pages which are entirely 0xFF, they are assumed erased on device
+        :param erase_blank: erase skipped blank pages unless flash history shows them erased, see omit_blank_pages
+        :param timeout: overall timeout of each port, scaled with image size and throughput if None
+        :param session_kwargs: FlashSession arguments: baudrate, window, rxtimeout, connection_factory, flash_history,
+                               adaptive_rto, stats_dir, prometheus_dir, capture_dir, capture_max_bytes
+        """
+        self.jobs = jobs
+        self.max_workers = max_workers or max(1, len(jobs))
+        self.timeout = timeout
+        self.run_app = run_app
+        self.progress = progress
+        self.full = full
+        self.skip_blank = skip_blank
+        self.erase_blank = erase_blank
+        self.session_kwargs = session_kwargs
+        self.port_progress = {port: 0.0 for port in jobs}
+        self.results = {}
+        self.elapsed = 0
+        self.__lock = threading.Lock()
+
+    def total_progress(self):
+        try:
+            return sum(self.port_progress.values()) / len(self.port_progress)
+        except ZeroDivisionError:
+            return 100.0
+
+    def __port_progress(self, port, percent):
+        with self.__lock:
+            self.port_progress[port] = percent
+            total = self.total_progress()
+        self.progress(total)
+
+    def flash_port(self, port, image):
+        t0 = time.time()
+        session = FlashSession(port=port, **self.session_kwargs)
+        try:
+            session.open()
+        except (IOError, OSError) as e:
+            return FlashResult(port, FlashResult.connection_error, error=e, elapsed=time.time() - t0)
+        try:
+            session.enable_bootloader()
+            result = session.flash(image, timeout=self.timeout, run_app=self.run_app, full=self.full,
+                                   skip_blank=self.skip_blank, erase_blank=self.erase_blank,
+                                   progress=lambda percent: self.__port_progress(port, percent))
+            status = FlashResult.ok if result else FlashResult.failed
+            return FlashResult(port, status, transmitter=session.transmitter, elapsed=time.time() - t0,
+                               skipped_pages=session.skipped_pages, skipped_bytes=session.skipped_bytes)
+        except BootloaderTimeout as e:
+            return FlashResult(port, FlashResult.bootloader_error, error=e, elapsed=time.time() - t0)
+        except (IOError, OSError) as e:     # SerialException included, e.g. board unplugged during flash
+            f_logger.error("%s: connection lost: %s", port, e)
+            return FlashResult(port, FlashResult.connection_error, error=e, elapsed=time.time() - t0)
+        finally:
+            session.close()
+
+    @staticmethod
+    def __result(port, future):
+        """
+        Unexpected exception of one port is its failed result, other ports results are kept
+        """
+        try:
+            return future.result()
+        except Exception as e:
+            f_logger.exception("%s: flash failed", port)
+            return FlashResult(port, FlashResult.failed, error=e)
+
+    def run(self):
+        """
+        :return: dict port->FlashResult
+        """
+        t0 = time.time()
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {port: executor.submit(self.flash_port, port, image) for port, image in self.jobs.items()}
+            self.results = {port: self.__result(port, future) for port, future in futures.items()}
+        self.elapsed = time.time() - t0
+        f_logger.debug("{}".format(self))
+        return self.results
+
+    @property
+    def bytes_sent(self):
+        return sum(r.bytes_sent for r in self.results.values())
+
+    def bytes_per_second(self):
+        try:
+            return self.bytes_sent/self.elapsed
+        except ZeroDivisionError:
+            return 0
+
+    def __repr__(self):
+        passed = sum(1 for r in self.results.values() if r)
+        return "{}/{} ports ok, {} bytes in {:.3f}s, {:.0f} B/s".format(passed, len(self.jobs), self.bytes_sent,
+                                                                        self.elapsed, self.bytes_per_second())
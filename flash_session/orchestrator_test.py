@@ -0,0 +1,57 @@
+"""
+author: Rafal Miecznik
+contact: ravmiecznk@gmail.com
+"""
+
+import os
+from contextlib import ExitStack
+
+from message_handler import MessageSender
+from image_cache import CachedImage
+from bootloader_emulator import BootloaderEmulator
+from flash_session import FlashOrchestrator, FlashResult, PACKET_SIZE
+
+
+def test_flash_many_ports():
+    image = CachedImage(os.urandom(PACKET_SIZE*5 + 10), PACKET_SIZE, [None]*6)
+    progress = []
+    with ExitStack() as stack:
+        devices = [stack.enter_context(BootloaderEmulator()) for _ in range(4)]
+        orchestrator = FlashOrchestrator({device.port: image for device in devices}, progress=progress.append)
+        results = orchestrator.run()
+    assert all(results[device.port] for device in devices)
+    assert orchestrator.bytes_sent == 4*len(image)
+    assert progress[-1] == 100
+    for device in devices:
+        assert device.image(len(image)) == bytes(image.image)
+        assert device.requests[0][1] == len(MessageSender.reserved_context)     # each port has own context space
+
+
+def test_per_port_failures():
+    image = CachedImage(b'\x00'*PACKET_SIZE, PACKET_SIZE, [None])
+    with BootloaderEmulator() as device, BootloaderEmulator(ack_loss_rate=1) as silent, \
+            BootloaderEmulator(unplug_after=MessageSender.ID.bootloader) as unplugged:
+        jobs = {device.port: image, '/dev/missing0': image, silent.port: image, unplugged.port: image}
+        results = FlashOrchestrator(jobs, timeout=0.2, rxtimeout=0.05).run()
+    assert results[device.port].status == FlashResult.ok
+    assert results['/dev/missing0'].status == FlashResult.connection_error
+    assert results[silent.port].status == FlashResult.failed
+    assert results[unplugged.port].status == FlashResult.connection_error
+
+
+def test_unexpected_error_fails_only_its_port(monkeypatch):
+    image = CachedImage(b'\x00'*PACKET_SIZE, PACKET_SIZE, [None])
+    with BootloaderEmulator() as device, BootloaderEmulator() as broken:
+        orchestrator = FlashOrchestrator({device.port: image, broken.port: image})
+        flash_port = orchestrator.flash_port
+
+        def broken_flash_port(port, image):
+            if port == broken.port:
+                raise RuntimeError("broken")
+            return flash_port(port, image)
+
+        monkeypatch.setattr(orchestrator, 'flash_port', broken_flash_port)
+        results = orchestrator.run()
+    assert results[device.port].status == FlashResult.ok
+    assert results[broken.port].status == FlashResult.failed
+    assert isinstance(results[broken.port].error, RuntimeError)
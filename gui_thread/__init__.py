@@ -3,3 +3,4 @@ author: Rafal Miecznik
 contact: ravmiecznk@gmail.com
 """
 from gui_thread.gui_thread import GuiThread, thread_this_method
+from worker_pool import PooledCall
@@ -6,34 +6,43 @@ contact: ravmiecznk@gmail.com
 import time
 from PyQt4.QtCore import QThread
 from config import LOG_PATH, thread_logger as t_logger
+from worker_pool import PooledCall, Worker, ResultTimeout
 
 info = t_logger.info
 
 
-def thread_this_method(**thread_kwargs):
+def thread_this_method(dedicated=False, **thread_kwargs):
     """
     This is decorator.
-    It will turn given method into GuiThread.
+    It will turn given method into background job run by persistent threads (see worker_pool),
+    no thread is created per start.
     Usage:
-    @thread_this_method(GuiThread args)
+    @thread_this_method(PooledCall args)
     def method(self, *method_args)
         method stuff here
 
-    start method as thread:
+    start method in background:
     method(*method_args).start()
 
     kill method thread:
     method.kill()
 
-    :param thread_kwargs:
-    :return: wrapped GuiThread object
+    :param dedicated: method gets own long lived Worker thread, for frequently started methods (rx data handling)
+    :param thread_kwargs: delay, action_when_done; with period GuiThread is used
+    :return: wrapped PooledCall, Worker or GuiThread object
     """
     def method_wraper(method):
         def method_call_wrap(*args, **kwargs):
             instance = args[0]
-            info("decorator {}: Converting method {} into {} object".format(thread_this_method.__name__, method.__name__, GuiThread.__name__))
-            info("{} with args: {}, kwargs: {}".format(GuiThread.__name__, args, thread_kwargs))
-            thread = GuiThread(method, args=args, **thread_kwargs)
+            if dedicated:
+                thread_cls = Worker
+            elif thread_kwargs.get('period'):
+                thread_cls = GuiThread
+            else:
+                thread_cls = PooledCall
+            info("decorator {}: Converting method {} into {} object".format(thread_this_method.__name__, method.__name__, thread_cls.__name__))
+            info("{} with args: {}, kwargs: {}".format(thread_cls.__name__, args, thread_kwargs))
+            thread = thread_cls(method, args=args, **thread_kwargs)
             thread.__name__ = "threaded_{}".format(method.__name__)
             setattr(instance, method.__name__, thread)
             return thread
@@ -56,10 +65,6 @@ class ThreadById:
         return self.__str__()
 
 
-class ResultTimeout(Exception):
-    pass
-
-
 class GuiThread(QThread):
     threads = []
 
@@ -239,8 +244,7 @@ class SignalThread(GuiThread):
         """
         def wrapper():
             try:
-                dbg_msg = "emit signal: name:{} id:{}".format(slot.__name__, slot)
-                t_logger.debug(dbg_msg)
+                t_logger.debug("emit signal: name:%s id:%s", slot.__name__, slot)
                 return self.general_signal.emit(slot, (), {})
             except AttributeError:
                 raise Exception("{doc}\n.{factory}: missing signal attribute. "
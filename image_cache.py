@@ -0,0 +1,168 @@
+"""
+author: Rafal Miecznik
+contact: ravmiecznk@gmail.com
+
+On-disk cache of parsed, packetized and crc'd hex images.
+Same firmware files are flashed over and over again, with cache hit there is no hex parsing at all:
+cache entry is memory mapped and packets are memoryview slices of it.
+
+Cache entry file layout (little endian):
+    magic | version | page_size | num_of_pages | image_len | crcs           | image
+    4s      B         H           I              I           H*num_of_pages   image_len bytes
+
+Entry name is built from sha1 of hex file content, its mtime, page size and start address of the segment.
+Least recently used entries are removed when cache size exceeds size_limit.
+"""
+
+import os
+import mmap
+import array
+import struct
+import hashlib
+
+from config import CACHE_PATH, CACHE_SIZE_LIMIT
+
+
+CACHE_MAGIC = b'RFLC'
+CACHE_VERSION = 1
+CACHE_HEADER = struct.Struct('<4sBHII')
+CACHE_ENTRY_EXT = '.img'
+
+
+class CachedImage(object):
+    """
+    Packetized image with precalculated page crcs
+    """
+    def __init__(self, image, page_size, crcs, mapping=None):
+        self.image = memoryview(image)
+        self.page_size = page_size
+        self.crcs = list(crcs)
+        self.__mapping = mapping
+
+    def packets(self):
+        """
+        :return: dict packet_index -> memoryview slice of image
+        """
+        return {index: self.image[offset:offset + self.page_size]
+                for index, offset in enumerate(range(0, len(self.image), self.page_size))}
+
+    def close(self):
+        """
+        Unmap cache entry, mapping stays open as long as any packet slice is still in use
+        """
+        self.image.release()
+        if self.__mapping is not None:
+            try:
+                self.__mapping.close()
+            except BufferError:
+                pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __len__(self):
+        return len(self.image)
+
+    def __repr__(self):
+        return "{}(len: {}, page_size: {}, pages: {})".format(CachedImage.__name__, len(self), self.page_size,
+                                                            len(self.crcs))
+
+
+class ImageCache(object):
+    def __init__(self, cache_path=CACHE_PATH, size_limit=CACHE_SIZE_LIMIT):
+        self.cache_path = cache_path
+        self.size_limit = size_limit
+
+    @staticmethod
+    def entry_name(file_path, page_size, start_address=0):
+        """
+        :param start_address: start address of hex file segment, each segment is separate entry
+        """
+        sha1 = hashlib.sha1()
+        with open(file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 16), b''):
+                sha1.update(chunk)
+        return "{}_{}_{}_{:x}{}".format(sha1.hexdigest(), os.stat(file_path).st_mtime_ns, page_size, start_address,
+                                        CACHE_ENTRY_EXT)
+
+    def get(self, file_path, page_size, start_address=0):
+        """
+        :return: CachedImage or None when not cached
+        """
+        entry = os.path.join(self.cache_path, self.entry_name(file_path, page_size, start_address))
+        return self.load(entry, page_size)
+
+    def load(self, entry, page_size):
+        try:
+            with open(entry, 'rb') as f:
+                mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (IOError, OSError, ValueError):
+            return None
+        try:
+            magic, version, _page_size, num_of_pages, image_len = CACHE_HEADER.unpack_from(mapping)
+            crcs_start = CACHE_HEADER.size
+            image_start = crcs_start + num_of_pages * 2
+            if magic != CACHE_MAGIC or version != CACHE_VERSION or _page_size != page_size \
+                    or image_start + image_len != len(mapping):
+                raise ValueError("corrupted cache entry")
+        except (struct.error, ValueError):
+            mapping.close()
+            self.remove(entry)
+            return None
+        crcs = array.array('H', mapping[crcs_start:image_start])
+        os.utime(entry)     # mark as recently used
+        image = memoryview(mapping)[image_start:]
+        return CachedImage(image, page_size, crcs, mapping=mapping)
+
+    def put(self, file_path, image, page_size, crcs, start_address=0):
+        """
+        Store image with its page crcs, evict least recently used entries if needed.
+        :param start_address: start address of hex file segment the image comes from
+        :return: CachedImage
+        """
+        if not os.path.isdir(self.cache_path):
+            os.makedirs(self.cache_path)
+        entry = os.path.join(self.cache_path, self.entry_name(file_path, page_size, start_address))
+        tmp_entry = entry + '.tmp'
+        with open(tmp_entry, 'wb') as f:
+            f.write(CACHE_HEADER.pack(CACHE_MAGIC, CACHE_VERSION, page_size, len(crcs), len(image)))
+            f.write(array.array('H', crcs).tobytes())
+            f.write(image)
+        os.replace(tmp_entry, entry)
+        self.evict()
+        return self.load(entry, page_size) or CachedImage(image, page_size, crcs)
+
+    def entries(self):
+        """
+        :return: list of (path, size, last use time), least recently used first
+        """
+        if not os.path.isdir(self.cache_path):
+            return []
+        entries = [(e.path, e.stat().st_size, e.stat().st_mtime) for e in os.scandir(self.cache_path)
+                   if e.is_file() and e.name.endswith(CACHE_ENTRY_EXT)]
+        entries.sort(key=lambda e: e[2])
+        return entries
+
+    def evict(self):
+        entries = self.entries()
+        total_size = sum(e[1] for e in entries)
+        for path, size, _ in entries[:-1]:      # most recent entry always stays
+            if total_size <= self.size_limit:
+                break
+            if self.remove(path):
+                total_size -= size
+
+    def clear(self):
+        for path, _, _ in self.entries():
+            self.remove(path)
+
+    @staticmethod
+    def remove(path):
+        try:
+            os.remove(path)
+            return True
+        except OSError:     # still mapped on windows
+            return False
@@ -0,0 +1,73 @@
+"""
+author: Rafal Miecznik
+contact: ravmiecznk@gmail.com
+"""
+
+import os
+import time
+
+from image_cache import ImageCache, CachedImage
+from intel_hex_handler import RecordType
+from intel_hex_handler_test import hex_record, HEX_EOF
+from flash_session import load_hex_image
+
+PAGE_SIZE = 2048
+
+
+def hex_file(tmp_path, name, content=':00000001FF\n'):
+    path = os.path.join(str(tmp_path), name)
+    with open(path, 'w') as f:
+        f.write(content)
+    return path
+
+
+def test_miss_then_hit(tmp_path):
+    cache = ImageCache(cache_path=os.path.join(str(tmp_path), 'cache'))
+    path = hex_file(tmp_path, 'app.hex')
+    image = os.urandom(PAGE_SIZE*2 + 10)
+    crcs = [1, 2, 0xffff]
+    assert cache.get(path, PAGE_SIZE) is None
+    cache.put(path, image, PAGE_SIZE, crcs)
+    cached = cache.get(path, PAGE_SIZE)
+    assert isinstance(cached, CachedImage)
+    assert bytes(cached.image) == image
+    assert cached.crcs == crcs
+    packets = cached.packets()
+    assert sorted(packets) == [0, 1, 2]
+    assert bytes(packets[2]) == image[PAGE_SIZE*2:]
+    assert cache.get(path, PAGE_SIZE*2) is None
+
+
+def test_modified_file_is_not_hit(tmp_path):
+    cache = ImageCache(cache_path=os.path.join(str(tmp_path), 'cache'))
+    path = hex_file(tmp_path, 'app.hex')
+    cache.put(path, b'\x00'*10, PAGE_SIZE, [0])
+    hex_file(tmp_path, 'app.hex', content=':00000001FF\n\n')
+    assert cache.get(path, PAGE_SIZE) is None
+
+
+def test_least_recently_used_is_evicted(tmp_path):
+    cache = ImageCache(cache_path=os.path.join(str(tmp_path), 'cache'), size_limit=2*PAGE_SIZE + 100)
+    paths = [hex_file(tmp_path, '{}.hex'.format(i), content=':00000001FF\n' * (i+1)) for i in range(3)]
+    for path in paths[:2]:
+        cache.put(path, b'\x00'*PAGE_SIZE, PAGE_SIZE, [0])
+        time.sleep(0.01)
+    assert cache.get(paths[0], PAGE_SIZE) is not None   # now paths[1] is least recently used
+    time.sleep(0.01)
+    cache.put(paths[2], b'\x00'*PAGE_SIZE, PAGE_SIZE, [0])
+    assert cache.get(paths[1], PAGE_SIZE) is None
+    assert cache.get(paths[0], PAGE_SIZE) is not None
+    assert cache.get(paths[2], PAGE_SIZE) is not None
+
+
+def test_segments_of_same_file_are_separate_entries(tmp_path):
+    path = hex_file(tmp_path, 'app.hex', hex_record(0, RecordType.data, b'\x01') +
+                    hex_record(0, RecordType.extended_segment_address, b'\x10\x00') +
+                    hex_record(0x10, RecordType.data, b'\x02\x03') + HEX_EOF)
+    cache = ImageCache(cache_path=os.path.join(str(tmp_path), 'cache'))
+    for _ in range(2):      # miss, then hit
+        with load_hex_image(path, cache) as image:
+            assert bytes(image.image) == b'\x01'
+        with load_hex_image(path, cache, start_address=0x10010) as image:
+            assert bytes(image.image) == b'\x02\x03'
+    assert len(cache.entries()) == 2
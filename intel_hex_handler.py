@@ -3,13 +3,57 @@ author: Rafal Miecznik
 contact: ravmiecznk@gmail.com
 """
 
-import platform
-platform = platform.system()
+import binascii
+
+
+class IntelHexError(Exception):
+    pass
+
+
+class RecordType:
+    """
+    Intel hex record types
+    """
+    data                    = 0x00
+    end_of_file             = 0x01
+    extended_segment_address= 0x02
+    start_segment_address   = 0x03
+    extended_linear_address = 0x04
+    start_linear_address    = 0x05
+
+
+RECORD_MIN_LEN = 5      # num_of_bytes, address(2), record type, crc
+ERASED_BYTE = b'\xff'
+
+
+def intel_hex_records(hex_lines):
+    """
+    Decode intel hex lines one by one, nothing is buffered so it can consume a file object directly.
+    Every record checksum is verified.
+    :param hex_lines: iterable of intel hex text lines (str or bytes)
+    :return: generator of tuples (line_num, record_type, address, data)
+    """
+    for line_num, hex_line in enumerate(hex_lines):
+        hex_line = hex_line.strip()
+        if not hex_line:
+            continue
+        if hex_line[:1] not in (':', b':'):
+            raise IntelHexError("Missing start code at line: {}".format(line_num))
+        try:
+            record = binascii.unhexlify(hex_line[1:])
+        except (binascii.Error, ValueError) as e:
+            raise IntelHexError("Not a hex record at line: {}: {}".format(line_num, e))
+        if len(record) < RECORD_MIN_LEN or record[0] + RECORD_MIN_LEN != len(record):
+            raise IntelHexError("Data length mismatch at line: {}. Calculated: {}, from file {}".format(
+                line_num, len(record) - RECORD_MIN_LEN, record[0]))
+        if sum(record) & 0xff:
+            raise IntelHexError("Checksum error at line: {}".format(line_num))
+        yield line_num, record[3], (record[1] << 8) | record[2], record[4:-1]
 
 
 def intel_hex_parser(hex_string_lines, info=lambda x:x):
     """
-    :param hex_string_lines: list of text lines of intel hex format
+    :param hex_string_lines: iterable of text lines of intel hex format, list of lines or opened file object
     :return: segmented binary file as dict, each segment key corresponds to target address
      INTEL HEX:
      :10010000214601360121470136007EFE09D2190140
@@ -23,58 +67,43 @@ def intel_hex_parser(hex_string_lines, info=lambda x:x):
             provieded in record type 00 (addressing up to 1MB address space)
      03 - sets reset vector, in other words it inctructs ucontroller to set application start address, e. g. if you
             want to set bootloader reset vector, you need to handle such command in you programmer
+     04 - extended linear address, 16 upper bits of 32bit address for following 00 records
+     05 - start linear address, 32bit application start address
 
+     Each 02/04 record opens a new segment keyed with the address of the first data record following it.
+     Data is placed in a segment at (address - segment address), gaps are filled with 0xFF (erased flash).
     """
     info("Parsing hex file")
-    split_by_n = lambda s, n: [s[e:e + n] for e in range(0, len(s), n)]
-    hexstr_to_int_list = lambda l: [int(e, 16) for e in l]
-    int_to_chr_list = lambda l: [chr(e) for e in l]
-
     current_bin_segment = 0
-    binary_segments = {current_bin_segment: bytes()}
+    binary_segments = {current_bin_segment: bytearray()}
+    segment = binary_segments[current_bin_segment]
     address_extension = 0
+    new_segment = False
 
-    addr_index = 2
-    addr_index_end = 6
-
-    num_of_data_index = 0
-    num_of_data_index_end = 2
-
-    record_type_index = 6
-    record_type_index_end = 8
-    data_index = 8
-    line_num = 0
-    for hex_line in hex_string_lines:
-        # if platform != 'Linux':
-        #     hex_line = hex_line + '\n'
-        hex_line = hex_line[1:-3]   # no crc, no first colon
-        num_of_data = int(hex_line[num_of_data_index:num_of_data_index_end], 16)
-        record_type = hex_line[record_type_index:record_type_index_end]
-        address_raw = hex_line[addr_index:addr_index_end]
-        if record_type == '02':
-            address_extension = hex_line[data_index:data_index+num_of_data*2]
-            address_extension = int(address_extension, 16) * 0x10
-            first_address_in_new_segment = hex_string_lines[line_num+1][1:][addr_index:addr_index_end]
-            first_address_in_new_segment = int(first_address_in_new_segment, 16) + address_extension
-            binary_segments[first_address_in_new_segment] = bytes()
-            current_bin_segment = first_address_in_new_segment
-        if record_type == '01':
+    for line_num, record_type, address, data in intel_hex_records(hex_string_lines):
+        if record_type == RecordType.data:
+            address += address_extension
+            if new_segment:
+                current_bin_segment = address
+                segment = binary_segments.setdefault(current_bin_segment, bytearray())
+                new_segment = False
+            offset = address - current_bin_segment
+            if offset < 0:
+                raise IntelHexError("Address 0x{:X} below segment 0x{:X} at line: {}".format(
+                    address, current_bin_segment, line_num))
+            if offset > len(segment):
+                segment += ERASED_BYTE * (offset - len(segment))
+            segment[offset:offset + len(data)] = data
+        elif record_type in (RecordType.extended_segment_address, RecordType.extended_linear_address):
+            shift = 4 if record_type == RecordType.extended_segment_address else 16
+            address_extension = int.from_bytes(data, 'big') << shift
+            new_segment = True
+        elif record_type in (RecordType.start_segment_address, RecordType.start_linear_address):
+            info("start address: 0x{}".format(binascii.hexlify(data).decode().upper()))
+        elif record_type == RecordType.end_of_file:
             info("reach hex file end")
-        if record_type == '00':
-            address = address_extension + int(address_raw, 16)
-            hex_data = hex_line[data_index:]
-            calc_num_of_data = int(len(hex_data)/2)
-            if num_of_data != calc_num_of_data:
-                info(hex_line)
-                exception = "Data length mismatch at line: {}. Calculated: {}, from file {}".format(line_num, calc_num_of_data, num_of_data)
-                info(exception)
-                raise Exception(exception)
-            hex_str_list = split_by_n(hex_data, 2)
-            hexstr_list_as_int = hexstr_to_int_list(hex_str_list)
-            #raw_bin_line = ''.join(int_to_chr_list(hexstr_list_as_int))
-            raw_bin_line = bytes(hexstr_list_as_int)
-            binary_segments[current_bin_segment] += raw_bin_line
-        line_num += 1
+            break
+        else:
+            raise IntelHexError("Unknown record type {:02X} at line: {}".format(record_type, line_num))
     info("parsing done")
-    return binary_segments
-
+    return {address: bytes(segment) for address, segment in binary_segments.items()}
@@ -0,0 +1,61 @@
+"""
+author: Rafal Miecznik
+contact: ravmiecznk@gmail.com
+"""
+
+import io
+import pytest
+
+from intel_hex_handler import intel_hex_parser, intel_hex_records, IntelHexError, RecordType
+
+
+def hex_record(address, record_type, data=b''):
+    record = bytes([len(data), address >> 8, address & 0xff, record_type]) + data
+    return ':{}\n'.format((record + bytes([-sum(record) & 0xff])).hex().upper())
+
+
+HEX_EOF = ':00000001FF\n'
+
+
+def test_record_example():
+    line = ':10010000214601360121470136007EFE09D2190140\n'
+    assert list(intel_hex_records([line])) == [
+        (0, RecordType.data, 0x0100, bytes.fromhex('214601360121470136007EFE09D21901'))]
+
+
+def test_checksum_error():
+    with pytest.raises(IntelHexError):
+        list(intel_hex_records([':10010000214601360121470136007EFE09D2190141\n']))
+
+
+def test_length_mismatch():
+    with pytest.raises(IntelHexError):
+        list(intel_hex_records([':11010000214601360121470136007EFE09D219013F\n']))
+
+
+def test_parse_file_object():
+    data = bytes(range(64))
+    hex_file = io.StringIO(''.join(hex_record(i, RecordType.data, data[i:i+16]) for i in range(0, 64, 16)) + HEX_EOF)
+    assert intel_hex_parser(hex_file) == {0: data}
+
+
+def test_gap_is_filled_with_erased_bytes():
+    lines = [hex_record(0, RecordType.data, b'\x01\x02'), hex_record(4, RecordType.data, b'\x03'), HEX_EOF]
+    assert intel_hex_parser(lines) == {0: b'\x01\x02\xff\xff\x03'}
+
+
+def test_extended_segment_address():
+    lines = [hex_record(0, RecordType.data, b'\x01'),
+             hex_record(0, RecordType.extended_segment_address, b'\x10\x00'),
+             hex_record(0x10, RecordType.data, b'\x02\x03'),
+             HEX_EOF]
+    assert intel_hex_parser(lines) == {0: b'\x01', 0x10010: b'\x02\x03'}
+
+
+def test_extended_linear_address_and_start_address():
+    lines = [hex_record(0, RecordType.extended_linear_address, b'\x00\x01'),
+             hex_record(0, RecordType.data, b'\xaa\xbb'),
+             hex_record(0, RecordType.start_linear_address, b'\x00\x01\x00\x00'),
+             HEX_EOF,
+             hex_record(2, RecordType.data, b'\xcc')]
+    assert intel_hex_parser(lines) == {0: b'', 0x10000: b'\xaa\xbb'}
@@ -5,6 +5,10 @@ author: Rafal Miecznik
 contact: ravmiecznk@gmail.com
 """
 import logging
+import logging.handlers
+import atexit
+import queue
+import threading
 import time
 import os
 import sys
@@ -33,8 +37,90 @@ def tstamp():
 log_format = '[%(asctime)s %(filename)s:%(lineno)d %(funcName)s thr:%(threadName)s]: %(levelname)s %(message)s'
 log_format_basic = '[%(asctime)s %(message)s'
 
+LOG_MAX_BYTES = 10*1024*1024
+LOG_BACKUP_COUNT = 3
 
-def create_logger(name, log_path=None, format=log_format, log_level=logging.DEBUG):
+
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    Puts records in queue as they are, message is formatted by writer thread,
+    so arguments of logging calls must not be modified afterwards.
+    """
+    def prepare(self, record):
+        return record
+
+
+class _FlushMarker(object):
+    """
+    Queued after records to be flushed, writer thread sets done when it gets there
+    """
+    def __init__(self):
+        self.done = threading.Event()
+
+
+class _LogWriter(logging.handlers.QueueListener):
+    """
+    Single background thread writing records of all queued loggers to their files
+    """
+    def __init__(self):
+        logging.handlers.QueueListener.__init__(self, queue.SimpleQueue())
+        self.targets = {}       # logger name -> file handler
+        self.__lock = threading.Lock()  # writer thread start/stop
+
+    def handle(self, record):
+        if isinstance(record, _FlushMarker):
+            record.done.set()
+            return
+        handler = self.targets.get(record.name)
+        if handler is not None and record.levelno >= handler.level:
+            handler.handle(record)
+
+    def add_target(self, name, handler):
+        with self.__lock:
+            self.targets[name] = handler
+            if self._thread is None:
+                self.start()
+                atexit.register(self.stop)
+
+    def stop(self):
+        with self.__lock:
+            if self._thread is not None:
+                logging.handlers.QueueListener.stop(self)
+
+    def flush(self, timeout=None):
+        """
+        Wait till all records queued so far are written, writer thread keeps running
+        :return: False on timeout
+        """
+        if self._thread is None:
+            return True
+        marker = _FlushMarker()
+        self.queue.put_nowait(marker)
+        return marker.done.wait(timeout)
+
+
+log_writer = _LogWriter()
+
+
+def set_performance_mode(enabled=True):
+    """
+    Performance mode: debug records (all per packet logging) of all loggers are dropped before being created
+    """
+    logging.disable(logging.DEBUG if enabled else logging.NOTSET)
+
+
+def performance_mode_enabled():
+    return logging.root.manager.disable >= logging.DEBUG
+
+
+def create_logger(name, log_path=None, format=log_format, log_level=logging.DEBUG, queued=True,
+                  max_bytes=LOG_MAX_BYTES, backup_count=LOG_BACKUP_COUNT):
+    """
+    Use lazy formatting in hot paths: logger.debug("context: %s", context), message is built only when written.
+    :param log_path: log is written to <log_path>/<name>.log, stdout if None
+    :param queued: log file is written by background thread (log_writer), logging call only enqueues record
+    :param max_bytes: log file is rotated when it exceeds max_bytes, backup_count old files are kept; 0 - no limit
+    """
     log_formatter = logging.Formatter(format)
     logger = logging.getLogger(name)
     if log_path is not None:
@@ -43,8 +129,11 @@ def create_logger(name, log_path=None, format=log_format, log_level=logging.DEBU
         with open(log_file, 'w') as lf:
             lf.write('')
         if not logger.handlers:
-            handler = logging.FileHandler(log_file)
+            handler = logging.handlers.RotatingFileHandler(log_file, maxBytes=max_bytes, backupCount=backup_count)
             handler.setFormatter(log_formatter)
+            if queued:
+                log_writer.add_target(name, handler)
+                handler = _DeferredQueueHandler(log_writer.queue)
             logger.addHandler(handler)
     else:
         if not logger.handlers:
@@ -54,4 +143,3 @@ def create_logger(name, log_path=None, format=log_format, log_level=logging.DEBU
 
     logger.setLevel(log_level)
     return logger
-
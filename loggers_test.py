@@ -0,0 +1,68 @@
+"""
+author: Rafal Miecznik
+contact: ravmiecznk@gmail.com
+"""
+
+import os
+import threading
+
+from loggers import create_logger, log_writer, set_performance_mode, performance_mode_enabled
+
+
+def read_log(tmpdir, name):
+    log_writer.flush()
+    return tmpdir.join(name + '.log').read()
+
+
+def test_queued_lazy_formatting(tmpdir):
+    logger = create_logger("queued_test", log_path=str(tmpdir), format='%(message)s')
+
+    class Expensive(object):
+        formatted = 0
+
+        def __repr__(self):
+            Expensive.formatted += 1
+            return "expensive"
+
+    logger.debug("value: %r", Expensive())
+    logger.info("done")
+    assert read_log(tmpdir, "queued_test") == "value: expensive\ndone\n"
+    formatted = Expensive.formatted
+    set_performance_mode()
+    try:
+        assert performance_mode_enabled()
+        logger.debug("value: %r", Expensive())
+        logger.info("still logged")
+    finally:
+        set_performance_mode(False)
+    assert read_log(tmpdir, "queued_test").endswith("done\nstill logged\n")
+    assert Expensive.formatted == formatted
+
+
+def test_rotation(tmpdir):
+    logger = create_logger("rotation_test", log_path=str(tmpdir), format='%(message)s', max_bytes=1000,
+                           backup_count=2)
+    for i in range(100):
+        logger.info("line %03d %s", i, 'x'*40)
+    log_writer.flush()
+    assert sorted(os.listdir(str(tmpdir))) == ["rotation_test.log", "rotation_test.log.1", "rotation_test.log.2"]
+    assert os.path.getsize(str(tmpdir.join("rotation_test.log"))) <= 1000
+    assert read_log(tmpdir, "rotation_test").rstrip().endswith("line 099 " + 'x'*40)
+
+
+def test_flush_keeps_single_writer_thread(tmpdir):
+    logger = create_logger("flush_test", log_path=str(tmpdir), format='%(message)s')
+    writer_thread = log_writer._thread
+
+    def log_and_add(i):
+        logger.info("line %d", i)
+        create_logger("flush_test_{}".format(i), log_path=str(tmpdir))
+        assert log_writer.flush(timeout=1)
+
+    threads = [threading.Thread(target=log_and_add, args=(i,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert log_writer._thread is writer_thread and writer_thread.is_alive()
+    assert sorted(read_log(tmpdir, "flush_test").splitlines()) == ["line {}".format(i) for i in range(8)]
@@ -24,20 +24,22 @@ except ImportError:
 
 import icons
 
-from intel_hex_handler import intel_hex_parser
-from gui_thread import thread_this_method, GuiThread
+from intel_hex_handler import IntelHexError
+from gui_thread import thread_this_method, PooledCall
 from win_com_port_handler import get_com_devices, ListPortInfo
 
 from loggers import create_logger, log_format_basic
-from message_handler import MessageSender, MessageReceiver, RxMessage
+from message_handler import MessageSender, MessageReceiver, RxMessage, PendingRequests, ContextAllocator
 from serial_handler import SerialConnection
+from flash_session import PageTransmitter, RttEstimator, load_hex_image
 from circ_io_buffer import CircIoBuffer
+from image_cache import ImageCache
+from flash_history import FlashHistory, device_id
 from config import LOG_PATH
 
 
 stdout_log = create_logger("stdout", log_path=LOG_PATH)
 dbg = stdout_log.debug
-PACKET_SIZE = 256*8
 
 logger_name = "signal_calls"
 signal_logger = create_logger(logger_name, log_path=LOG_PATH)
@@ -53,8 +55,7 @@ def general_signal_factory(slot):
     """
     def wrapper(args=(), kwargs={}):
         try:
-            dbg_msg = "emit signal: name:{} id:{} args: {} kwargs: {}".format(slot.__name__, slot, args, kwargs)
-            signal_logger.debug(dbg_msg)
+            signal_logger.debug("emit signal: name:%s id:%s args: %s kwargs: %s", slot.__name__, slot, args, kwargs)
             return general_signal_factory.signal.emit(slot, args, kwargs)
         except AttributeError as e:
             raise Exception("{factory}: missing signal attribute. Set it up with {factory}.signal={slot}".format(factory=general_signal_factory.__name__, slot=slot))
@@ -239,7 +240,7 @@ class Reflasher(QtGui.QWidget):
 
     general_signal_args_kwargs = pyqtSignal(object, object, object)
 
-    def __init__(self, app_status_file, serial_connection=None):
+    def __init__(self, app_status_file, serial_connection=None, tx_window=1):
         QtGui.QWidget.__init__(self)
         general_signal_factory.signal = self.general_signal_args_kwargs
         self.general_signal_args_kwargs.connect(self.general_signal_slot)
@@ -250,9 +251,16 @@ class Reflasher(QtGui.QWidget):
 
         self.connection = serial_connection if serial_connection is not None else None
         self.rx_buffer = CircIoBuffer(size=258*10)
-        self.rx_message_buffer = dict()     # this buffer wont't exceed number of maximum
-                                            # possible context ids in msg.id (0xffff)
+        self.pending_requests = PendingRequests()
+        self.rx_message_buffer = self.pending_requests.unsolicited  # bounded, see PendingRequests
+        self.context_allocator = ContextAllocator(MessageSender.reserved_context)
         self.packets = {}
+        self.packet_crcs = {}
+        self.tx_window = tx_window
+        self.image_cache = ImageCache()
+        self.image = None
+        self.flash_history = FlashHistory()
+        self.rtt_estimator = RttEstimator()
 
         self.message_receiver = MessageReceiver(self.rx_buffer)
 
@@ -297,6 +305,8 @@ class Reflasher(QtGui.QWidget):
         self.browse_button.setToolTip("Browse for hex file")
         self.reflash_button = QtGui.QPushButton("REFLASH")
         self.cancel_button = QtGui.QPushButton("Cancel")
+        self.full_flash_checkbox = QtGui.QCheckBox("Full reflash")
+        self.full_flash_checkbox.setToolTip("Flash all pages, not only pages changed since last reflash of device")
         self.browse_button.setMaximumSize(25, 25)
         self.browse_button.clicked.connect(self.select_file)
         self.reflash_button.clicked.connect(self.check_selected_file)
@@ -311,6 +321,7 @@ class Reflasher(QtGui.QWidget):
         mainGrid.addWidget(self.text_browser,   2, 0, 3, 5)
         mainGrid.addWidget(self.progress_bar,   5, 0, 1, 5)
         mainGrid.addWidget(self.cancel_button,  6, 0, 1, 1)
+        mainGrid.addWidget(self.full_flash_checkbox, 6, 3, 1, 1)
         mainGrid.addWidget(self.reflash_button, 6, 4, 1, 1)
         mainGrid.addWidget(self.label,          7, 0, 1, 5)
         self.setLayout(mainGrid)
@@ -334,6 +345,9 @@ class Reflasher(QtGui.QWidget):
     def close(self):
         if self.connection and self.connection.isOpen():
             self.connection.close()
+        self.data_ready_slot.kill()
+        if self.image is not None:
+            self.image.close()
         QtGui.QWidget.close(self)
 
     @thread_this_method()
@@ -343,8 +357,7 @@ class Reflasher(QtGui.QWidget):
             if connection:
                 self.connection = connection
         elif self.connection and self.connection.isOpen():
-            self.tmp = GuiThread(process=self.text_browser.append, args=("disconnecting",))
-            self.tmp.start()
+            PooledCall(process=self.text_browser.append, args=("disconnecting",)).start()
             self.connection.close()
             self.set_disconnected()
 
@@ -364,11 +377,8 @@ class Reflasher(QtGui.QWidget):
         """
         if not self.connection or not self.connection.isOpen():
             self.connection = self.establish_connection()
-            test_connection_thread = GuiThread(process=self.test_connection_with_req, args=(self.connection,))
-            test_connection_thread.start()
-            while test_connection_thread.returned() is None:
-                pass
-            if test_connection_thread.returned() is False:
+            test_connection_thread = PooledCall(process=self.test_connection_with_req, args=(self.connection,))
+            if test_connection_thread.start().get_result(timeout=None) is False:
                 self.text_browser.append("Connection test failed")
                 self.connection = None
             else:
@@ -382,13 +392,10 @@ class Reflasher(QtGui.QWidget):
         """
         Do until message available
         """
-        msg = self.message_receiver.get_message()
-        stdout_log.debug("msg: ".format(msg))
-        while msg:
-            self.rx_message_buffer[msg.context] = msg
-            msg = self.message_receiver.get_message()
+        for msg in self.message_receiver.get_messages():
+            self.pending_requests.dispatch(msg)
 
-    @thread_this_method()
+    @thread_this_method(dedicated=True)
     def data_ready_slot(self):
         """
         Slot called on 'data available in the buffer' event
@@ -433,32 +440,26 @@ class Reflasher(QtGui.QWidget):
             self.line_edit.setText(self.last_hex_path)
 
     def check_selected_file(self):
+        if self.reflash.running():     # reflash uses current image
+            self.text_browser.append("Reflashing in progress")
+            return
         try:
             file_path = self.line_edit.text()
-            with open(file_path) as hex_file:
-                hex_lines = hex_file.readlines()
-                bin_segments = intel_hex_parser(hex_lines, self.text_browser.append)
-                start_address = 0
-                self.text_browser.append("Reflash with:\n{}\n".format(file_path))
-                self.bin_segments_to_packets(bin_segments[start_address])
-                self.reflash.start()
+            image = load_hex_image(file_path, self.image_cache, info=self.text_browser.append)
+            if self.image is not None:
+                self.image.close()      # unmap previous cache entry
+            self.image = image
+            self.text_browser.append("Image: {}".format(self.image))
+            self.packets = self.image.packets()
+            self.packet_crcs = dict(enumerate(self.image.crcs))
+            self.text_browser.append("Reflash with:\n{}\n".format(file_path))
+            self.reflash.start()
         except IOError:
             self.text_browser.append("File not present or faulty:\n{}".format(file_path))
+        except IntelHexError as e:
+            self.text_browser.append("Hex file corrupted:\n{}\n{}".format(file_path, e))
 
 
-    def bin_segments_to_packets(self, bin_segments):
-        self.packets = {}
-        cnt = 0
-        # print(bin_segments)
-        # for i in range(0, len(bin_segments), 16):
-        #     s = bin_segments[i: i+16]
-        #     print((len(s)*'{:02X}').format(*s))
-        # return
-        for i in range(0, len(bin_segments), PACKET_SIZE):
-            self.packets[cnt] = bin_segments[i:i+PACKET_SIZE]
-            cnt += 1
-        return self.packets
-
     def establish_connection(self):
         conn_type = self.com_devices.get_connection_type()
         if conn_type == "COM":
@@ -486,23 +487,25 @@ class Reflasher(QtGui.QWidget):
         """
         retx = 3
         timeout = 1
-        self.rx_message_buffer = {}
+        self.rx_message_buffer.clear()
         try:
-            MessageSender(connection.write).send(MessageSender.ID.bootloader)
-        except (serial.serialutil.SerialTimeoutException, AttributeError):
+            message_sender = MessageSender(connection.write, self.pending_requests, self.context_allocator)
+        except AttributeError:
             self.text_browser.append("Connection write test failed")
             return False
 
         while retx > 0:
-            t0 = time.time()
-            while b'bootloader3' not in [self.rx_message_buffer[m].msg for m in self.rx_message_buffer]:
-                time.sleep(0.1)
-                if time.time() - t0 > timeout:
-                    MessageSender(connection.write).send(MessageSender.ID.bootloader)
-                    retx -= 1
-                    break
-            else:
+            try:
+                reply = message_sender.send(MessageSender.ID.bootloader)
+            except serial.serialutil.SerialTimeoutException:
+                self.text_browser.append("Connection write test failed")
+                return False
+            bootloader_responded = lambda: (reply.done() and b'bootloader3' in reply.rx_message.msg) or \
+                any(b'bootloader3' in m.msg for m in self.rx_message_buffer.values())
+            if self.pending_requests.wait_for(bootloader_responded, timeout):
                 return True
+            self.pending_requests.cancel(reply)
+            retx -= 1
         else:
             self.text_browser.append("Can't enable bootloader")
             return False
@@ -512,50 +515,32 @@ class Reflasher(QtGui.QWidget):
         """
         Main reflashing thread
         """
-        reflash_timeout = 30
-        rxtimeout = 1
         self.progress_bar.set_val_signal.emit(0)
         if self.connection is None or not self.connection.isOpen():
             self.connection = self.establish_connection()
 
-        test_connection_thread = GuiThread(process=self.test_connection_with_req, args=(self.connection,))
-        test_connection_thread.start()
-        if test_connection_thread.get_result(timeout=2) is False:
+        test_connection_thread = PooledCall(process=self.test_connection_with_req, args=(self.connection,))
+        if test_connection_thread.start().get_result(timeout=2) is False:
             self.text_browser.append("Bootloader did not repsond !")
             return
 
-        message_sender = MessageSender(self.connection.send)
-        message_sender.send(MessageSender.ID.rxflush)
-        num_of_packets = len(self.packets)
-        t0 = time.time()
-        context_to_packet_index_map = {}
-        self.rx_message_buffer = {}     #reset rx message buffer
-        while self.packets:
-            packet_index = list(self.packets.keys())[0]
-
-            context = message_sender.send(MessageSender.ID.write_to_page,
-                                body=struct.pack('H', packet_index) + self.packets[packet_index])
-
-            context_to_packet_index_map[context] = packet_index
-            tx_t0 = time.time()
-            while context not in self.rx_message_buffer:
-                time.sleep(0.01)
-                if time.time() - tx_t0 > rxtimeout:
-                    dbg('timeout for context: {}'.format(context))
-                    break
-            else:
-                if self.rx_message_buffer[context].id == RxMessage.RxId.ack:
-                    __packet_index = context_to_packet_index_map[context]
-                    self.packets.pop(__packet_index)
-                self.rx_message_buffer.pop(context)
-                context_to_packet_index_map.pop(context)
-                self.progress_bar.set_val_signal.emit(100*float(num_of_packets-len(self.packets))/num_of_packets)
-
-            if time.time() - t0 > reflash_timeout:
-                self.text_browser.append("REFLASHING FAILED")
-                return
+        message_sender = MessageSender(self.connection.send, self.pending_requests, self.context_allocator)
+        self.pending_requests.cancel(message_sender.send(MessageSender.ID.rxflush))
+        self.rx_message_buffer.clear()     #reset rx message buffer
+        device = device_id(self.com_devices.get_current_serial_device())
+        packets, hashes = self.flash_history.start_flash(device, self.image,
+                                                         full=self.full_flash_checkbox.isChecked())
+        if len(packets) < len(self.packets):
+            self.text_browser.append("{} of {} pages changed since last reflash".format(len(packets),
+                                                                                    len(self.packets)))
+        transmitter = PageTransmitter(message_sender, window=self.tx_window, rtt_estimator=self.rtt_estimator)
+        if not transmitter.transmit(packets, self.packet_crcs, progress=self.progress_bar.set_val_signal.emit):
+            self.text_browser.append("REFLASHING FAILED")
+            return
+        self.flash_history.finish_flash(device, self.image, hashes)
         self.text_browser.append("REFLASHING FINISHED")
-        self.text_browser.append("{}".format(time.time()-t0))
+        self.text_browser.append("{:.3f}s, {:.0f} B/s".format(transmitter.elapsed, transmitter.bytes_per_second()))
+        dbg("transmission: {}".format(transmitter))
         message_sender.send(MessageSender.ID.run_main_app_btl)
         self.cancel_button.setText("CLOSE")
 
@@ -3,4 +3,5 @@ author: Rafal Miecznik
 contact: ravmiecznk@gmail.com
 """
 
-from message_handler.message_handler import MessageSender, MessageReceiver, RxMessage, TransmissionStats, TxTimeout
\ No newline at end of file
+from message_handler.message_handler import MessageSender, MessageReceiver, RxMessage, TransmissionStats, TxTimeout, \
+    PendingRequests, PendingReply, ContextAllocator, ExpiringTable
\ No newline at end of file
@@ -0,0 +1,78 @@
+"""
+author: Rafal Miecznik
+contact: ravmiecznk@gmail.com
+
+Precompiled struct codecs of atm128_bootloader_v3 messages, native byte order and standard sizes.
+
+Host to device message, header first:
+ >ID CONTEXT BODY_LEN CRC<MESSAGE_BODY
+  2  2       4        2   ?bytes
+Device to host message, body first and tail in the end:
+ MESSAGE_BODY<ID CONTEXT MSG_LEN BODY_CRC>TAIL_CRC
+ ?bytes       2  2       2       2          2
+"""
+
+import struct
+import binascii
+
+
+MESSAGE_HEADER = struct.Struct('=cHHIHc')
+MESSAGE_CONTEXT = struct.Struct('=H')
+MESSAGE_CONTEXT_OFFSET = 3
+TAIL = struct.Struct('=cHHH2sc')
+TAIL_FIELDS = struct.Struct('=HHH')         # id, context, msg_len at offset 1 of tail
+TAIL_CRC = struct.Struct('=H')
+TAIL_START = b'<'
+TAIL_END = b'>'
+HEADER_START = b'>'
+HEADER_END = b'<'
+
+
+def message_size(body_len):
+    return MESSAGE_HEADER.size + body_len
+
+
+def pack_header_into(buffer, offset, msg_id, context, body_len, crc):
+    """
+    :param crc: body crc as integer
+    """
+    MESSAGE_HEADER.pack_into(buffer, offset, HEADER_START, msg_id, context, body_len, crc, HEADER_END)
+
+
+def pack_message_into(buffer, offset, msg_id, body, context=0, crc=None):
+    """
+    Write whole message into caller supplied buffer, no intermediate objects are created
+    :param buffer: bytearray (or writable memoryview) with at least message_size(len(body)) bytes from offset
+    :param crc: precalculated body crc (integer), calculated here if None
+    :return: offset of first byte after message
+    """
+    body_len = len(body)
+    if crc is None:
+        crc = binascii.crc_hqx(body, 0)
+    pack_header_into(buffer, offset, msg_id, context, body_len, crc)
+    start = offset + MESSAGE_HEADER.size
+    buffer[start:start + body_len] = body
+    return start + body_len
+
+
+def set_context(message, context):
+    """
+    Patch context field of message created in advance
+    """
+    MESSAGE_CONTEXT.pack_into(message, MESSAGE_CONTEXT_OFFSET, context)
+
+
+def pack_tail(msg_id, context, body):
+    """
+    :return: device message tail with its crc, see bootloader_emulator.device_message
+    """
+    tail = TAIL.pack(TAIL_START, msg_id, context, len(body), TAIL_CRC.pack(binascii.crc_hqx(body, 0)), TAIL_END)
+    return tail + TAIL_CRC.pack(binascii.crc_hqx(tail, 0))
+
+
+def decode_tail(full_tail):
+    """
+    :param full_tail: memoryview (or bytes) of tail with tail crc, TAIL.size + TAIL_CRC.size bytes
+    :return: tuple(id, context, msg_len) - tail marks and crc are not checked here
+    """
+    return TAIL_FIELDS.unpack_from(full_tail, 1)
@@ -0,0 +1,39 @@
+"""
+author: Rafal Miecznik
+contact: ravmiecznk@gmail.com
+"""
+
+import struct
+
+from message_handler.crc import crc_bytes
+from message_handler.codec import pack_message_into, message_size, set_context, pack_tail, decode_tail, \
+    MESSAGE_HEADER
+from message_handler.message_handler import create_message
+
+
+def reference_message(msg_id, body, context):
+    # message layout as built before codec
+    return b'>' + struct.pack('H', msg_id) + struct.pack('H', context) + struct.pack('I', len(body)) + \
+           crc_bytes(body) + b'<' + body
+
+
+def test_create_message_layout():
+    assert create_message(1, b'page', context=300) == reference_message(1, b'page', 300)
+    assert create_message(1, b'', context=2) == reference_message(1, b'', 2)
+    assert create_message(1, b'page', crc=0xabcd)[9:11] == struct.pack('H', 0xabcd)
+
+
+def test_pack_into_buffer_and_set_context():
+    buffer = bytearray(message_size(4) + message_size(3))
+    offset = pack_message_into(buffer, 0, 1, b'page', context=5)
+    assert offset == MESSAGE_HEADER.size + 4
+    assert pack_message_into(buffer, offset, 2, b'abc') == len(buffer)
+    set_context(memoryview(buffer)[offset:], 7)
+    assert buffer == reference_message(1, b'page', 5) + reference_message(2, b'abc', 7)
+
+
+def test_tail():
+    tail = pack_tail(3, 0x1234, b'body')
+    assert tail == b'<' + struct.pack('HHH', 3, 0x1234, 4) + crc_bytes(b'body') + b'>' + \
+        crc_bytes(tail[:10])
+    assert decode_tail(memoryview(tail)) == (3, 0x1234, 4)
@@ -0,0 +1,72 @@
+"""
+author: Rafal Miecznik
+contact: ravmiecznk@gmail.com
+"""
+
+import os
+import struct
+
+from message_handler.crc import crc_bytes, crc_xmodem, crc_xmodem_table, crc16_xmodem, CrcXmodem, page_crcs
+
+
+def crc_bytes_reference(buffer):
+    crc = 0
+    for i in buffer:
+        crc = crc_xmodem(crc, i)
+    return struct.pack('H', crc)
+
+
+def test_crc_xmodem_check_value():
+    """CRC-16/XMODEM check value for '123456789'"""
+    assert crc16_xmodem(b'123456789') == 0x31C3
+
+
+def test_table_matches_bitwise():
+    for crc in (0, 0x1021, 0x8000, 0xffff, 0x1234):
+        for byte in range(256):
+            assert crc_xmodem_table(crc, byte) == crc_xmodem(crc, byte)
+
+
+def test_crc_bytes_bit_exact():
+    assert crc_bytes(b'') == crc_bytes_reference(b'')
+    for length in (1, 2, 15, 256, 2050):
+        data = os.urandom(length)
+        assert crc_bytes(data) == crc_bytes_reference(data)
+        assert crc_bytes(bytearray(data)) == crc_bytes_reference(data)
+        assert crc_bytes(memoryview(data)) == crc_bytes_reference(data)
+
+
+def test_incremental_crc():
+    data = os.urandom(2048)
+    crc = CrcXmodem()
+    for i in range(0, len(data), 100):
+        crc.update(data[i:i+100])
+    assert crc.digest() == crc_bytes(data)
+    assert crc.value == crc16_xmodem(data)
+    assert CrcXmodem(data).digest() == crc_bytes(data)
+
+
+def test_incremental_crc_copy():
+    crc = CrcXmodem(b'abc')
+    fork = crc.copy().update(b'def')
+    assert crc.digest() == crc_bytes(b'abc')
+    assert fork.digest() == crc_bytes(b'abcdef')
+
+
+def test_page_crcs():
+    page_size = 2048
+    image = os.urandom(page_size*3 + 100)
+    crcs = page_crcs(image, page_size)
+    assert len(crcs) == 4
+    for page_num, crc in enumerate(crcs):
+        page = image[page_num*page_size: (page_num+1)*page_size]
+        assert struct.pack('H', crc) == crc_bytes(page)
+
+
+def test_page_crcs_with_prefix():
+    page_size = 2048
+    image = os.urandom(page_size*2)
+    index_prefix = lambda page_num: struct.pack('H', page_num)
+    for page_num, crc in enumerate(page_crcs(memoryview(image), page_size, page_prefix=index_prefix)):
+        body = index_prefix(page_num) + image[page_num*page_size: (page_num+1)*page_size]
+        assert struct.pack('H', crc) == crc_bytes(body)
@@ -15,17 +15,20 @@ given msg len it is possible to extract it from rx buffer
 
 """
 
-import struct
+import os
+import json
+import math
 import time
-import sys
-
-from datetime import datetime
-from message_handler.crc import crc_bytes
-from random import randrange
+import bisect
+import logging
+import threading
+from collections import deque, OrderedDict
+
+from message_handler.crc import crc16_xmodem
+from message_handler.codec import TAIL_CRC, pack_message_into, message_size, set_context, \
+    decode_tail
 from loggers import create_logger
-from PyQt4.QtCore import QMutex
 
-from auxiliary_module import Uint16, MeanCalculator
 from config import LOG_PATH
 
 
@@ -35,6 +38,12 @@ m_logger = create_logger(logger_name, log_path=LOG_PATH, format=log_format)
 
 
 MAX_PACKET_SIZE = 256*8 + 20
+CONTEXT_SPACE = 0x10000
+PENDING_LIMIT = 1024            # requests waiting for response
+PENDING_TTL = 60                # [s] request without response is forgotten after that time
+UNSOLICITED_LIMIT = 256         # received messages nobody waited for
+UNSOLICITED_TTL = 60
+WALL_CLOCK_OFFSET_NS = time.time_ns() - time.monotonic_ns()     # monotonic_ns -> time_ns
 
 
 class MsgLockTimeout(Exception):
@@ -49,44 +58,361 @@ class TxTimeout(Exception):
     pass
 
 
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)    # seconds
+MAX_LATENCY_SAMPLES = 10000
+RATE_WINDOW = 1.0   # seconds, instantaneous bytes/s is averaged over this period
+
+
 class TransmissionStats:
     """
-    Keeps track of ack/nack ratio
+    Keeps track of ack/nack ratio, timeouts, retransmits, throughput, page round trip latency
+    and rx buffer high-water mark of one transmission.
     """
     def __init__(self):
         self.__acks = 0
         self.__nacks = 0
+        self.timeouts = 0
+        self.retransmits = 0
+        self.bytes_sent = 0
+        self.rx_high_water = 0
+        self.t0 = time.time()
+        self.t_end = None
+        self.latency_buckets = [0] * len(LATENCY_BUCKETS)
+        self.latency_sum = 0
+        self.latency_count = 0
+        self.__latencies = deque(maxlen=MAX_LATENCY_SAMPLES)
+        self.__recent = deque()     # (tstamp, bytes) of last RATE_WINDOW
+
+    @property
+    def acks(self):
+        return self.__acks
+
+    @property
+    def nacks(self):
+        return self.__nacks
 
-    def ack(self):
+    def ack(self, num_of_bytes=0, latency=None):
+        """
+        :param num_of_bytes: acked page size
+        :param latency: page round trip time [s]
+        """
         self.__acks += 1
+        if num_of_bytes:
+            self.bytes_sent += num_of_bytes
+            now = time.time()
+            self.__recent.append((now, num_of_bytes))
+            while self.__recent[0][0] < now - RATE_WINDOW:
+                self.__recent.popleft()
+        if latency is not None:
+            self.latency(latency)
 
     def nack(self):
         self.__nacks += 1
 
+    def timeout(self):
+        self.timeouts += 1
+
+    def retransmit(self):
+        self.retransmits += 1
+
+    def latency(self, seconds):
+        self.__latencies.append(seconds)
+        self.latency_sum += seconds
+        self.latency_count += 1
+        index = bisect.bisect_left(LATENCY_BUCKETS, seconds)
+        if index < len(LATENCY_BUCKETS):
+            self.latency_buckets[index] += 1
+
+    def rx_buffered(self, num_of_bytes):
+        self.rx_high_water = max(self.rx_high_water, num_of_bytes)
+
+    def stop(self):
+        self.t_end = time.time()
+
+    @property
+    def elapsed(self):
+        return (self.t_end if self.t_end is not None else time.time()) - self.t0
+
+    def bytes_per_second(self):
+        """
+        Average since start
+        """
+        try:
+            return self.bytes_sent/self.elapsed
+        except ZeroDivisionError:
+            return 0
+
+    def instant_bytes_per_second(self):
+        """
+        Average of last RATE_WINDOW seconds
+        """
+        now = self.t_end if self.t_end is not None else time.time()
+        return sum(b for t, b in self.__recent if t >= now - RATE_WINDOW)/RATE_WINDOW
+
+    def percentile(self, percent):
+        """
+        Nearest-rank percentile of page latency
+        :return: seconds or None when no samples
+        """
+        if not self.__latencies:
+            return None
+        latencies = sorted(self.__latencies)
+        return latencies[max(0, int(math.ceil(percent/100.0*len(latencies))) - 1)]
+
+    def as_dict(self):
+        return {
+            "acks": self.acks,
+            "nacks": self.nacks,
+            "timeouts": self.timeouts,
+            "retransmits": self.retransmits,
+            "bytes_sent": self.bytes_sent,
+            "elapsed": self.elapsed,
+            "bytes_per_second": self.bytes_per_second(),
+            "instant_bytes_per_second": self.instant_bytes_per_second(),
+            "latency": {
+                "p50": self.percentile(50),
+                "p95": self.percentile(95),
+                "p99": self.percentile(99),
+                "count": self.latency_count,
+                "sum": self.latency_sum,
+                "buckets": dict(zip(LATENCY_BUCKETS, self.latency_buckets)),
+            },
+            "rx_high_water": self.rx_high_water,
+        }
+
+    def to_json(self):
+        return json.dumps(self.as_dict(), indent=2)
+
+    def prometheus(self, labels=None, prefix='reflasher'):
+        """
+        :param labels: dict label->value attached to every sample, e.g. {'port': '/dev/ttyUSB0'}
+        :return: metrics in Prometheus text exposition format
+        """
+        labels = labels or {}
+
+        def sample(name, value, **extra):
+            all_labels = dict(labels, **extra)
+            label_str = ','.join('{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+                                 for k, v in all_labels.items())
+            return "{}_{}{} {}".format(prefix, name, '{' + label_str + '}' if label_str else '', value)
+
+        lines = []
+        for name, kind, help_text, value in (
+                ("acks_total", "counter", "Acked pages", self.acks),
+                ("nacks_total", "counter", "Nacked pages", self.nacks),
+                ("timeouts_total", "counter", "Page ack timeouts", self.timeouts),
+                ("retransmits_total", "counter", "Retransmitted pages", self.retransmits),
+                ("bytes_sent_total", "counter", "Acked page bytes", self.bytes_sent),
+                ("bytes_per_second", "gauge", "Average throughput of last flash", self.bytes_per_second()),
+                ("rx_high_water_bytes", "gauge", "Rx buffer high-water mark", self.rx_high_water),
+                ("last_flash_timestamp_seconds", "gauge", "End of last flash", self.t_end or time.time())):
+            lines.append("# HELP {}_{} {}".format(prefix, name, help_text))
+            lines.append("# TYPE {}_{} {}".format(prefix, name, kind))
+            lines.append(sample(name, value))
+        lines.append("# HELP {}_page_latency_seconds Page round trip time".format(prefix))
+        lines.append("# TYPE {}_page_latency_seconds histogram".format(prefix))
+        cumulative = 0
+        for bucket, count in zip(LATENCY_BUCKETS, self.latency_buckets):
+            cumulative += count
+            lines.append(sample("page_latency_seconds_bucket", cumulative, le=bucket))
+        lines.append(sample("page_latency_seconds_bucket", self.latency_count, le="+Inf"))
+        lines.append(sample("page_latency_seconds_sum", self.latency_sum))
+        lines.append(sample("page_latency_seconds_count", self.latency_count))
+        lines.append("# HELP {}_page_latency_quantile_seconds Page round trip time percentiles".format(prefix))
+        lines.append("# TYPE {}_page_latency_quantile_seconds gauge".format(prefix))
+        for quantile in (50, 95, 99):
+            value = self.percentile(quantile)
+            lines.append(sample("page_latency_quantile_seconds", value if value is not None else 'NaN',
+                                quantile=quantile/100.0))
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path, labels=None):
+        """
+        Write textfile for node_exporter textfile collector, file is replaced atomically
+        """
+        with open(path + '.tmp', 'w') as f:
+            f.write(self.prometheus(labels))
+        os.replace(path + '.tmp', path)
+
     def __repr__(self):
         try:
             err_rate = float(self.__nacks)/self.__acks
         except ZeroDivisionError:
             err_rate = 0
-        return "acks: {}, nack: {}, err_rate: {}".format(self.__acks, self.__nacks, err_rate)
+        latency = ', '.join("p{}: {:.1f}ms".format(p, self.percentile(p)*1000) for p in (50, 95, 99)) \
+            if self.latency_count else "no latency samples"
+        return "acks: {}, nack: {}, err_rate: {}, timeouts: {}, retransmits: {}, {:.0f} B/s, {}, " \
+               "rx high-water: {}".format(self.__acks, self.__nacks, err_rate, self.timeouts, self.retransmits,
+                                          self.bytes_per_second(), latency, self.rx_high_water)
+
+
+class PendingReply(int):
+    """
+    Context of sent request which can be waited for.
+    It is still an integer so it can be used as context anywhere.
+    """
+    def __new__(cls, context):
+        obj = int.__new__(cls, context)
+        obj.tstamp = time.time()
+        obj.rx_tstamp = None
+        obj.rx_message = None
+        obj.__event = threading.Event()
+        return obj
+
+    def set(self, rx_message):
+        self.rx_tstamp = time.time()
+        self.rx_message = rx_message
+        self.__event.set()
+
+    def done(self):
+        return self.__event.is_set()
+
+    def wait(self, timeout=None):
+        """
+        :return: RxMessage or None on timeout
+        """
+        self.__event.wait(timeout)
+        return self.rx_message
+
+
+class ExpiringTable(OrderedDict):
+    """
+    Dict with size cap and time to live, kept in insertion order (key set again becomes the newest one).
+    On each insert the oldest entries are evicted while table is over max_size or they are older than ttl,
+    so both memory and lookups stay bounded on long runs.
+    """
+    def __init__(self, max_size, ttl, tstamp, clock=time.time):
+        """
+        :param tstamp: callable returning insertion time of value, in clock units
+        """
+        OrderedDict.__init__(self)
+        self.max_size = max_size
+        self.ttl = ttl
+        self.tstamp = tstamp
+        self.clock = clock
+        self.evicted = 0
+
+    def __setitem__(self, key, value):
+        OrderedDict.__setitem__(self, key, value)
+        self.move_to_end(key)
+        self.expire()
+
+    def expire(self):
+        oldest_allowed = self.clock() - self.ttl
+        while self:
+            key, value = next(iter(self.items()))
+            if len(self) <= self.max_size and self.tstamp(value) >= oldest_allowed:
+                break
+            del self[key]
+            self.evicted += 1
+
+
+def pending_table():
+    return ExpiringTable(PENDING_LIMIT, PENDING_TTL, tstamp=lambda reply: reply.tstamp)
+
+
+def unsolicited_table():
+    return ExpiringTable(UNSOLICITED_LIMIT, UNSOLICITED_TTL, tstamp=lambda rx_message: rx_message.tstamp_ns/1e9,
+                         clock=time.monotonic)
+
+
+class PendingRequests:
+    """
+    Registry of requests waiting for response.
+    Each received message is dispatched here: if its context was registered, waiter wakes up immediately,
+    otherwise message lands in unsolicited dict context->RxMessage.
+    Both tables are ExpiringTable: requests not answered within PENDING_TTL are forgotten (waiter times out),
+    only UNSOLICITED_LIMIT most recent unsolicited messages are kept.
+    """
+    def __init__(self, unsolicited=None):
+        self.unsolicited = unsolicited if unsolicited is not None else unsolicited_table()
+        self.__pending = pending_table()
+        self.__condition = threading.Condition()
+
+    def register(self, context):
+        reply = PendingReply(context)
+        with self.__condition:
+            self.__pending[int(context)] = reply
+        return reply
+
+    def cancel(self, context):
+        with self.__condition:
+            return self.__pending.pop(int(context), None)
+
+    def dispatch(self, rx_message):
+        """
+        :return: True if message completed a pending request
+        """
+        with self.__condition:
+            reply = self.__pending.pop(rx_message.context, None)
+            if reply is not None:
+                reply.set(rx_message)
+            else:
+                self.unsolicited[rx_message.context] = rx_message
+            self.__condition.notify_all()
+        return reply is not None
+
+    def wait_for(self, predicate, timeout=None):
+        """
+        Wait until predicate is true, it is checked each time message is dispatched
+        """
+        with self.__condition:
+            return self.__condition.wait_for(predicate, timeout)
+
+    def wait_any(self, replies, timeout=None):
+        """
+        :return: list of completed replies, empty on timeout
+        """
+        self.wait_for(lambda: any(r.done() for r in replies), timeout)
+        return [r for r in replies if r.done()]
+
+    def __len__(self):
+        return len(self.__pending)
+
+
+class ContextAllocator:
+    """
+    Source of message contexts. Each session (device) should own one, then context spaces never collide.
+    Whole uint16 space is used, reserved context ids are skipped.
+    """
+    def __init__(self, reserved_context=()):
+        self.reserved_context = frozenset(reserved_context)
+        if len(self.reserved_context) >= CONTEXT_SPACE:
+            raise ValueError("no context left")
+        self.__context = 0
+        self.__lock = threading.Lock()
+        self.__skip_reserved()
+
+    def __skip_reserved(self):
+        while self.__context in self.reserved_context:
+            self.__context = (self.__context + 1) & (CONTEXT_SPACE - 1)
+
+    def allocate(self):
+        with self.__lock:
+            context = self.__context
+            self.__context = (context + 1) & (CONTEXT_SPACE - 1)
+            self.__skip_reserved()
+        return context
+
+    def peek(self):
+        return self.__context
 
 
 class MessageSender:
     """
-    static fileds:
-        context: to keep track of msg req<->resp mechanism msg context is attached.
-                 Thanks to this value it is possible to find right response for given request.
-                 There are context ids reserved for particular messages handling:
-                 0: free text which should be displayed in console window
-                 1: digidiag frame data
-                 Message sender cant assign reserved_context id when message is created and sent.
+    Each message gets context id which device puts in its response, so response is matched with its request.
+    Contexts come from ContextAllocator, each connection (session) should own one: whole uint16 space is used
+    and context spaces of different devices never collide. Senders without own allocator share class level one.
+    reserved_context ids are never allocated, device uses them for unsolicited messages:
+        0: free text which should be displayed in console window
+        1: digidiag frame data
     """
 
     reserved_context = (
         0,
         1,
     )
-    context = Uint16(len(reserved_context)) #start with value greater than reserved_context
+    context_allocator = ContextAllocator(reserved_context)
     lock = False
 
     class ID:
@@ -103,38 +429,57 @@ class MessageSender:
 
         @classmethod
         def translate_id(cls, m_id):
-            try:
-                return [p[0] for p in MessageSender.ID.__dict__.items() if p[1] == m_id][0]
-            except IndexError:
-                return None
+            return MESSAGE_ID_NAMES.get(m_id)
 
-    def __init__(self, tx_interface):
-        self.mutex = QMutex()
+    def __init__(self, tx_interface, pending_requests=None, context_allocator=None):
+        """
+        :param tx_interface: write method
+        :param pending_requests: PendingRequests, when given send returns PendingReply which can be waited for
+        :param context_allocator: ContextAllocator, class level one shared by all senders if None
+        """
+        self.mutex = threading.Lock()
         self.__transmit = tx_interface
+        self.pending_requests = pending_requests
+        self.context_allocator = context_allocator if context_allocator is not None \
+            else MessageSender.context_allocator
 
-    def __send_m(self, msg, m_id):
+    def __send_m(self, msg, m_id, context):
         """
         Send createad message.
-         Avoid using recovered context_ids
-        """
-        context = MessageSender.context
-        MessageSender.context += 1
-        while MessageSender.context in MessageSender.reserved_context:
-            MessageSender.context += 1
-        translated_m_id = MessageSender.ID.translate_id(m_id)
-        m_logger.debug("Sent message with context: {}, id: {}({})".format(context, translated_m_id, m_id))
-        m_logger.debug(msg[11:30])
-        self.__transmit(msg)
+        """
+        if self.pending_requests is not None and m_id is not None:
+            context = self.pending_requests.register(context)   # before transmit, response may come any time
+        if m_logger.isEnabledFor(logging.DEBUG):
+            m_logger.debug("Sent message with context: %s, id: %s(%s) %s", context,
+                           MessageSender.ID.translate_id(m_id), m_id, bytes(msg[11:30]))
+        try:
+            self.__transmit(msg)
+        except Exception:
+            if self.pending_requests is not None and m_id is not None:
+                self.pending_requests.cancel(context)   # no response will come for message not sent
+            raise
         return context
 
     def peek_context(self):
-        return MessageSender.context + 1
+        return self.context_allocator.peek()
 
-    def send(self, m_id, body=b'NULL'):
+    def send(self, m_id, body=b'NULL', crc=None):
         """
         Polymorphic method for send
+        :param crc: precalculated body crc (integer), calculated on the fly if None
         """
-        return self.__send(m_id, body)
+        return self.__send(m_id, body, crc)
+
+    def send_frame(self, m_id, frame):
+        """
+        Send message created in advance in writable buffer (see flash_session.PageFrames),
+        only its context field is set here. tx_interface must not keep the frame after it returns.
+        :param frame: memoryview of whole message
+        """
+        context = self.context_allocator.allocate()
+        set_context(frame, context)
+        with self.mutex:
+            return self.__send_m(frame, m_id, context)
 
     def send_raw_msg(self, body):
         """
@@ -142,13 +487,14 @@ class MessageSender:
         """
         return self.__send(m_id=None, body=body)
 
-    def __send(self, m_id=None, body='NULL'):
-        msg = create_message(msg_id=m_id, body=body, context=MessageSender.context) if m_id is not None else body
-        self.mutex.lock()
-        context = self.__send_m(msg, m_id)
-        self.mutex.unlock()
-        m_logger.debug("message sending unlocked")
-        return context
+    def __send(self, m_id=None, body='NULL', crc=None):
+        context = self.context_allocator.allocate()
+        msg = create_message(msg_id=m_id, body=body, context=context, crc=crc) if m_id is not None else body
+        with self.mutex:
+            return self.__send_m(msg, m_id, context)
+
+
+MESSAGE_ID_NAMES = {value: name for name, value in vars(MessageSender.ID).items() if isinstance(value, int)}
 
 
 class RxId(tuple):
@@ -174,9 +520,12 @@ class RxMessage(object):
         ack_feedback,
         nak_feedback,
     };
+    Reception time is kept as time.monotonic_ns() (tstamp_ns), usable for latency calculations,
+    tstamp is its wall clock text formatted only when asked for.
     """
     rx_id_tuple = ('ack', 'nack', 'dtx', 'txt', 'dbg')
     rx_id = RxId(rx_id_tuple)
+    __slots__ = ('__id', '__context', '__crc_result', '__body', '__len', 'tstamp_ns')
 
     class RxId():
         ack                 = 0
@@ -185,33 +534,27 @@ class RxMessage(object):
         txt                 = 3
         dbg                 = 4
 
+    valid_results = (RxId.ack, RxId.nack, RxId.dtx)
+
     def __init__(self, msg_id, context, crc_check, body, length):
+        if crc_check not in RxMessage.valid_results:
+            raise Exception("Result must be ACK {} | NACK {} | DTX {}".format(*RxMessage.valid_results))
+        if not hasattr(body, '__len__'):
+            raise Exception("body is not iterable")
         self.__id = msg_id
         self.__context = context
-        self.__crc_result = self.__set_result(crc_check)        #crc calculated from msg raceived vs tail crc
-        self.__body = self.__set_body(body)
-        if sys.platform in ('linux', 'linux2'):
-            self.__tstamp = datetime.now().strftime("%H:%M:%S.%s")
-        elif sys.platform == 'win32':
-            self.__tstamp = datetime.now().strftime("%H:%M:%S.%ms")
+        self.__crc_result = crc_check        #crc calculated from msg raceived vs tail crc
+        self.__body = body
         self.__len = length
-
-    def __set_body(self, body):
-        try:
-            len(body)
-            return body
-        except TypeError:
-            raise Exception("body is not iterable")
-
-    def __set_result(self, result):
-        valid_results = [RxMessage.RxId.ack, RxMessage.RxId.nack, RxMessage.RxId.dtx]
-        if result not in valid_results:
-            raise Exception("Result must be ACK {} | NACK {} | DTX {}".format(*valid_results))
-        return result
+        self.tstamp_ns = time.monotonic_ns()
 
     @property
     def tstamp(self):
-        return self.__tstamp
+        """
+        :return: reception wall clock time as text: HH:MM:SS.microseconds
+        """
+        seconds, ns = divmod(self.tstamp_ns + WALL_CLOCK_OFFSET_NS, 1000000000)
+        return "{}.{:06d}".format(time.strftime("%H:%M:%S", time.localtime(seconds)), ns // 1000)
 
     @property
     def id(self):
@@ -253,13 +596,13 @@ class RxMessage(object):
                                              context=self.__context,
                                              result=['ack', 'nack', 'dtx'][self.__crc_result],
                                              lenght=self.__len,
-                                             body=self.__body[0:20] + b'...',
-                                             tstamp=self.__tstamp)
+                                             body=bytes(self.__body[0:20]) + b'...',
+                                             tstamp=self.tstamp)
 
 
 MSG_RX_DBG_TEMPLATE = "\n--------------------\n"\
                       "Message received:\n" \
-                      "{}\n" \
+                      "%s\n" \
                       "--------------------"
 
 
@@ -276,106 +619,147 @@ class MessageReceiver:
             uint8_t     tail_end = TAIL_END_MARK; // '>'
         }
         uint16_t    tail_crc= 0;
+    Message body is msg_len bytes just before the tail.
+
+    Decoder is incremental: position up to which rx buffer was already scanned is remembered, so each call
+    only looks at bytes received since previous call. Each '<' candidate is checked once: '>' mark, id and
+    length bounds first, crc calculation only when those pass.
+    rx_buffer must be RingBuffer (CircIoBuffer).
     """
     TAIL_LEN = 10
     TAIL_START_MARK = ord('<')
     TAIL_END_MARK = ord('>')
     TAIL_CRC_SHIFT_POS = 3
+    FULL_TAIL_LEN = TAIL_LEN + 2    # with tail crc
+    BODY_CRC_POS = 7
     ts = time.time()
     LOCKED = False
 
-    def __init__(self, rx_buffer):
+    def __init__(self, rx_buffer, monitor=None):
+        """
+        :param monitor: called with (rxmsg, skipped, consumed) for each extracted frame, also with body crc error
+                        (rxmsg.crc_check == 'nack'); skipped - garbage bytes before message body,
+                        consumed - bytes removed from rx buffer
+        """
         self.rx_buffer = rx_buffer
-        self.__mean_rx_time = MeanCalculator()
-        self.mutex = QMutex()
+        self.monitor = monitor
+        self.high_water = 0                 # max number of bytes waiting in rx buffer for decoding
+        self.crc_errors = 0
+        self.mutex = threading.Lock()
         self.t0 = time.time()
+        self.__scanned = 0                  # relative to rx buffer head
+        self.__scanned_to = rx_buffer.consumed  # scanned position in whole rx stream, see RingBuffer.written
 
-    def check_tail(self, peek_buff):
-        init_find = peek_buff.find(MessageReceiver.TAIL_START_MARK)
-        peek_buff_len = len(peek_buff)
-        for i in range(peek_buff_len - MessageReceiver.TAIL_LEN + init_find):
-            latest_find = i + init_find
-            try:
-                tail_start_mark_pos = peek_buff[latest_find:].find(MessageReceiver.TAIL_START_MARK)
-                tail_end_mark_pos = tail_start_mark_pos + MessageReceiver.TAIL_LEN - 1
-                tail_end_mark = peek_buff[latest_find:][tail_end_mark_pos]
-            except IndexError:
-                return False
-            try:
-                if tail_end_mark == MessageReceiver.TAIL_END_MARK:
-                    peek_buff = peek_buff[latest_find:]
-                    tail = peek_buff[tail_start_mark_pos: tail_end_mark_pos]
-                    _full_tail = peek_buff[tail_start_mark_pos: tail_end_mark_pos+1]
-                    _id = struct.unpack('H', tail[1:3])[0]
-                    _context = struct.unpack('H', tail[3:5])[0]
-                    _msg_len = struct.unpack('H', tail[5:7])[0]
-                    _body_crc = tail[7:9]
-                    _tail_crc = peek_buff[tail_end_mark_pos+1: tail_end_mark_pos + MessageReceiver.TAIL_CRC_SHIFT_POS]
-                    tail_integrity = _tail_crc == crc_bytes(_full_tail)    # tail integrity check
-                    if _id < len(RxMessage.rx_id_tuple) and _msg_len < MAX_PACKET_SIZE and _context < 0xffff \
-                            and self.rx_buffer.available() > _msg_len and tail_integrity:
-                        return _id, _context, _msg_len, _body_crc, tail_start_mark_pos + latest_find, tail_end_mark_pos + latest_find
-            except struct.error:
-                return False
-        return False
+    def __sync_scanned(self):
+        """
+        Buffer head moves when oldest bytes are overwritten or consumed by someone else,
+        scanned position is relative to head so it has to follow
+        """
+        rx_buffer = self.rx_buffer
+        available = rx_buffer.available()
+        if rx_buffer.written - self.__scanned_to > rx_buffer.size:
+            self.__scanned = 0              # everything scanned so far was overwritten
+        else:
+            self.__scanned = min(max(self.__scanned_to - rx_buffer.consumed, 0), available)
+        self.high_water = max(self.high_water, available)
+
+    def check_tail(self, position):
+        """
+        :param position: position of '<' candidate relative to rx buffer head,
+                         FULL_TAIL_LEN bytes starting there must be available
+        :return: tuple(id, context, msg_len, body_crc as integer) when there is valid tail at position else None
+        """
+        rx_buffer = self.rx_buffer
+        if rx_buffer[position + MessageReceiver.TAIL_LEN - 1] != MessageReceiver.TAIL_END_MARK:
+            return None
+        full_tail = memoryview(rx_buffer[position:position + MessageReceiver.FULL_TAIL_LEN])
+        _id, _context, _msg_len = decode_tail(full_tail)
+        if _id >= len(RxMessage.rx_id_tuple) or _msg_len >= MAX_PACKET_SIZE or _msg_len > position:
+            return None
+        tail_crc = TAIL_CRC.unpack_from(full_tail, MessageReceiver.TAIL_LEN)[0]
+        if tail_crc != crc16_xmodem(full_tail[:MessageReceiver.TAIL_LEN]):    # tail integrity
+            return None
+        return _id, _context, _msg_len, TAIL_CRC.unpack_from(full_tail, MessageReceiver.BODY_CRC_POS)[0]
+
+    def __decode(self):
+        """
+        Scan from remembered position to first valid tail, extract message and drop it from rx buffer
+        :return: RxMessage, False when message was extracted with body crc error, None if no more messages
+        """
+        rx_buffer = self.rx_buffer
+        available = rx_buffer.available()
+        position = rx_buffer.find(MessageReceiver.TAIL_START_MARK, self.__scanned)
+        while 0 <= position <= available - MessageReceiver.FULL_TAIL_LEN:
+            tail = self.check_tail(position)
+            if tail:
+                break
+            position = rx_buffer.find(MessageReceiver.TAIL_START_MARK, position + 1)
+        else:
+            # no '<' at all: everything scanned, otherwise resume from incomplete candidate
+            self.__scanned = available if position < 0 else position
+            return None
+        _id, _context, _msg_len, _crc = tail
+        msg_body = rx_buffer[position - _msg_len:position]
+        rx_buffer.consume(position + MessageReceiver.FULL_TAIL_LEN)
+        self.__scanned = 0
+        MessageReceiver.ts = time.time()
+        crc_ok = _crc == crc16_xmodem(msg_body)
+        crc_check = RxMessage.RxId.ack if crc_ok else RxMessage.RxId.nack
+        rxmsg = RxMessage(msg_id=_id, crc_check=crc_check, length=len(msg_body), context=_context, body=msg_body)
+        m_logger.debug(MSG_RX_DBG_TEMPLATE, rxmsg)
+        if self.monitor is not None:
+            self.monitor(rxmsg, position - _msg_len, position + MessageReceiver.FULL_TAIL_LEN)
+        self.t0 = time.time()
+        if not crc_ok:
+            self.crc_errors += 1
+            return False
+        return rxmsg
+
+    def get_messages(self):
+        """
+        Drain all complete messages from rx buffer
+        :return: list of RxMessage, messages with body crc error are dropped
+        """
+        messages = []
+        with self.mutex:
+            self.__sync_scanned()
+            rxmsg = self.__decode()
+            while rxmsg is not None:
+                if rxmsg:
+                    messages.append(rxmsg)
+                rxmsg = self.__decode()
+            self.__scanned_to = self.rx_buffer.consumed + self.__scanned
+        return messages
 
     def get_message(self):
-        t0 = time.time()
-
-        ret_rxmsg = None
-        if self.rx_buffer.available() >= MessageReceiver.TAIL_LEN:
-            self.mutex.lock()
-            peek_buff = self.rx_buffer.peek()
-            check_tail_result = self.check_tail(peek_buff)
-            self.mutex.unlock()
-            if check_tail_result:
-                _id, _context, _msg_len, _crc, tail_start_mark_pos, tail_end_mark_pos = check_tail_result
-                self.mutex.lock()
-                msg_body = self.rx_buffer.read(tail_end_mark_pos + 1 + 2)
-                self.mutex.unlock()
-                msg_body = msg_body[:tail_start_mark_pos]
-                MessageReceiver.ts = time.time()
-                crc_check = RxMessage.RxId.ack if _crc == crc_bytes(msg_body) else RxMessage.RxId.nack
-                rxmsg = RxMessage(msg_id=_id, crc_check=crc_check, length=len(msg_body), context=_context, body=msg_body)
-                m_logger.debug(MSG_RX_DBG_TEMPLATE.format(rxmsg))
-                self.t0 = time.time()
-                if _crc == crc_bytes(msg_body):
-                    self.__mean_rx_time.count(time.time() - t0)
-                    ret_rxmsg = rxmsg
-                m_logger.debug("Mean msg extract time: {}".format(self.__mean_rx_time))
-                m_logger.debug("Period: {}".format(time.time() - self.t0))
-
-        return ret_rxmsg
-
-
-
-def create_message(msg_id, body, context=0, max_packet_size=MAX_PACKET_SIZE):
+        """
+        :return: next RxMessage or None
+        """
+        with self.mutex:
+            self.__sync_scanned()
+            rxmsg = self.__decode()
+            while rxmsg is False:
+                rxmsg = self.__decode()
+            self.__scanned_to = self.rx_buffer.consumed + self.__scanned
+        return rxmsg
+
+
+def create_message(msg_id, body, context=0, max_packet_size=MAX_PACKET_SIZE, crc=None):
     """
-    Create message with name, body_len, crc, id
-    fail_crc_factor: propability factor to fail crc, value 4 means that 1 of 4 transmissions will fail crc, overwrites fail_crc
+    Create message with name, body_len, crc, id, see codec.pack_message_into
     :param msg_id: msg id
     :param context: msg context
-    :param body: bytearray
+    :param body: bytes like object
     :param max_packet_size:
-    :param fail_crc_factor: fail factor for testing purposes
-    :return:
+    :param crc: precalculated body crc (integer), see message_handler.crc.page_crcs
+    :return: bytearray
     """
     body_len = len(body)                            #integer type, 4 bytes long
     header_size = 10
     if body_len + header_size > max_packet_size:
         raise Exception("msg len to big: {}>{}".format(body_len + header_size, max_packet_size))
-
-    print("id: {}, context: {}, blen: {}".format(msg_id, context, body_len))
-
-    body_len = struct.pack('I', body_len)
-    msg_id = struct.pack('H', msg_id)                       #two bytes
-    context = struct.pack('H', context)  # two bytes
-    c = crc_bytes(body)                                   #two bytes field
-    #raw_msg = '>{id}{context}{body_len}{crc}<{body}'.format(id=msg_id, context=context, body_len=body_len, crc=c, body=body)
-    raw_msg = b'>' + msg_id + context + body_len + c + b'<' + body
-    #print(raw_msg)
-    # print(''.join(['|{:02X}'.format(ord(i)) if i not in ['<', '>'] else i for i in raw_msg]))
-    # print(''.join(['|{:2s}'.format(i) if i not in ['<', '>'] else i for i in raw_msg]))
+    raw_msg = bytearray(message_size(body_len))
+    pack_message_into(raw_msg, 0, msg_id, body, context, crc)
     return raw_msg
 
 
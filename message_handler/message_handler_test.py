@@ -0,0 +1,195 @@
+"""
+author: Rafal Miecznik
+contact: ravmiecznk@gmail.com
+"""
+
+import json
+import time
+import threading
+
+import pytest
+
+from message_handler import MessageSender, MessageReceiver, RxMessage, PendingRequests, PendingReply
+from message_handler.message_handler import TransmissionStats, ContextAllocator, ExpiringTable, PENDING_LIMIT, \
+    UNSOLICITED_LIMIT
+from circ_io_buffer import RingBuffer
+from bootloader_emulator import device_message
+
+
+def rx_message(context, body=b''):
+    return RxMessage(msg_id=RxMessage.RxId.ack, context=context, crc_check=RxMessage.RxId.ack, body=body,
+                     length=len(body))
+
+
+def test_send_returns_pending_reply():
+    pending_requests = PendingRequests()
+    sent = []
+    reply = MessageSender(sent.append, pending_requests).send(MessageSender.ID.bootloader)
+    assert isinstance(reply, PendingReply)
+    assert len(sent) == 1 and len(pending_requests) == 1
+    assert not reply.done()
+    assert reply.wait(timeout=0.01) is None
+
+
+def test_failed_transmit_releases_sender():
+    pending_requests = PendingRequests()
+
+    def unplugged(msg):
+        raise IOError("device disconnected")
+
+    sender = MessageSender(unplugged, pending_requests)
+    for _ in range(2):          # second send would deadlock on mutex left locked
+        with pytest.raises(IOError):
+            sender.send(MessageSender.ID.bootloader)
+    assert not sender.mutex.locked()
+    assert len(pending_requests) == 0
+
+
+def test_dispatch_wakes_waiter():
+    pending_requests = PendingRequests()
+    reply = MessageSender(lambda msg: None, pending_requests).send(MessageSender.ID.bootloader)
+    threading.Timer(0.01, pending_requests.dispatch, args=(rx_message(reply, b'bootloader3'),)).start()
+    assert reply.wait(timeout=1).msg == b'bootloader3'
+    assert len(pending_requests) == 0
+    assert pending_requests.unsolicited == {}
+
+
+def test_unsolicited_and_cancelled():
+    pending_requests = PendingRequests()
+    reply = pending_requests.register(100)
+    pending_requests.cancel(reply)
+    assert not pending_requests.dispatch(rx_message(100))
+    assert not pending_requests.dispatch(rx_message(0, b'txt'))
+    assert sorted(pending_requests.unsolicited) == [0, 100]
+
+
+def test_wait_for():
+    pending_requests = PendingRequests()
+    threading.Timer(0.01, pending_requests.dispatch, args=(rx_message(0, b'bootloader3'),)).start()
+    assert pending_requests.wait_for(lambda: 0 in pending_requests.unsolicited, timeout=1)
+    assert not pending_requests.wait_for(lambda: 1 in pending_requests.unsolicited, timeout=0.01)
+
+
+def test_get_messages_drains_all():
+    rx_buffer = RingBuffer(size=1024)
+    receiver = MessageReceiver(rx_buffer)
+    rx_buffer.write(b'noise<<>' + device_message(0, 10, b'a<b>c') + device_message(3, 0, b'') +
+                    device_message(0, 11, b'x'*100))
+    messages = receiver.get_messages()
+    assert [(m.context, m.msg) for m in messages] == [(10, b'a<b>c'), (0, b''), (11, b'x'*100)]
+    assert rx_buffer.available() == 0
+    assert receiver.get_messages() == []
+
+
+def test_message_split_across_writes():
+    rx_buffer = RingBuffer(size=64)
+    receiver = MessageReceiver(rx_buffer)
+    frame = device_message(0, 5, b'<'*20)
+    for i in range(0, len(frame) - 1, 3):
+        rx_buffer.write(frame[i:min(i + 3, len(frame) - 1)])
+        assert receiver.get_message() is None
+    rx_buffer.write(frame[-1:])
+    message = receiver.get_message()
+    assert message.context == 5 and message.msg == b'<'*20
+
+
+def test_bad_body_crc_dropped():
+    rx_buffer = RingBuffer(size=256)
+    receiver = MessageReceiver(rx_buffer)
+    broken = bytearray(device_message(0, 7, b'body'))
+    broken[0] ^= 0xff
+    rx_buffer.write(bytes(broken) + device_message(0, 8, b'body'))
+    assert [m.context for m in receiver.get_messages()] == [8]
+
+
+def test_scan_follows_overwritten_head():
+    rx_buffer = RingBuffer(size=64)
+    receiver = MessageReceiver(rx_buffer)
+    rx_buffer.write(b'<' * 40)
+    assert receiver.get_messages() == []
+    rx_buffer.write(device_message(0, 9, b'abc'))     # oldest bytes overwritten
+    assert [m.context for m in receiver.get_messages()] == [9]
+
+
+def test_scan_after_more_than_buffer_size_written():
+    rx_buffer = RingBuffer(size=64)
+    receiver = MessageReceiver(rx_buffer)
+    rx_buffer.write(b'x' * 30)
+    assert receiver.get_messages() == []
+    frame = device_message(0, 9, b'abc')
+    data = b'x' * 36 + frame + b'x' * (64 - len(frame))     # 100 bytes, frame at new head
+    for i in range(0, len(data), 20):                       # head moves by 66, not by 66 % 64
+        rx_buffer.write(data[i:i + 20])
+    assert [m.context for m in receiver.get_messages()] == [9]
+
+
+def test_transmission_stats_percentiles():
+    stats = TransmissionStats()
+    for ms in range(1, 101):
+        stats.ack(2050, latency=ms/1000.0)
+    stats.nack()
+    stats.stop()
+    assert stats.percentile(50) == 0.05
+    assert stats.percentile(99) == 0.099
+    assert stats.acks == 100 and stats.nacks == 1 and stats.bytes_sent == 205000
+    as_dict = json.loads(stats.to_json())
+    assert as_dict["latency"]["count"] == 100 and as_dict["latency"]["p95"] == 0.095
+
+
+def test_transmission_stats_prometheus():
+    stats = TransmissionStats()
+    stats.ack(2050, latency=0.003)
+    stats.ack(2050, latency=10)
+    stats.timeout()
+    text = stats.prometheus({'port': '/dev/ttyUSB0'})
+    assert 'reflasher_acks_total{port="/dev/ttyUSB0"} 2' in text
+    assert 'reflasher_timeouts_total{port="/dev/ttyUSB0"} 1' in text
+    assert 'reflasher_page_latency_seconds_bucket{port="/dev/ttyUSB0",le="0.005"} 1' in text
+    assert 'reflasher_page_latency_seconds_bucket{port="/dev/ttyUSB0",le="+Inf"} 2' in text
+    assert TransmissionStats().percentile(50) is None
+
+
+def test_rx_message_record():
+    t0 = time.monotonic_ns()
+    message = rx_message(5, b'body')
+    assert t0 <= message.tstamp_ns <= time.monotonic_ns()
+    assert (message.id, message.ids, message.context, message.crc_check, message.msg, message.len) == \
+        (RxMessage.RxId.ack, 'ack', 5, 'ack', b'body', 4)
+    assert not hasattr(message, '__dict__')
+    assert message.tstamp.startswith(time.strftime("%H:"))
+    assert "context:    5" in repr(message)
+
+
+def test_context_allocator_wraps_whole_uint16_space():
+    allocator = ContextAllocator(MessageSender.reserved_context)
+    contexts = [allocator.allocate() for _ in range(0x10000 - 2 + 3)]
+    assert contexts[:3] == [2, 3, 4] and contexts[0xffff - 2] == 0xffff
+    assert contexts[-3:] == [2, 3, 4]       # 0 and 1 reserved
+    assert MessageSender.ID.translate_id(MessageSender.ID.write_to_page) == 'write_to_page'
+    assert MessageSender.ID.translate_id(12345) is None
+
+
+def test_pending_and_unsolicited_bounded():
+    pending_requests = PendingRequests()
+    for context in range(PENDING_LIMIT + 10):
+        pending_requests.register(context)
+    assert len(pending_requests) == PENDING_LIMIT
+    for context in range(5000, 5000 + UNSOLICITED_LIMIT + 10):
+        pending_requests.dispatch(rx_message(context))
+    assert list(pending_requests.unsolicited)[0] == 5010
+    assert len(pending_requests.unsolicited) == UNSOLICITED_LIMIT
+
+
+def test_expiring_table_ttl():
+    now = [100.0]
+    table = ExpiringTable(max_size=10, ttl=5, tstamp=lambda value: value, clock=lambda: now[0])
+    table['a'] = 100.0
+    now[0] = 103.0
+    table['b'] = 103.0
+    table['a'] = 103.0     # set again: newest
+    now[0] = 106.0
+    table['c'] = 106.0
+    assert list(table) == ['b', 'a', 'c']
+    now[0] = 108.5
+    table['d'] = 108.5
+    assert list(table) == ['c', 'd'] and table.evicted == 2
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+author: Rafal Miecznik
+contact: ravmiecznk@gmail.com
+
+Headless command line reflasher, no Qt required:
+    python -m reflash --port /dev/ttyUSB0 --hex app.hex
+    python -m reflash --port /dev/ttyUSB0 /dev/ttyUSB1 /dev/ttyUSB2 --hex app.hex
+Only pages changed since last successful flash of the device are sent, use --full to flash all pages.
+
+exit codes:
+    0 - reflashing finished
+    1 - reflashing failed (timeout)
+    2 - wrong arguments
+    3 - hex file not present or corrupted
+    4 - can't open serial port
+    5 - bootloader did not respond
+With many ports exit code is the highest one of all ports.
+"""
+
+import sys
+import time
+import argparse
+
+EXIT_OK = 0
+EXIT_FLASH_FAILED = 1
+EXIT_HEX_ERROR = 3
+EXIT_CONNECTION_ERROR = 4
+EXIT_BOOTLOADER_ERROR = 5
+
+
+def positive_int(value):
+    """
+    argparse type: integer >= 1
+    """
+    try:
+        number = int(value)
+    except ValueError:
+        number = 0
+    if number < 1:
+        raise argparse.ArgumentTypeError("positive integer expected, got: {}".format(value))
+    return number
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog="reflash", description="ATmega128 reflash tool for atm128_bootloader_v3")
+    parser.add_argument("--port", required=True, nargs='+', dest="ports",
+                        help="serial device(s), e.g. /dev/ttyUSB0 or COM3, many ports are flashed in parallel")
+    parser.add_argument("--hex", required=True, dest="hex_file", help="intel hex file to flash")
+    parser.add_argument("--baudrate", type=int, default=115200)
+    parser.add_argument("--window", type=positive_int, default=1, help="number of pages in flight")
+    parser.add_argument("--rxtimeout", type=float, default=1,
+                        help="page ack timeout [s], initial one which then follows measured round trip times")
+    parser.add_argument("--fixed-rxtimeout", action="store_true", help="do not adapt page ack timeout")
+    parser.add_argument("--timeout", type=float, default=None,
+                        help="overall reflash timeout [s], scaled with image size and throughput by default")
+    parser.add_argument("--workers", type=positive_int, default=None, help="max number of ports flashed at once")
+    parser.add_argument("--asyncio", action="store_true", help="drive all ports from single asyncio event loop")
+    parser.add_argument("--no-cache", action="store_true", help="do not use parsed image cache")
+    parser.add_argument("--full", action="store_true",
+                        help="flash all pages, by default only pages changed since last flash of the device are sent")
+    parser.add_argument("--skip-blank", action="store_true",
+                        help="do not send pages which are entirely 0xFF, device flash is assumed erased there "
+                             "unless its flash history shows other data (such page is erased by writing it)")
+    parser.add_argument("--erase-blank", action="store_true",
+                        help="with --skip-blank: erase every blank page not recorded erased in flash history, "
+                             "bootloader has no erase request so such page is written")
+    parser.add_argument("--no-history", action="store_true", help="do not read nor update device flash history")
+    parser.add_argument("--stats-dir", help="save transfer stats of each port there as json")
+    parser.add_argument("--prometheus-dir", help="save transfer stats of each port there as Prometheus textfile")
+    parser.add_argument("--capture-dir", help="capture raw serial traffic of each port there (binary, see wire_capture)")
+    parser.add_argument("--capture-max-bytes", type=int, default=None,
+                        help="keep only about this many bytes of most recent traffic per port")
+    parser.add_argument("--performance", action="store_true", help="disable per packet debug logging")
+    parser.add_argument("--no-run", action="store_true", help="stay in bootloader after reflash")
+    parser.add_argument("--quiet", action="store_true", help="print only final result")
+    args = parser.parse_args(argv)
+    if args.erase_blank and not args.skip_blank:
+        parser.error("--erase-blank needs --skip-blank")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    t0 = time.time()
+    out = (lambda *args, **kwargs: None) if args.quiet else print
+
+    if args.performance:
+        from loggers import set_performance_mode
+        set_performance_mode()
+    from intel_hex_handler import IntelHexError
+    from flash_session import FlashOrchestrator, FlashResult, load_hex_image
+    from image_cache import ImageCache
+    from flash_history import FlashHistory
+
+    try:
+        image = load_hex_image(args.hex_file, None if args.no_cache else ImageCache())
+    except (IOError, OSError, IntelHexError) as e:
+        print("Hex file not present or corrupted: {}: {}".format(args.hex_file, e))
+        return EXIT_HEX_ERROR
+    out("Image: {} ({:.3f}s)".format(image, time.time() - t0))
+
+    jobs = {port: image for port in args.ports}
+    flash_history = None if args.no_history else FlashHistory()
+    if args.asyncio:
+        import asyncio
+        from flash_session.async_session import flash_ports
+        t0 = time.time()
+        results = asyncio.run(flash_ports(jobs, timeout=args.timeout, run_app=not args.no_run, full=args.full,
+                                          skip_blank=args.skip_blank, erase_blank=args.erase_blank,
+                                          baudrate=args.baudrate, window=args.window,
+                                          rxtimeout=args.rxtimeout, adaptive_rto=not args.fixed_rxtimeout,
+                                          flash_history=flash_history, stats_dir=args.stats_dir,
+                                          prometheus_dir=args.prometheus_dir, capture_dir=args.capture_dir,
+                                          capture_max_bytes=args.capture_max_bytes))
+        summary = "{} bytes in {:.3f}s".format(sum(r.bytes_sent for r in results.values()), time.time() - t0)
+    else:
+        progress = lambda percent: out("\r{:5.1f}%".format(percent), end='', flush=True)
+        orchestrator = FlashOrchestrator(jobs, max_workers=args.workers,
+                                         timeout=args.timeout, run_app=not args.no_run, progress=progress,
+                                         full=args.full, skip_blank=args.skip_blank, erase_blank=args.erase_blank,
+                                         baudrate=args.baudrate, window=args.window,
+                                         rxtimeout=args.rxtimeout, adaptive_rto=not args.fixed_rxtimeout,
+                                         flash_history=flash_history, stats_dir=args.stats_dir,
+                                         prometheus_dir=args.prometheus_dir, capture_dir=args.capture_dir,
+                                         capture_max_bytes=args.capture_max_bytes)
+        results = orchestrator.run()
+        summary = orchestrator
+        out("")
+
+    exit_codes = {
+        FlashResult.ok: EXIT_OK,
+        FlashResult.failed: EXIT_FLASH_FAILED,
+        FlashResult.connection_error: EXIT_CONNECTION_ERROR,
+        FlashResult.bootloader_error: EXIT_BOOTLOADER_ERROR,
+    }
+    for port in args.ports:
+        print(results[port])
+        if results[port].transmitter is not None:
+            out("    {}".format(results[port].transmitter.stats))
+    if len(args.ports) > 1:
+        print(summary)
+    return max(exit_codes[r.status] for r in results.values())
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,22 @@
+"""
+author: Rafal Miecznik
+contact: ravmiecznk@gmail.com
+"""
+
+import pytest
+
+from reflash import parse_args
+
+
+@pytest.mark.parametrize("window", ["0", "-1", "x"])
+def test_window_must_be_positive(window):
+    with pytest.raises(SystemExit) as e:
+        parse_args(["--port", "/dev/ttyUSB0", "--hex", "app.hex", "--window", window])
+    assert e.value.code == 2
+
+
+
+def test_erase_blank_needs_skip_blank():
+    with pytest.raises(SystemExit):
+        parse_args(["--port", "/dev/ttyUSB0", "--hex", "app.hex", "--erase-blank"])
+    assert parse_args(["--port", "/dev/ttyUSB0", "--hex", "app.hex", "--skip-blank", "--erase-blank"]).erase_blank
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""
+author: Rafal Miecznik
+contact: ravmiecznk@gmail.com
+
+Offline replay of recorded rx stream through CircIoBuffer + MessageReceiver, no serial device required:
+    python replay.py REFLASHER_CAPTURE/_dev_ttyUSB0.cap             # wire capture, as fast as possible
+    python replay.py REFLASHER_DBG/rx_log.log --speed 1             # rx_log, original timing
+    python replay.py _dev_ttyUSB0.cap --speed 10 --quiet            # 10x accelerated, summary only
+
+Every decoded message, body crc failure and resync point (garbage skipped before a frame) is reported
+with its offset in rx stream, then decode throughput: bytes replayed / time spent in buffer write and decoding.
+"""
+
+import re
+import ast
+import sys
+import time
+import argparse
+from collections import namedtuple
+from datetime import datetime
+
+from circ_io_buffer import CircIoBuffer
+from message_handler import MessageReceiver
+from wire_capture import read_capture, RX
+from wire_capture.wire_capture import MAGIC
+
+RX_BUFFER_SIZE = 258*10
+MESSAGE = 'message'
+CRC_ERROR = 'crc_error'
+RESYNC = 'resync'
+
+RX_LOG_LINE = re.compile(r"^\[(\d{4}-\d\d-\d\d \d\d:\d\d:\d\d,\d{3}).*?rxdata: (b'.*'|b\".*\")\s*$")
+RX_LOG_TIME_FORMAT = "%Y-%m-%d %H:%M:%S,%f"
+
+
+ReplayEvent = namedtuple('ReplayEvent', 'kind offset skipped message')
+
+
+def capture_chunks(path):
+    """
+    :return: list of tuples (tstamp [s], data) of rx records of wire capture
+    """
+    return [(record.tstamp_ns/1e9, record.data) for record in read_capture(path) if record.direction == RX]
+
+
+def rx_log_chunks(path):
+    """
+    :return: list of tuples (tstamp [s], data) of 'rxdata: b...' lines of rx_log, other lines are ignored
+    """
+    chunks = []
+    with open(path) as f:
+        for line in f:
+            match = RX_LOG_LINE.match(line)
+            if match:
+                tstamp = datetime.strptime(match.group(1), RX_LOG_TIME_FORMAT).timestamp()
+                chunks.append((tstamp, ast.literal_eval(match.group(2))))
+    return chunks
+
+
+def load_chunks(path):
+    """
+    :return: rx chunks of wire capture or rx_log file
+    """
+    with open(path, 'rb') as f:
+        is_capture = f.read(len(MAGIC)) == MAGIC
+    return capture_chunks(path) if is_capture else rx_log_chunks(path)
+
+
+class ReplayResult(object):
+    def __init__(self):
+        self.messages = 0
+        self.crc_errors = 0
+        self.resyncs = 0
+        self.skipped_bytes = 0
+        self.lost_bytes = 0
+        self.trailing_bytes = 0
+        self.bytes = 0
+        self.chunks = 0
+        self.decode_time = 0
+        self.elapsed = 0
+
+    def bytes_per_second(self):
+        try:
+            return self.bytes/self.decode_time
+        except ZeroDivisionError:
+            return 0
+
+    def __repr__(self):
+        return "{} chunks, {} bytes: {} messages, {} crc errors, {} resyncs ({} bytes skipped), " \
+               "{} bytes lost, {} trailing bytes; decode {:.3f}s {:.0f} B/s, elapsed {:.3f}s".format(
+                self.chunks, self.bytes, self.messages, self.crc_errors, self.resyncs, self.skipped_bytes,
+                self.lost_bytes, self.trailing_bytes, self.decode_time, self.bytes_per_second(), self.elapsed)
+
+
+class Replay(object):
+    """
+        result = Replay(load_chunks('port.cap')).run(speed=1, on_event=print)
+    """
+    def __init__(self, chunks, rx_buffer_size=RX_BUFFER_SIZE):
+        """
+        :param chunks: list of tuples (tstamp [s], data) in order of reception
+        :param rx_buffer_size: CircIoBuffer size, same as in FlashSession by default
+        """
+        self.chunks = chunks
+        self.rx_buffer_size = rx_buffer_size
+
+    def run(self, speed=0, on_event=lambda event: None):
+        """
+        :param speed: 1 - original timing, 10 - 10 times faster, 0 - as fast as possible
+        :param on_event: called with ReplayEvent for every message, crc error and resync point
+        :return: ReplayResult
+        """
+        result = ReplayResult()
+        rx_buffer = CircIoBuffer(size=self.rx_buffer_size)
+        decoded = [0]       # bytes consumed by decoder, skipped garbage included
+
+        def monitor(rxmsg, skipped, frame_len):
+            start = rx_buffer.consumed - frame_len     # stream offset, overwritten bytes included
+            decoded[0] += frame_len
+            if skipped:
+                result.resyncs += 1
+                result.skipped_bytes += skipped
+                on_event(ReplayEvent(RESYNC, start, skipped, None))
+            if rxmsg.crc_check == 'nack':
+                result.crc_errors += 1
+                on_event(ReplayEvent(CRC_ERROR, start + skipped, 0, rxmsg))
+            else:
+                result.messages += 1
+                on_event(ReplayEvent(MESSAGE, start + skipped, 0, rxmsg))
+
+        receiver = MessageReceiver(rx_buffer, monitor=monitor)
+        t_start = time.time()
+        first_tstamp = self.chunks[0][0] if self.chunks else 0
+        for tstamp, data in self.chunks:
+            if speed:
+                delay = t_start + (tstamp - first_tstamp)/speed - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+            t0 = time.perf_counter()
+            rx_buffer.write(data)
+            receiver.get_messages()
+            result.decode_time += time.perf_counter() - t0
+            result.bytes += len(data)
+            result.chunks += 1
+        result.elapsed = time.time() - t_start
+        result.trailing_bytes = rx_buffer.available()
+        # bytes overwritten in rx buffer before being decoded
+        result.lost_bytes = result.bytes - decoded[0] - result.trailing_bytes
+        return result
+
+
+def format_event(event):
+    if event.kind == RESYNC:
+        return "{:10d} resync, {} bytes skipped".format(event.offset, event.skipped)
+    return "{:10d} {} id: {}, context: {}, length: {}{}".format(
+        event.offset, event.kind, event.message.ids, event.message.context, event.message.len,
+        ", body: {}".format(bytes(event.message.msg[:32])) if event.message.len else "")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog="replay", description="replay recorded rx stream through MessageReceiver")
+    parser.add_argument("path", help="wire capture file or rx_log")
+    parser.add_argument("--speed", type=float, default=0,
+                        help="1 - original timing, 10 - 10 times faster, 0 - as fast as possible (default)")
+    parser.add_argument("--rx-buffer-size", type=int, default=RX_BUFFER_SIZE)
+    parser.add_argument("--quiet", action="store_true", help="print only summary")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    from loggers import set_performance_mode
+    set_performance_mode()
+    out = (lambda *args, **kwargs: None) if args.quiet else print
+    replay = Replay(load_chunks(args.path), rx_buffer_size=args.rx_buffer_size)
+    print(replay.run(args.speed, on_event=lambda event: out(format_event(event))))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
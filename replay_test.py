@@ -0,0 +1,54 @@
+"""
+author: Rafal Miecznik
+contact: ravmiecznk@gmail.com
+"""
+
+from bootloader_emulator import device_message
+from wire_capture import WireCapture
+from replay import Replay, load_chunks, MESSAGE, CRC_ERROR, RESYNC
+
+
+def corrupted_message(m_id, context, body):
+    message = bytearray(device_message(m_id, context, body))
+    message[0] ^= 0xff
+    return bytes(message)
+
+
+STREAM = device_message(0, 2) + b'noise' + device_message(3, 3, b'bootloader3') + corrupted_message(0, 4, b'body') \
+         + device_message(0, 5)
+
+
+def replay_events(chunks, **kwargs):
+    events = []
+    result = Replay(chunks).run(on_event=events.append, **kwargs)
+    return result, [(e.kind, e.offset, e.skipped, e.message and e.message.context) for e in events]
+
+
+def test_events_and_offsets():
+    chunks = [(i*0.001, STREAM[i:i + 7]) for i in range(0, len(STREAM), 7)]
+    result, events = replay_events(chunks)
+    assert events == [(MESSAGE, 0, 0, 2), (RESYNC, 12, 5, None), (MESSAGE, 17, 0, 3), (CRC_ERROR, 40, 0, 4),
+                      (MESSAGE, 56, 0, 5)]
+    assert (result.messages, result.crc_errors, result.resyncs, result.skipped_bytes) == (3, 1, 1, 5)
+    assert result.bytes == len(STREAM) and result.lost_bytes == result.trailing_bytes == 0
+
+
+def test_original_timing_accelerated():
+    chunks = [(0, STREAM[:20]), (0.2, STREAM[20:])]
+    result, _ = replay_events(chunks, speed=2)
+    assert 0.1 <= result.elapsed < 0.2
+    assert result.messages == 3
+
+
+def test_capture_and_rx_log_input(tmpdir):
+    capture_path = str(tmpdir.join('port.cap'))
+    with WireCapture(capture_path) as capture:
+        capture.tx(b'>request<')
+        capture.rx(STREAM[:30])
+        capture.rx(STREAM[30:])
+    rx_log_path = tmpdir.join('rx_log.log')
+    rx_log_path.write(''.join("[2026-01-01 12:00:00,{:03d} serial_handler.py:69 rx_data_thread thr:Thread-1]: "
+                              "DEBUG rxdata: {!r}\n".format(i, STREAM[i*30:(i + 1)*30]) for i in range(3)))
+    for path in (capture_path, str(rx_log_path)):
+        assert b''.join(data for _, data in load_chunks(path)) == STREAM
+        assert Replay(load_chunks(path)).run().messages == 3
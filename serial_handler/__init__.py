@@ -4,4 +4,5 @@ contact: ravmiecznk@gmail.com
 creation date: 2020-03-20
 """
 
-from serial_handler.serial_handler import SerialConnection
\ No newline at end of file
+from serial_handler.serial_handler import SerialConnection
+# from serial_handler.async_serial import AsyncSerialConnection   (imports asyncio)
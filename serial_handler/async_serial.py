@@ -0,0 +1,131 @@
+"""
+author: Rafal Miecznik
+contact: ravmiecznk@gmail.com
+
+Serial connection driven by asyncio event loop.
+Port file descriptor is registered in the loop, there is no reader thread and no polling:
+data_received callback is called only when bytes arrive. Posix only (loop.add_reader).
+"""
+
+import os
+import asyncio
+import serial
+
+from config import thread_logger
+
+dbg = thread_logger.debug
+
+READ_CHUNK = 4096
+
+
+class AsyncSerialConnection(object):
+    def __init__(self, port, baudrate=115200, data_received=lambda data: None, loop=None, capture=None,
+                 connection_lost=lambda exc: None, **kwargs):
+        """
+        :param data_received: callback called from event loop with every received chunk
+        :param connection_lost: callback called from event loop with exception when port is gone (read error, EOF)
+        :param capture: WireCapture of rx and tx traffic
+        :param kwargs: other serial.Serial arguments, timeouts are forced to non blocking
+        """
+        kwargs.pop('timeout', None)
+        kwargs.pop('write_timeout', None)
+        self.serial = serial.Serial(port=port, baudrate=baudrate, timeout=0, write_timeout=0, **kwargs)
+        self.name = self.serial.name
+        self.data_received = data_received
+        self.connection_lost = connection_lost
+        self.error = None       # set when connection is lost
+        self.capture = capture
+        self.loop = loop if loop is not None else asyncio.get_event_loop()
+        self.fd = self.serial.fileno()
+        self.__tx_buffer = bytearray()
+        self.__drain_waiters = []
+        self.loop.add_reader(self.fd, self.__read_ready)
+
+    def __read_ready(self):
+        try:
+            data = os.read(self.fd, READ_CHUNK)
+        except BlockingIOError:
+            return
+        except OSError as e:
+            self.__read_failed(e)
+            return
+        if not data:    # EOF, hang up of the port: fd would stay readable forever
+            self.__read_failed(serial.SerialException("{}: port hung up".format(self.name)))
+            return
+        if self.capture is not None:
+            self.capture.rx(data)
+        self.data_received(data)
+
+    def __read_failed(self, e):
+        dbg("{}: read error: {}".format(self.name, e))
+        self.loop.remove_reader(self.fd)
+        self.error = e
+        self.connection_lost(e)
+
+    def send(self, data):
+        """
+        Non blocking write, what can't be written now is buffered and written when port is ready
+        """
+        if self.capture is not None:
+            self.capture.tx(data)
+        if self.__tx_buffer:
+            self.__tx_buffer += data
+            return
+        try:
+            written = os.write(self.fd, data)
+        except BlockingIOError:
+            written = 0
+        except OSError as e:
+            self.__write_failed(e)
+            raise
+        if written < len(data):
+            self.__tx_buffer += data[written:]
+            self.loop.add_writer(self.fd, self.__write_ready)
+
+    write = send
+
+    def __write_ready(self):
+        try:
+            written = os.write(self.fd, self.__tx_buffer)
+        except BlockingIOError:
+            return
+        except OSError as e:
+            self.__write_failed(e)
+            return
+        del self.__tx_buffer[:written]
+        if not self.__tx_buffer:
+            self.loop.remove_writer(self.fd)
+            for waiter in self.__drain_waiters:
+                if not waiter.done():
+                    waiter.set_result(None)
+            self.__drain_waiters = []
+
+    def __write_failed(self, e):
+        """
+        Port is gone (e.g. EIO after USB disconnect): stop writing and wake up drain() with the error
+        """
+        dbg("{}: write error: {}".format(self.name, e))
+        self.loop.remove_writer(self.fd)
+        del self.__tx_buffer[:]
+        for waiter in self.__drain_waiters:
+            if not waiter.done():
+                waiter.set_exception(e)
+        self.__drain_waiters = []
+
+    async def drain(self):
+        """
+        Wait until all buffered data is written
+        """
+        if self.__tx_buffer:
+            waiter = self.loop.create_future()
+            self.__drain_waiters.append(waiter)
+            await waiter
+
+    def isOpen(self):
+        return self.serial.isOpen()
+
+    def close(self):
+        if self.serial.isOpen():
+            self.loop.remove_reader(self.fd)
+            self.loop.remove_writer(self.fd)
+            self.serial.close()
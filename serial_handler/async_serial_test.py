@@ -0,0 +1,49 @@
+"""
+author: Rafal Miecznik
+contact: ravmiecznk@gmail.com
+"""
+
+import os
+import pty
+import tty
+import asyncio
+
+import pytest
+
+from serial_handler.async_serial import AsyncSerialConnection
+
+
+def test_drain_fails_when_port_is_gone():
+    master, slave = pty.openpty()
+    tty.setraw(slave)
+
+    async def unplug():
+        connection = AsyncSerialConnection(os.ttyname(slave))
+        connection.send(b'\x55'*(1 << 20))       # nobody reads master side: rest is buffered
+        asyncio.get_running_loop().call_later(0.05, os.close, master)
+        with pytest.raises(OSError):
+            await asyncio.wait_for(connection.drain(), 2)
+        with pytest.raises(OSError):
+            connection.send(b'\x55')
+        connection.close()
+
+    asyncio.run(unplug())
+
+
+def test_eof_is_connection_loss(monkeypatch):
+    master, slave = pty.openpty()
+    tty.setraw(slave)
+    lost = []
+
+    async def hang_up():
+        loop = asyncio.get_running_loop()
+        connection = AsyncSerialConnection(os.ttyname(slave), connection_lost=lost.append)
+        monkeypatch.setattr(os, 'read', lambda fd, n: b'')     # port hung up
+        os.write(master, b'\x55')
+        await asyncio.sleep(0.05)
+        assert not loop.remove_reader(connection.fd)      # reader already removed, loop does not spin
+        connection.close()
+
+    asyncio.run(hang_up())
+    os.close(master)
+    assert len(lost) == 1 and isinstance(lost[0], IOError)
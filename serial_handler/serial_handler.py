@@ -54,6 +54,7 @@ class SerialThread(Thread):
 class SerialConnection(serial.Serial):
     def __init__(self, **kwargs):
         self.data_ready_sig = kwargs.pop('data_ready_signal', lambda x:x)
+        self.capture = kwargs.pop('capture', None)     # WireCapture of rx and tx traffic
         period = kwargs.get('timeout', 0.002)
         serial.Serial.__init__(self, **kwargs)
         self.reader = SerialThread(target=self.rx_data_thread, period=period)
@@ -61,11 +62,18 @@ class SerialConnection(serial.Serial):
         self.reader.start()
 
     def rx_data_thread(self):
-        rx_data = self.read(1024)
-        while rx_data:
-            rxlog.debug("rxdata: {}".format(rx_data))
-            self.queue.put(rx_data, timeout=0.1, block=True)
+        try:
             rx_data = self.read(1024)
+            while rx_data:
+                rxlog.debug("rxdata: %s", rx_data)
+                if self.capture is not None:
+                    self.capture.rx(rx_data)
+                self.queue.put(rx_data, timeout=0.1, block=True)
+                rx_data = self.read(1024)
+        except serial.SerialException as e:     # port is gone, e.g. device unplugged, send fails with it too
+            if self.reader.period:
+                rxlog.error("%s: reader stopped: %s", self.port, e)
+            self.reader.period = 0
         if self.queue.qsize() > 0:
             self.data_ready_sig()
 
@@ -74,6 +82,8 @@ class SerialConnection(serial.Serial):
         serial.Serial.close(self)
 
     def send(self, data):
+        if self.capture is not None:
+            self.capture.tx(data)
         self.write(data)
 
 
@@ -0,0 +1,6 @@
+"""
+author: Rafal Miecznik
+contact: ravmiecznk@gmail.com
+"""
+
+from wire_capture.wire_capture import WireCapture, CaptureRecord, read_capture, RX, TX
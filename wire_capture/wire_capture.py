@@ -0,0 +1,166 @@
+"""
+author: Rafal Miecznik
+contact: ravmiecznk@gmail.com
+
+Binary capture of raw serial traffic in both directions.
+
+File format (little endian):
+ MAGIC VERSION WALL_CLOCK_NS MONOTONIC_NS      header, both clocks taken at file creation
+ 6     1       8             8
+ TSTAMP_NS DIRECTION LENGTH DATA               record, one per received chunk or sent message
+ 8         1         4      ?bytes
+TSTAMP_NS is time.monotonic_ns(), wall clock time of record: WALL_CLOCK_NS + TSTAMP_NS - MONOTONIC_NS
+
+With max_bytes capture is kept as ring of two files: when <path> reaches max_bytes/2 it is renamed
+to <path>.1 (older one is dropped) and new <path> is started, so about max_bytes of the most recent traffic
+is retained. read_capture(path) reads both in order.
+"""
+
+import os
+import time
+import struct
+import threading
+from collections import namedtuple
+
+
+MAGIC = b'RFLCAP'
+VERSION = 1
+HEADER = struct.Struct('<6sBQQ')
+RECORD = struct.Struct('<QBI')
+RX = 0
+TX = 1
+BUFFER_SIZE = 64*1024
+OLD_SEGMENT_EXT = '.1'
+
+
+class CaptureFormatError(Exception):
+    pass
+
+
+CaptureRecord = namedtuple('CaptureRecord', 'tstamp_ns direction data')
+
+
+class WireCapture(object):
+    """
+        capture = WireCapture('ttyUSB0.cap', max_bytes=16*1024*1024)
+        SerialConnection(port='/dev/ttyUSB0', capture=capture, ...)
+        ...
+        capture.close()
+        for record in read_capture('ttyUSB0.cap'):
+            ...
+    """
+    def __init__(self, path, max_bytes=None, buffer_size=BUFFER_SIZE):
+        """
+        :param max_bytes: ring retention limit of both files together, no limit if None
+        :param buffer_size: records are written to file when buffer is full, on flush and on close
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.buffer_size = buffer_size
+        self.records = 0
+        self.lock = threading.Lock()
+        self.__file = None
+        self.__size = 0
+        self.__open()
+
+    def __open(self):
+        self.__file = open(self.path, 'wb', buffering=self.buffer_size)
+        self.__size = self.__file.write(HEADER.pack(MAGIC, VERSION, time.time_ns(), time.monotonic_ns()))
+
+    def __rollover(self):
+        self.__file.close()
+        os.replace(self.path, self.path + OLD_SEGMENT_EXT)
+        self.__open()
+
+    def record(self, direction, data):
+        tstamp = time.monotonic_ns()
+        with self.lock:
+            if self.__file is None:
+                return
+            if self.max_bytes is not None and self.__size + RECORD.size + len(data) > self.max_bytes//2:
+                self.__rollover()
+            self.__file.write(RECORD.pack(tstamp, direction, len(data)))
+            self.__file.write(data)
+            self.__size += RECORD.size + len(data)
+            self.records += 1
+
+    def rx(self, data):
+        self.record(RX, data)
+
+    def tx(self, data):
+        self.record(TX, data)
+
+    def flush(self):
+        with self.lock:
+            if self.__file is not None:
+                self.__file.flush()
+
+    def close(self):
+        with self.lock:
+            if self.__file is not None:
+                self.__file.close()
+                self.__file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __repr__(self):
+        return "{}({}, records: {})".format(type(self).__name__, self.path, self.records)
+
+
+def read_capture_file(path):
+    """
+    Iterate records of single capture file, incomplete last record (capture not closed) is ignored
+    :return: generator of CaptureRecord
+    """
+    with open(path, 'rb') as f:
+        header = f.read(HEADER.size)
+        if len(header) < HEADER.size or header[:len(MAGIC)] != MAGIC:
+            raise CaptureFormatError("{}: not a wire capture file".format(path))
+        version = HEADER.unpack(header)[1]
+        if version != VERSION:
+            raise CaptureFormatError("{}: unsupported version {}".format(path, version))
+        while True:
+            record = f.read(RECORD.size)
+            if len(record) < RECORD.size:
+                return
+            tstamp, direction, length = RECORD.unpack(record)
+            data = f.read(length)
+            if len(data) < length:
+                return
+            yield CaptureRecord(tstamp, direction, data)
+
+
+def read_capture(path):
+    """
+    Iterate records of capture, including older ring segment if present
+    :return: generator of CaptureRecord
+    """
+    if os.path.isfile(path + OLD_SEGMENT_EXT):
+        for record in read_capture_file(path + OLD_SEGMENT_EXT):
+            yield record
+    for record in read_capture_file(path):
+        yield record
+
+
+def capture_start(path):
+    """
+    :return: tuple(wall clock ns, monotonic ns) of capture file creation
+    """
+    with open(path, 'rb') as f:
+        _, _, wall_ns, monotonic_ns = HEADER.unpack(f.read(HEADER.size))
+    return wall_ns, monotonic_ns
+
+
+if __name__ == "__main__":
+    # dump capture:  python -m wire_capture.wire_capture ttyUSB0.cap
+    import sys
+
+    t0 = None
+    for rec in read_capture(sys.argv[1]):
+        t0 = rec.tstamp_ns if t0 is None else t0
+        print("{:12.6f} {} {:5d} {}".format((rec.tstamp_ns - t0)/1e9, 'tx' if rec.direction == TX else 'rx',
+                                              len(rec.data), rec.data[:64].hex()))
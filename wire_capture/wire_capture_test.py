@@ -0,0 +1,39 @@
+"""
+author: Rafal Miecznik
+contact: ravmiecznk@gmail.com
+"""
+
+import os
+
+from wire_capture import WireCapture, read_capture, RX, TX
+
+
+def test_records_roundtrip(tmpdir):
+    path = str(tmpdir.join('port.cap'))
+    with WireCapture(path) as capture:
+        capture.tx(b'>request')
+        capture.rx(b'response<')
+        capture.rx(b'')
+    records = list(read_capture(path))
+    assert [(r.direction, r.data) for r in records] == [(TX, b'>request'), (RX, b'response<'), (RX, b'')]
+    assert records[0].tstamp_ns <= records[1].tstamp_ns <= records[2].tstamp_ns
+
+
+def test_ring_retention(tmpdir):
+    path = str(tmpdir.join('port.cap'))
+    with WireCapture(path, max_bytes=2000) as capture:
+        for i in range(100):
+            capture.rx(bytes([i])*50)
+    assert os.path.getsize(path) + os.path.getsize(path + '.1') <= 2000
+    data = [r.data[0] for r in read_capture(path)]
+    assert data == list(range(data[0], 100)) and len(data) > 20
+
+
+def test_incomplete_record_ignored(tmpdir):
+    path = str(tmpdir.join('port.cap'))
+    with WireCapture(path) as capture:
+        capture.rx(b'complete')
+        capture.rx(b'cut off')
+    with open(path, 'rb+') as f:
+        f.truncate(os.path.getsize(path) - 3)
+    assert [r.data for r in read_capture(path)] == [b'complete']
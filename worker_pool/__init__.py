@@ -0,0 +1,6 @@
+"""
+author: Rafal Miecznik
+contact: ravmiecznk@gmail.com
+"""
+
+from worker_pool.worker_pool import PooledCall, Worker, ResultTimeout, worker_pool
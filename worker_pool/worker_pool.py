@@ -0,0 +1,175 @@
+"""
+author: Rafal Miecznik
+contact: ravmiecznk@gmail.com
+
+Persistent threads for background jobs, no thread is created per call:
+    PooledCall  - one shot job run by shared pool of BACKGROUND_WORKERS long lived threads
+    Worker      - own long lived thread running one target each time it is started, e.g. rx data handling
+                  of a connection. Starts coming while target runs are coalesced into one more run.
+Both have GuiThread like API: start(), returned(), get_result(timeout), kill().
+"""
+
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+from config import thread_logger as t_logger
+
+
+BACKGROUND_WORKERS = 8
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+class ResultTimeout(Exception):
+    pass
+
+
+def worker_pool():
+    """
+    :return: shared ThreadPoolExecutor, threads are started on demand and live until exit
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=BACKGROUND_WORKERS, thread_name_prefix="worker")
+        return _pool
+
+
+class PooledCall(object):
+    def __init__(self, process, args=(), kwargs=None, delay=None, action_when_done=None):
+        self.target = process
+        self.args = args
+        self.kwargs = kwargs if kwargs is not None else {}
+        self.delay = delay
+        self.action_when_done = action_when_done
+        self.result = None
+        self.future = None
+        self.__lock = threading.Lock()
+
+    def __run(self):
+        if self.delay:
+            time.sleep(self.delay)
+        try:
+            self.result = self.target(*self.args, **self.kwargs)
+        except Exception:
+            t_logger.exception("%s failed", self)
+            raise
+        if self.action_when_done:
+            self.action_when_done()
+        return self.result
+
+    def start(self):
+        """
+        Submit call to worker pool, does nothing while previous call is still pending or running
+        (same as QThread.start() of GuiThread)
+        """
+        with self.__lock:
+            if self.running():
+                return self
+            self.result = None
+            self.future = worker_pool().submit(self.__run)
+        return self
+
+    def running(self):
+        """
+        :return: True when call is pending or running
+        """
+        return self.future is not None and not self.future.done()
+
+    def returned(self):
+        return self.result
+
+    def get_result(self, timeout=1):
+        """
+        Wait for return value of the call
+        :param timeout: None - wait as long as it takes
+        """
+        try:
+            return self.future.result(timeout)
+        except TimeoutError:
+            raise ResultTimeout("No result from: {}".format(self.target.__name__))
+
+    def kill(self):
+        """
+        Cancel call if it did not start yet
+        """
+        if self.future is not None:
+            self.future.cancel()
+
+    def __repr__(self):
+        return "{}({})".format(type(self).__name__, getattr(self.target, '__name__', self.target))
+
+
+class Worker(object):
+    def __init__(self, process, args=(), kwargs=None, name=None):
+        self.target = process
+        self.args = args
+        self.kwargs = kwargs if kwargs is not None else {}
+        self.name = name if name is not None else "worker_{}".format(getattr(process, '__name__', 'job'))
+        self.result = None
+        self.runs = 0
+        self.__wake = threading.Event()
+        self.__done = threading.Condition()
+        self.__killed = False
+        self.__running = False
+        self.__thread = None
+        self.__lock = threading.Lock()
+
+    def __loop(self):
+        while True:
+            self.__wake.wait()
+            if self.__killed:
+                return
+            with self.__done:
+                self.__running = True
+            self.__wake.clear()     # before call: start during the call means one more run
+            try:
+                self.result = self.target(*self.args, **self.kwargs)
+            except Exception:
+                t_logger.exception("%s failed", self)
+            with self.__done:
+                self.__running = False
+                self.runs += 1
+                self.__done.notify_all()
+
+    def idle(self):
+        return not self.__running and not self.__wake.is_set()
+
+    def start(self):
+        """
+        Wake worker thread up (it is started on first call)
+        """
+        with self.__lock:
+            if self.__killed:
+                return self
+            if self.__thread is None:
+                self.__thread = threading.Thread(target=self.__loop, name=self.name, daemon=True)
+                self.__thread.start()
+        self.__wake.set()
+        return self
+
+    def returned(self):
+        return self.result
+
+    def get_result(self, timeout=1):
+        """
+        Wait until requested runs are done
+        """
+        with self.__done:
+            if not self.__done.wait_for(lambda: self.runs and self.idle(), timeout):
+                raise ResultTimeout("No result from: {}".format(self.name))
+        return self.result
+
+    def kill(self, timeout=1):
+        self.__killed = True
+        self.__wake.set()
+        if self.__thread is not None and self.__thread is not threading.current_thread():
+            self.__thread.join(timeout)
+
+    def is_alive(self):
+        return self.__thread is not None and self.__thread.is_alive()
+
+    def __repr__(self):
+        return "{}({}, runs: {})".format(type(self).__name__, self.name, self.runs)
@@ -0,0 +1,76 @@
+"""
+author: Rafal Miecznik
+contact: ravmiecznk@gmail.com
+"""
+
+import time
+import threading
+
+import pytest
+
+from worker_pool import PooledCall, Worker, ResultTimeout
+
+
+def test_pooled_call_reuses_threads():
+    names = set()
+
+    def job(x):
+        names.add(threading.current_thread().name)
+        return x*2
+
+    calls = [PooledCall(job, args=(i,)).start() for i in range(50)]
+    assert [call.get_result() for call in calls] == [i*2 for i in range(50)]
+    assert len(names) <= 8
+    threads = threading.active_count()
+    PooledCall(job, args=(1,)).start().get_result()
+    assert threading.active_count() <= threads
+
+
+def test_pooled_call_timeout():
+    call = PooledCall(time.sleep, args=(0.2,)).start()
+    with pytest.raises(ResultTimeout):
+        call.get_result(timeout=0.01)
+
+
+def test_pooled_call_start_while_running_is_ignored():
+    release = threading.Event()
+    runs = []
+
+    def reflash():
+        runs.append(1)
+        release.wait(1)
+        return len(runs)
+
+    call = PooledCall(reflash)
+    call.start()
+    first = call.future
+    call.start()                # e.g. double click on REFLASH
+    assert call.future is first
+    release.set()
+    assert call.get_result() == 1
+    assert runs == [1]
+    assert call.start().get_result() == 2     # done call can be started again
+
+
+def test_worker_coalesces_starts():
+    started = threading.Event()
+    release = threading.Event()
+    runs = []
+
+    def rx_data():
+        runs.append(threading.current_thread().name)
+        started.set()
+        release.wait(1)
+
+    worker = Worker(rx_data)
+    worker.start()
+    started.wait(1)
+    for _ in range(10):         # while target runs: one more run
+        worker.start()
+    release.set()
+    worker.get_result()
+    assert len(runs) == 2 and len(set(runs)) == 1
+    worker.start().get_result()
+    assert len(runs) == 3
+    worker.kill()
+    assert not worker.is_alive()